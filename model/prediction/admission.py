@@ -0,0 +1,117 @@
+import asyncio
+import json
+import math
+from collections import deque
+from typing import Iterable, Optional, Sequence
+
+
+class PriorityClass:
+    """
+    Admission limit for a group of endpoints.
+
+    At most `max_concurrent` requests run at once; up to `queue_size` more
+    wait, in arrival order, for at most `queue_timeout` seconds (None: no
+    limit). Requests beyond the queue, or that waited too long, are rejected.
+    The middleware runs on the event loop, so the counters need no lock.
+    """
+
+    def __init__(self, name: str, paths: Iterable[str], max_concurrent: int, queue_size: int = 0,
+                 queue_timeout: Optional[float] = None):
+        self.name = name
+        self.paths = frozenset(paths)
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot, waiting in the queue if needed; returns the reason ('queue_full', 'timeout') if rejected."""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.queue_size:
+            return 'queue_full'
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # Since Python 3.12 wait_for can time out after the slot was handed over
+            self._give_back(waiter)
+            return 'timeout'
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as the client went away
+            self._give_back(waiter)
+            raise
+        return None
+
+    def _give_back(self, waiter: asyncio.Future) -> None:
+        """Release the slot `waiter` was handed, or leave the queue if it got none."""
+        if waiter.done() and not waiter.cancelled():
+            self.release()
+        else:
+            self._discard(waiter)
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self) -> None:
+        """Hand the slot to the oldest waiting request, or free it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionMiddleware:
+    """
+    Load shedding for the endpoints listed in `classes`.
+
+    Each priority class has its own concurrency limit and queue, so a burst
+    of predictions cannot hold the slots (or the worker threads) the read
+    endpoints need. A request that cannot be admitted gets an immediate 503
+    with `Retry-After` instead of waiting behind an unbounded backlog; paths
+    outside every class (such as /health) are never held back.
+    """
+
+    def __init__(self, app, classes: Sequence[PriorityClass], retry_after: float = 1.0, rejected=None):
+        self.app = app
+        self.classes = {path: priority for priority in classes for path in priority.paths}
+        self.retry_after = str(max(1, math.ceil(retry_after))).encode('latin-1')
+        self.rejected = rejected
+
+    async def __call__(self, scope, receive, send):
+        priority = self.classes.get(scope['path']) if scope['type'] == 'http' else None
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+        reason = await priority.acquire()
+        if reason is not None:
+            if self.rejected is not None:
+                self.rejected.labels(priority.name, reason).inc()
+            await self._reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            priority.release()
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": "El servicio está sobrecargado; vuelva a intentarlo más tarde."},
+                          ensure_ascii=False).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 503, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'retry-after', self.retry_after),
+        ]})
+        await send({'type': 'http.response.body', 'body': body})
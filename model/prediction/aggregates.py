@@ -0,0 +1,186 @@
+import heapq
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .rollups import MAX_ESTADOS, BucketRings, timestamp_to_micros
+from .storage import PredictionStore
+
+
+class PredictionAggregates:
+    """
+    In-process summary of the prediction history.
+
+    Keeps per-estado counters, the `top_k` most recent records (a bounded
+    min-heap on timestamp), the latest record and per-minute/hour/day
+    rollups. It is rebuilt once from storage at startup and then updated on
+    every saved prediction, so the read endpoints answer in O(1)/O(k) (or
+    O(buckets) for time series) whatever the history size.
+    """
+
+    def __init__(self, top_k: int = 5):
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        # Entries are (timestamp, -seq, record): among equal timestamps the
+        # earliest stored record ranks first, like a stable sort would
+        self._recent: list = []
+        self._latest = None
+        self._seq = 0
+        self._version = 0
+        # Distinguishes this process's versions from those of a previous run or another worker
+        self._epoch = random.getrandbits(62)
+        self._modified = time.time()
+        self._rings_buffer = bytearray(8 * BucketRings.slots())
+        self._rings = BucketRings(memoryview(self._rings_buffer).cast('q'))
+        self._estado_names: List[str] = []
+        self._estado_index: Dict[str, int] = {}
+
+    @property
+    def version(self) -> int:
+        """Increases every time the aggregates change; used to invalidate derived caches."""
+        return self._version
+
+    @property
+    def epoch(self) -> int:
+        """Random token that, together with `version`, identifies the state across restarts."""
+        return self._epoch
+
+    @property
+    def modified(self) -> float:
+        """Unix time of the last change."""
+        return self._modified
+
+    def rebuild(self, records: Iterable[Dict[str, str]], state: Optional[Dict[str, Any]] = None) -> None:
+        """Reset the state (to an export() `state`, if given) and fold in `records` (in storage order)."""
+        with self._lock:
+            self._counts = Counter()
+            self._recent = []
+            self._latest = None
+            self._seq = 0
+            self._version += 1
+            self._modified = time.time()
+            self._rings_buffer[:] = bytes(len(self._rings_buffer))
+            if state is not None:
+                self._restore(state)
+            for record in records:
+                self._add(record)
+
+    def load(self, store: PredictionStore, snapshot: Optional[Dict[str, Any]] = None) -> None:
+        """Rebuild from every record in `store`, or from a snapshot's state and the records after its position."""
+        if snapshot is None:
+            self.rebuild(store.iter_records())
+        else:
+            self.rebuild((record for _, record in store.iter_from(snapshot['position'])), snapshot['aggregates'])
+
+    def export(self) -> Dict[str, Any]:
+        """The whole state as JSON-serializable data, for a snapshot."""
+        with self._lock:
+            names = list(self._estado_names)
+            return {
+                "seq": self._seq,
+                "counts": dict(self._counts),
+                "recent": [[-negative_seq, record] for _, negative_seq, record in sorted(self._recent, key=lambda e: e[:2])],
+                "rollups": {
+                    granularity: [[start, {names[i]: count for i, count in enumerate(counts) if count}]
+                                  for start, counts in buckets]
+                    for granularity, buckets in self._rings.export().items()
+                },
+            }
+
+    def _restore(self, state: Dict[str, Any]) -> None:
+        for estado, count in state['counts'].items():
+            self._counts[estado] += count
+        for granularity, buckets in state['rollups'].items():
+            self._rings.restore(granularity, [
+                (start, {self._index(estado): count for estado, count in counts.items()}) for start, counts in buckets
+            ])
+        for seq, record in state['recent']:
+            self._seq = seq
+            self._push_recent(record)
+        self._seq = state['seq']
+
+    def commit(self, store: PredictionStore, records: List[Dict[str, str]]) -> None:
+        """Append `records` to the store, then fold them in."""
+        store.append_many(records)
+        self.add_many(records)
+
+    def add(self, record: Dict[str, str]) -> None:
+        """Fold a newly saved record into the aggregates."""
+        with self._lock:
+            self._add(record)
+            self._version += 1
+            self._modified = time.time()
+
+    def add_many(self, records: Iterable[Dict[str, str]]) -> None:
+        """Fold in a batch of saved records; counters and rollups are updated once per (timestamp, estado)."""
+        records = list(records)
+        with self._lock:
+            for (timestamp, estado), count in Counter((r['timestamp'], r['estado']) for r in records).items():
+                self._count(timestamp, estado, count)
+            for record in records:
+                self._push_recent(record)
+            self._version += 1
+            self._modified = time.time()
+
+    def touch(self) -> None:
+        """Bump the version after a change the aggregates do not track, such as a compaction."""
+        with self._lock:
+            self._version += 1
+            self._modified = time.time()
+
+    def _add(self, record: Dict[str, str]) -> None:
+        self._count(record['timestamp'], record['estado'], 1)
+        self._push_recent(record)
+
+    def _count(self, timestamp: str, estado: str, count: int) -> None:
+        self._counts[estado] += count
+        self._rings.add(timestamp_to_micros(timestamp), self._index(estado), count)
+
+    def _index(self, estado: str) -> int:
+        index = self._estado_index.get(estado)
+        if index is None:
+            if len(self._estado_names) >= MAX_ESTADOS:
+                raise ValueError(f"Demasiados estados distintos para los rollups: '{estado}'")
+            index = self._estado_index[estado] = len(self._estado_names)
+            self._estado_names.append(estado)
+        return index
+
+    def _push_recent(self, record: Dict[str, str]) -> None:
+        entry = (record['timestamp'], -self._seq, record)
+        self._seq += 1
+        if len(self._recent) < self.top_k:
+            heapq.heappush(self._recent, entry)
+        elif entry[:2] > self._recent[0][:2]:
+            heapq.heapreplace(self._recent, entry)
+        if self._latest is None or entry[:2] > self._latest[:2]:
+            self._latest = entry
+
+    def counts(self) -> Dict[str, int]:
+        """Number of predictions per estado."""
+        with self._lock:
+            return dict(self._counts)
+
+    def last(self, n: Optional[int] = None) -> List[Dict[str, str]]:
+        """The `n` (at most top_k) most recent records, newest first."""
+        with self._lock:
+            entries = sorted(self._recent, key=lambda e: e[:2], reverse=True)
+        return [entry[2] for entry in entries[:n]]
+
+    def latest(self) -> Optional[Dict[str, str]]:
+        """The most recent record, or None if nothing has been saved yet."""
+        with self._lock:
+            return self._latest[2] if self._latest is not None else None
+
+    def timeseries(self, granularity: str, since_micros: int, until_micros: int) -> List[Tuple[int, Dict[str, int]]]:
+        """Per-estado counts of the non-empty `granularity` buckets in [since, until), oldest first."""
+        with self._lock:
+            buckets = self._rings.query(granularity, since_micros, until_micros)
+            names = list(self._estado_names)
+        return [(start, {names[i]: count for i, count in enumerate(counts) if count}) for start, counts in buckets]
+
+    def rollup_window(self, granularity: str) -> int:
+        """Retained history of `granularity`, in microseconds."""
+        return self._rings.window(granularity)
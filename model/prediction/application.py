@@ -1,32 +1,195 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Body, FastAPI, File, Header, HTTPException, Query, Request, UploadFile
+from contextlib import asynccontextmanager
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from typing import Literal
-import pandas as pd
 import json
-import random
 import os
+import time
 from datetime import datetime
 import pytz
 from pydantic import BaseModel
-from collections import Counter
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Annotated, Tuple, Union
 import base64  # Standard library module, no external installation required
+import hmac
+import codecs
+import csv
+from concurrent.futures import Future
+import anyio.to_thread
+from .admission import AdmissionMiddleware, PriorityClass
+from .compaction import CompactionThread, compact, count_by_estado as count_with_compacted, load_aggregates
+from .conditional import ConditionalGetMiddleware
+from .drift import DriftMonitor, drift_report, merge, reference_histograms
+from .events import EventBroadcaster, format_event
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry
+from .profiling import ProfilingMiddleware
+from .rule_registry import RuleRegistry
+from .rules import RuleEngine
+from .sampling import EstadoSampler
+from .storage import open_store
+from .aggregates import PredictionAggregates
+from .rollups import micros_to_timestamp, timestamp_to_micros
+from .shared_state import SHARED_STATE_FILENAME, SharedAggregates
+from .settings import PREDICTION_DIR, Settings
+from .writer import WriteBehindQueue, WriteQueueFull
+
+# Worker threads kept for the endpoints outside the admission classes (/metrics, the rules admin)
+_UNLIMITED_THREADS = 8
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Rebuild the in-memory aggregates from storage once, at startup (from the
+    last snapshot plus the records written after it, when there is one), and
+    run the writer thread, the shadow rule evaluation and the periodic
+    compaction. On shutdown the write queue is drained before the process
+    exits.
+    """
+    global write_queue
+    if settings.admission_max_concurrent > 0:
+        # Sync endpoints run in anyio's thread pool: make room for both admission classes plus the
+        # unlimited endpoints, so that admitted reads never wait for a thread held by a prediction
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        limiter.total_tokens = max(limiter.total_tokens, settings.admission_max_concurrent
+                                   + settings.admission_read_max_concurrent + _UNLIMITED_THREADS)
+    started = time.perf_counter()
+    load_aggregates(aggregates, prediction_store)
+    _time_load.observe(time.perf_counter() - started)
+    compaction = None
+    if settings.compaction_interval_minutes > 0:
+        compaction = CompactionThread(compact_history, settings.compaction_interval_minutes * 60)
+        compaction.start()
+    broadcaster.start(asyncio.get_running_loop())
+    watcher = asyncio.create_task(watch_shared_version(settings.events_poll_ms / 1000)) if settings.multiprocess else None
+    rules_watcher = asyncio.create_task(watch_rules(settings.events_poll_ms / 1000)) if settings.multiprocess else None
+    rule_registry.start()
+    # Handlers never write to storage on the event loop: in 'sync' mode each request waits for its own
+    # commit (requests arriving together share one), without the batching delay or the extra fsyncs
+    write_behind = settings.write_mode == 'write_behind'
+    write_queue = WriteBehindQueue(
+        prediction_store,
+        commit=commit_predictions,
+        max_queue=settings.write_queue_size,
+        max_batch=settings.write_batch_size,
+        max_delay=settings.write_batch_delay_ms / 1000 if write_behind else 0,
+        fsync=settings.fsync if write_behind else 'never',
+        fsync_interval=settings.fsync_interval_ms / 1000,
+    )
+    write_queue.start()
+    try:
+        yield
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if rules_watcher is not None:
+            rules_watcher.cancel()
+        if compaction is not None:
+            compaction.close()
+        rule_registry.close()
+        broadcaster.close()
+        if write_queue is not None:
+            write_queue.close()
+            write_queue = None
+
+settings = Settings.from_env()
+
+def create_metrics(settings: Settings) -> MetricsRegistry:
+    """Prometheus metrics; with PREDICTION_MULTIPROCESS each worker writes its own file and /metrics sums them."""
+    directory = settings.metrics_dir or (os.path.join(settings.data_dir, 'metrics') if settings.multiprocess else None)
+    return MetricsRegistry(directory)
+
+metrics = create_metrics(settings)
+http_requests = metrics.counter(
+    'prediction_http_requests_total', 'Peticiones HTTP por método, ruta y código de estado.',
+    ['method', 'route', 'status'])
+http_request_seconds = metrics.histogram(
+    'prediction_http_request_duration_seconds', 'Latencia de las peticiones HTTP por método y ruta.',
+    ['method', 'route'])
+operation_seconds = metrics.histogram(
+    'prediction_operation_duration_seconds', 'Duración de la evaluación de reglas y de las lecturas y escrituras del almacén.',
+    ['operation'])
+# Children resolved once so that the hot path only pays for the observation
+_time_classify = operation_seconds.labels('classify')
+_time_sample = operation_seconds.labels('sample')
+_time_commit = operation_seconds.labels('store_commit')
+_time_query = operation_seconds.labels('store_query')
+_time_count = operation_seconds.labels('store_count')
+_time_load = operation_seconds.labels('store_load')
+_time_score_batch = operation_seconds.labels('score_batch')
+_time_report = operation_seconds.labels('report_build')
+shadow_evaluations = metrics.counter(
+    'prediction_shadow_evaluations_total', 'Clasificaciones de las versiones de reglas en sombra, por coincidencia con la activa.',
+    ['version', 'result'])
+admission_rejected = metrics.counter(
+    'prediction_admission_rejected_total', 'Peticiones rechazadas con 503 por el control de admisión, por clase y motivo.',
+    ['priority', 'reason'])
 
 app = FastAPI(
     title="Predicción de Estado de Salud",
     description="API para predecir el estado de salud basado en edad, sexo e índice arterial, con reportes en Base64.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+def cache_validators():
+    """(ETag, Last-Modified time) of the read endpoints: every commit bumps the aggregates version."""
+    return f'W/"{aggregates.epoch:x}-{aggregates.version}"', aggregates.modified
+
+# Opt-in profiler, innermost so that profiles show the endpoint rather than the other middlewares
+if settings.profile_token or settings.profile_sample_rate > 0:
+    app.add_middleware(
+        ProfilingMiddleware,
+        directory=settings.profile_dir or os.path.join(settings.data_dir, 'profiles'),
+        token=settings.profile_token,
+        sample_rate=settings.profile_sample_rate,
+        max_concurrent=settings.profile_max_concurrent,
+        interval=settings.profile_interval_ms / 1000,
+        # The event stream would hold a profiling slot for as long as the client stays connected
+        exclude=["/events"],
+    )
+
+# Conditional GETs are answered from the aggregates version, before the endpoint runs
+# (added before CORS so that 304 answers still get the CORS headers)
+app.add_middleware(
+    ConditionalGetMiddleware,
+    paths=["/prediction_counts", "/last_predictions", "/last_prediction_date", "/last_prediction",
+           "/getReport", "/getReport/raw"],
+    validators=cache_validators,
 )
 
+# Admission control, inside CORS so that browsers can read the 503 answers
+if settings.admission_max_concurrent > 0:
+    queue_timeout = settings.admission_queue_timeout_ms / 1000 if settings.admission_queue_timeout_ms > 0 else None
+    app.add_middleware(
+        AdmissionMiddleware,
+        classes=[
+            PriorityClass('predict', ["/getprediction", "/getpredictions", "/getpredictions/csv"],
+                          settings.admission_max_concurrent, settings.admission_queue_size, queue_timeout),
+            # /health, /metrics, /events and the admin endpoints are never held back
+            PriorityClass('read', ["/prediction_counts", "/prediction_counts/timeseries", "/last_predictions",
+                                   "/last_prediction_date", "/last_prediction", "/getReport", "/getReport/raw",
+                                   "/drift", "/rules", "/export"],
+                          settings.admission_read_max_concurrent, settings.admission_queue_size, queue_timeout),
+        ],
+        retry_after=settings.admission_retry_after_seconds,
+        rejected=admission_rejected,
+    )
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
-    allow_methods=["GET"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],
 )
 
+# Added last, so it is the outermost middleware and its latency includes the others
+app.add_middleware(MetricsMiddleware, requests=http_requests, latency=http_request_seconds, routes=app.router.routes)
+
 # Define response models
 class PredictionResponse(BaseModel):
     estado: str
@@ -43,6 +206,29 @@ class LastPredictionResponse(BaseModel):
     
 class HealthResponse(BaseModel):
     status: str
+
+class TimeseriesBucket(BaseModel):
+    start: str
+    counts: Dict[str, int]
+
+class TimeseriesResponse(BaseModel):
+    bucket: str
+    buckets: List[TimeseriesBucket]
+
+class BatchPredictionRequest(BaseModel):
+    """Patients as parallel columns; values are validated per row, not by the model."""
+    age: List[Any]
+    sex: List[Any]
+    arterialIndex: List[Any]
+
+class BatchPredictionItem(BaseModel):
+    estado: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchPredictionResponse(BaseModel):
+    timestamp: str
+    predictions: List[BatchPredictionItem]
+    errors: int
     
 def load_conditions(json_path: str) -> dict:
     """Load health condition rules from a JSON file."""
@@ -54,38 +240,228 @@ def load_conditions(json_path: str) -> dict:
     except json.JSONDecodeError:
         raise HTTPException(status_code=500, detail="Formato de JSON inválido en conditions.json.")
 
-def save_prediction(estado: str, file_index: int):
-    """Save prediction with timestamp to one of three JSON files."""
+CONDITIONS_PATH = os.path.join(PREDICTION_DIR, 'conditions.json')
+MODEL_PATH = os.path.join(PREDICTION_DIR, 'model.csv')
+
+def count_shadow_results(version: str, agreed: int, disagreed: int):
+    """Export the shadow comparisons of a rule version to /metrics."""
+    if agreed:
+        shadow_evaluations.labels(version, 'agree').inc(agreed)
+    if disagreed:
+        shadow_evaluations.labels(version, 'disagree').inc(disagreed)
+
+def create_rule_registry(settings: Settings) -> RuleRegistry:
+    """
+    Rule set versions, with conditions.json as 'default'.
+
+    Every version is compiled once, when it is added or first selected;
+    classification never touches the disk. PREDICTION_RULES_ACTIVE and
+    PREDICTION_RULES_SHADOW override the selection saved by /rules.
+    """
+    registry = RuleRegistry(settings.rules_dir or os.path.join(settings.data_dir, 'rules'),
+                            load_conditions(CONDITIONS_PATH), on_result=count_shadow_results)
+    if settings.rules_active and settings.rules_active != registry.active[0]:
+        registry.activate(settings.rules_active)
+    shadows = [version.strip() for version in settings.rules_shadow.split(',') if version.strip()]
+    if shadows and shadows != registry.shadow_versions:
+        registry.set_shadows(shadows)
+    return registry
+
+rule_registry = create_rule_registry(settings)
+
+def load_sampler(csv_path: str) -> EstadoSampler:
+    """Build the per-estado sampling table from model.csv (read with the csv module, no pandas)."""
+    try:
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            return EstadoSampler(row['estado'] for row in csv.DictReader(f))
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Archivo model.csv no encontrado.")
+
+estado_sampler = load_sampler(MODEL_PATH)
+
+def load_reference(csv_path: str):
+    """Per-sex age and arterialIndex histograms of the model.csv rows, the reference of /drift."""
+    rows = []
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            try:
+                rows.append((int(row['ege']), row['sex'], int(row['arterialIndex'])))
+            except (KeyError, TypeError, ValueError):
+                continue
+    return reference_histograms(rows)
+
+model_reference = load_reference(MODEL_PATH)
+
+def create_drift_monitor(settings: Settings) -> DriftMonitor:
+    """Input histograms fed by every prediction; with PREDICTION_MULTIPROCESS /drift sums all workers."""
+    directory = settings.drift_dir or (os.path.join(settings.data_dir, 'drift') if settings.multiprocess else None)
+    return DriftMonitor(settings.drift_window_minutes * 60, settings.drift_windows, directory)
+
+drift_monitor = create_drift_monitor(settings)
+
+# Predictions go to the store selected by PREDICTION_STORE; run `python -m prediction.storage migrate`
+# once to import the legacy predictions_{1,2,3}.json files
+prediction_store = open_store(settings.store, settings.data_dir)
+
+def compact_history():
+    """
+    Snapshot the aggregates and fold the records beyond PREDICTION_RETAIN_RECORDS/DAYS into hourly totals.
+
+    Filtered counts over the compacted range lose their sub-hour resolution,
+    so the aggregates version is bumped and cached ETags stop matching.
+    """
+    result = compact(prediction_store, settings.retain_records, settings.retain_days * 86400, top_k=aggregates.top_k)
+    if result['removed']:
+        aggregates.touch()
+    return result
+
+def create_aggregates(settings: Settings):
+    """
+    Counters, last predictions and latest record, kept up to date by save_prediction.
+
+    With PREDICTION_MULTIPROCESS every worker maps the same file, so the read
+    endpoints give the same answer whichever worker serves them.
+    """
+    if settings.multiprocess:
+        path = settings.shared_state_path or os.path.join(settings.data_dir, SHARED_STATE_FILENAME)
+        return SharedAggregates(path, top_k=5)
+    return PredictionAggregates(top_k=5)
+
+aggregates = create_aggregates(settings)
+
+# Writer thread that commits every prediction, started by the lifespan
+write_queue = None
+
+# Live updates for /events subscribers
+broadcaster = EventBroadcaster(max_queue=settings.events_queue_size)
+MAX_EVENT_PREDICTIONS = 100
+# Aggregates version last announced to subscribers
+_published_version = None
+
+def _event_prediction(record: Optional[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """The estado and timestamp of a record; the patient inputs are not broadcast."""
+    return {"estado": record['estado'], "timestamp": record['timestamp']} if record is not None else None
+
+def snapshot_event() -> str:
+    """Current counters and last predictions, sent on connect and to resynchronize a subscriber."""
+    return format_event('snapshot', {
+        "version": aggregates.version,
+        "counts": aggregates.counts(),
+        "last_predictions": [_event_prediction(r) for r in aggregates.last()],
+        "latest": _event_prediction(aggregates.latest()),
+    })
+
+def commit_predictions(records: List[Dict[str, str]]):
+    """
+    Append records to the store, fold them into the aggregates and announce
+    them to /events subscribers (one message per commit, serialized once).
+    """
+    global _published_version
+    started = time.perf_counter()
+    aggregates.commit(prediction_store, records)
+    _time_commit.observe(time.perf_counter() - started)
+    if broadcaster.subscriber_count:
+        _published_version = aggregates.version
+        broadcaster.publish(format_event('prediction', {
+            "version": _published_version,
+            "counts": aggregates.counts(),
+            "count": len(records),
+            # Newest first, like /last_predictions
+            "predictions": [_event_prediction(r) for r in records[::-1][:MAX_EVENT_PREDICTIONS]],
+        }))
+
+async def watch_rules(interval: float):
+    """With PREDICTION_MULTIPROCESS, apply rule versions activated or shadowed through another worker."""
+    while True:
+        await asyncio.sleep(interval)
+        rule_registry.reload()
+
+async def watch_shared_version(interval: float):
+    """With PREDICTION_MULTIPROCESS, send a snapshot when other workers commit predictions."""
+    global _published_version
+    while True:
+        await asyncio.sleep(interval)
+        version = aggregates.version
+        if version != _published_version:
+            _published_version = version
+            broadcaster.publish(snapshot_event())
+
+def submit_records(records: List[Dict[str, Any]]) -> Optional[Future]:
+    """
+    Hand records to the writer thread, returning the Future of their commit.
+
+    Never blocks: a full queue raises WriteQueueFull at once. Without the
+    writer (the lifespan is not running) the records are committed inline
+    and None is returned.
+    """
+    if write_queue is None:
+        commit_predictions(records)
+        return None
+    return write_queue.submit_many(records, block=False)
+
+async def save_prediction(estado: str, age: int, sex: str, arterial_index: int):
+    """
+    Append prediction with timestamp and the patient inputs to the prediction store.
+
+    The record is committed by the writer thread; the handler waits for it on
+    the event loop unless PREDICTION_WRITE_MODE=write_behind is combined with
+    PREDICTION_WRITE_ACK=enqueued, which returns once it is queued.
+    """
     timestamp = datetime.now(pytz.UTC).isoformat()
-    prediction = {"estado": estado, "timestamp": timestamp}
-    
-    file_path = f'/app/prediction/predictions_{file_index}.json'
+    prediction = {"estado": estado, "timestamp": timestamp, "age": age, "sex": sex, "arterialIndex": arterial_index}
+
     try:
-        # Load existing predictions
-        try:
-            with open(file_path, 'r') as f:
-                predictions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            predictions = []
-        
-        # Append new prediction
-        predictions.append(prediction)
-        
-        # Save updated predictions
-        with open(file_path, 'w') as f:
-            json.dump(predictions, f, indent=2)
+        future = submit_records([prediction])
+        if future is not None and (settings.write_mode == 'sync' or settings.write_ack == 'durable'):
+            await asyncio.wrap_future(future)
+    except WriteQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al guardar la predicción: {str(e)}")
 
+async def save_predictions(rows: List[Tuple[int, str, int, str]]) -> str:
+    """
+    Append a batch of (age, sex, arterialIndex, estado) predictions, all with the same timestamp, in one bulk commit.
+
+    The batch is already a group commit, so it is always waited for, even
+    with PREDICTION_WRITE_ACK=enqueued. Returns the timestamp of the records.
+    """
+    timestamp = datetime.now(pytz.UTC).isoformat()
+    records = [
+        {"estado": estado, "timestamp": timestamp, "age": age, "sex": sex, "arterialIndex": arterial_index}
+        for age, sex, arterial_index, estado in rows
+    ]
+    if not records:
+        return timestamp
+    try:
+        future = submit_records(records)
+        if future is not None:
+            await asyncio.wrap_future(future)
+    except WriteQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al guardar las predicciones: {str(e)}")
+    return timestamp
+
+def observe_inputs(rows: List[Tuple[int, str, int, str]], rule_engine: RuleEngine):
+    """Feed the (age, sex, arterialIndex, estado) rows of a batch to the drift histograms and the shadow rules."""
+    if rows:
+        ages, sexes, arterial_indexes, _ = zip(*rows)
+        drift_monitor.observe_many(ages, sexes, arterial_indexes)
+        rule_registry.shadow_many(rule_engine, ages, sexes, arterial_indexes)
+
 @app.get("/getprediction",
     summary="Obtener predicción de estado de salud",
     description="Devuelve un estado de salud ('NO ENFERMO', 'ENFERMEDAD LEVE', 'ENFERMEDAD AGUDA', 'ENFERMEDAD CRÓNICA') basado en la edad, sexo e índice arterial.",
     response_description="Un objeto JSON con el estado de salud predicho y timestamp.",
     response_model=PredictionResponse
 )
-def get_prediction(age: int, sex: str, arterialIndex: int) -> PredictionResponse:
+async def get_prediction(age: int, sex: str, arterialIndex: int) -> PredictionResponse:
     """
     Predict health status based on input parameters and JSON conditions.
+
+    Rule evaluation and sampling are in-memory and run inline on the event
+    loop; only the write leaves it, to the writer thread.
     
     Args:
         age (int): Patient's age
@@ -100,51 +476,131 @@ def get_prediction(age: int, sex: str, arterialIndex: int) -> PredictionResponse
         raise HTTPException(status_code=400, detail="La edad debe ser un valor no negativo.")
     if arterialIndex < 0:
         raise HTTPException(status_code=400, detail="El índice arterial debe ser un valor no negativo.")
+    # A value the store cannot hold would otherwise fail the whole group commit it lands in
+    if prediction_store.max_age is not None and age > prediction_store.max_age:
+        raise HTTPException(status_code=400, detail=f"La edad debe ser como máximo {prediction_store.max_age}.")
+    if prediction_store.max_arterial_index is not None and arterialIndex > prediction_store.max_arterial_index:
+        raise HTTPException(status_code=400,
+                            detail=f"El índice arterial debe ser como máximo {prediction_store.max_arterial_index}.")
     if sex not in ['M', 'F']:
         raise HTTPException(status_code=400, detail="El sexo debe ser 'M' o 'F'.")
 
-    # Load CSV data
-    try:
-        df = pd.read_csv('/app/prediction/model.csv')
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="Archivo model.csv no encontrado.")
+    drift_monitor.observe(age, sex, arterialIndex)
 
-    # Load conditions from JSON
-    conditions = load_conditions('/app/prediction/conditions.json')
-
-    # Evaluate conditions
-    estado = None
-    for condition in conditions['conditions']:
-        age_range = condition['age_range']
-        if age_range[0] <= age <= age_range[1]:
-            for rule in condition['rules']:
-                if rule['sex'] == sex and rule['arterial_index'][0] <= arterialIndex <= rule['arterial_index'][1]:
-                    estado = rule['estado']
-                    break
-            if estado:
-                break
-
-    # Default case if no specific condition matches
-    if not estado:
-        if arterialIndex <= conditions['default_threshold']['arterial_index']:
-            estado = 'NO ENFERMO'
-        else:
-            estado = 'ENFERMEDAD AGUDA'
+    # Evaluate conditions (default_threshold fallback is compiled into the engine); the active
+    # version is read once, so a concurrent swap cannot change it halfway through the request
+    started = time.perf_counter()
+    _, rule_engine = rule_registry.active
+    estado = rule_engine.classify(age, sex, arterialIndex)
+    classified = time.perf_counter()
+    _time_classify.observe(classified - started)
+    rule_registry.shadow(age, sex, arterialIndex, estado)
+
+    # Randomly select a status from the model.csv records with the predicted status
+    final_estado = estado_sampler.sample(estado)
+    _time_sample.observe(time.perf_counter() - classified)
+
+    # Save to the prediction store
+    await save_prediction(final_estado, age, sex, arterialIndex)
 
-    # Filter dataframe based on predicted status
-    filtered_df = df[df['estado'] == estado]
+    return PredictionResponse(estado=final_estado, timestamp=datetime.now(pytz.UTC).isoformat())
+
+# Largest /getpredictions batch scored on the event loop (about a millisecond of work)
+INLINE_BATCH_ROWS = 1000
 
-    # If no matching records, use the predicted status
-    if filtered_df.empty:
-        final_estado = estado
+@app.post("/getpredictions",
+    summary="Obtener predicciones para varios pacientes",
+    description="Clasifica un lote de pacientes en una sola llamada. Acepta columnas (`{\"age\": [...], \"sex\": [...], \"arterialIndex\": [...]}`) o una lista de pacientes (`[{\"age\": 20, \"sex\": \"M\", \"arterialIndex\": 120}, ...]`). Las filas inválidas devuelven su error sin afectar al resto del lote.",
+    response_description="Un objeto JSON con el timestamp del lote, una predicción o un error por paciente (en el mismo orden) y el número de errores.",
+    response_model=BatchPredictionResponse
+)
+async def get_predictions(patients: Union[BatchPredictionRequest, List[Any]]) -> BatchPredictionResponse:
+    """
+    Predict the health status of many patients at once.
+
+    Rows are validated like /getprediction, the valid ones are classified in
+    a single vectorized pass and saved with one bulk append. Batches of more
+    than INLINE_BATCH_ROWS patients are scored in a worker thread, so that a
+    large batch does not stall the other requests of the event loop.
+    """
+    # Batch scoring needs NumPy; it is only imported once a batch arrives
+    from .batch import score_columns
+
+    if isinstance(patients, BatchPredictionRequest):
+        ages, sexes, arterial_indexes = patients.age, patients.sex, patients.arterialIndex
     else:
-        # Randomly select a status from filtered records
-        final_estado = random.choice(filtered_df['estado'].tolist())
+        rows = [p if isinstance(p, dict) else {} for p in patients]
+        ages = [p.get('age') for p in rows]
+        sexes = [p.get('sex') for p in rows]
+        arterial_indexes = [p.get('arterialIndex') for p in rows]
 
-    # Save to one of three JSON files (random selection for load balancing)
-    save_prediction(final_estado, random.randint(1, 3))
+    if len(ages) > settings.max_batch_size:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {settings.max_batch_size} pacientes.")
+    started = time.perf_counter()
+    _, rule_engine = rule_registry.active
+    limits = (prediction_store.max_age, prediction_store.max_arterial_index)
+    try:
+        if len(ages) > INLINE_BATCH_ROWS:
+            estados, errors = await run_in_threadpool(score_columns, rule_engine, estado_sampler, ages, sexes,
+                                                      arterial_indexes, *limits)
+        else:
+            estados, errors = score_columns(rule_engine, estado_sampler, ages, sexes, arterial_indexes, *limits)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _time_score_batch.observe(time.perf_counter() - started)
 
-    return PredictionResponse(estado=final_estado, timestamp=datetime.now(pytz.UTC).isoformat())
+    valid = [row for row in zip(ages, sexes, arterial_indexes, estados) if row[3] is not None]
+    observe_inputs(valid, rule_engine)
+    timestamp = await save_predictions(valid)
+
+    return {
+        "timestamp": timestamp,
+        "predictions": [{"estado": estado, "error": error} for estado, error in zip(estados, errors)],
+        "errors": sum(error is not None for error in errors),
+    }
+
+@app.post("/getpredictions/csv",
+    summary="Obtener predicciones para un archivo CSV",
+    description="Recibe un CSV con las columnas `ege,sex,arterialIndex` (el mismo formato que model.csv; otras columnas se ignoran) y devuelve en streaming el CSV `ege,sex,arterialIndex,estado,error`, procesado por bloques con memoria constante. Las filas inválidas llevan su error y no se guardan.",
+    response_description="El CSV con la predicción o el error de cada fila, en el mismo orden.",
+    response_class=StreamingResponse
+)
+async def get_predictions_csv(file: UploadFile = File(..., description="Archivo CSV con las columnas ege, sex y arterialIndex.")) -> StreamingResponse:
+    """
+    Score an uploaded CSV chunk by chunk and stream the scored CSV back.
+
+    Each chunk is validated and classified like /getpredictions and its valid
+    rows are saved with one bulk append before the chunk is sent, so the first
+    rows reach the client while the rest of the file is still being scored.
+    Reading and scoring the chunks happens in a worker thread.
+    """
+    from .batch import CSV_OUTPUT_COLUMNS, csv_input_positions, format_csv, score_csv
+
+    text = codecs.getreader('utf-8-sig')(file.file, errors='replace')
+    reader = csv.reader(text)
+    try:
+        positions = csv_input_positions(next(reader))
+    except StopIteration:
+        raise HTTPException(status_code=400, detail="El archivo CSV está vacío.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    _, rule_engine = rule_registry.active
+
+    async def scored():
+        yield format_csv([CSV_OUTPUT_COLUMNS])
+        chunks = score_csv(rule_engine, estado_sampler, reader, positions, max_age=prediction_store.max_age,
+                           max_arterial_index=prediction_store.max_arterial_index)
+        async for rows, valid in iterate_in_threadpool(chunks):
+            observe_inputs(valid, rule_engine)
+            await save_predictions(valid)
+            yield format_csv(rows)
+
+    return StreamingResponse(
+        scored(),
+        media_type='text/csv; charset=utf-8',
+        headers={'Content-Disposition': 'attachment; filename="predicciones.csv"'},
+    )
 
 @app.get("/health",
     summary="Verificar el estado de la API",
@@ -156,80 +612,170 @@ async def health_check() -> HealthResponse:
     """Return the health status of the API."""
     return HealthResponse(status="ok")
 
+def _utc_iso(value: Optional[datetime]) -> Optional[str]:
+    """Normalize a query datetime to the UTC ISO-8601 format used by stored timestamps."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = pytz.UTC.localize(value)
+    return value.astimezone(pytz.UTC).isoformat()
+
+SinceQuery = Annotated[Optional[datetime], Query(description="Solo predicciones con timestamp >= since (ISO-8601, UTC si no tiene zona).")]
+UntilQuery = Annotated[Optional[datetime], Query(description="Solo predicciones con timestamp < until (ISO-8601, UTC si no tiene zona).")]
+EstadoQuery = Annotated[Optional[str], Query(description="Solo predicciones con este estado.")]
+
 @app.get("/prediction_counts",
     summary="Obtener conteo de predicciones por categoría",
-    description="Devuelve el número total de predicciones realizadas para cada categoría de estado de salud.",
+    description="Devuelve el número total de predicciones realizadas para cada categoría de estado de salud, opcionalmente filtradas por rango de tiempo y estado.",
     response_description="Un objeto JSON con el conteo de predicciones por categoría."
 )
-def get_prediction_counts() -> Dict[str, int]:
+async def get_prediction_counts(since: SinceQuery = None, until: UntilQuery = None, estado: EstadoQuery = None) -> Dict[str, int]:
     """Return the total number of predictions made for each health status category."""
-    all_predictions = []
-    for i in range(1, 4):
-        file_path = f'/app/prediction/predictions_{i}.json'
-        try:
-            with open(file_path, 'r') as f:
-                predictions = json.load(f)
-                all_predictions.extend(predictions)
-        except (FileNotFoundError, json.JSONDecodeError):
-            continue
-    
-    # Count predictions by status
-    counts = Counter(pred['estado'] for pred in all_predictions)
-    return dict(counts)
+    if since is None and until is None and estado is None:
+        return aggregates.counts()
+    # Filtered counts read the store, in a worker thread
+    started = time.perf_counter()
+    counts = await run_in_threadpool(count_with_compacted, prediction_store, _utc_iso(since), _utc_iso(until), estado)
+    _time_count.observe(time.perf_counter() - started)
+    return counts
+
+@app.get("/prediction_counts/timeseries",
+    summary="Obtener conteo de predicciones por intervalo de tiempo",
+    description="Devuelve el número de predicciones por categoría en intervalos de un minuto, hora o día, desde agregados precalculados. Solo se incluyen intervalos con predicciones.",
+    response_description="Un objeto JSON con los intervalos y su conteo por categoría.",
+    response_model=TimeseriesResponse
+)
+async def get_prediction_counts_timeseries(
+    bucket: Annotated[Literal['minute', 'hour', 'day'], Query(description="Tamaño del intervalo.")] = 'hour',
+    since: SinceQuery = None,
+    until: UntilQuery = None,
+    estado: EstadoQuery = None,
+) -> TimeseriesResponse:
+    """
+    Return per-estado prediction counts per time bucket.
+
+    Served from the rollups maintained by save_prediction, so the cost depends
+    on the number of buckets in the range, not on the number of predictions.
+    Ranges longer than the retained window of the bucket size are truncated.
+    """
+    until_micros = timestamp_to_micros(_utc_iso(until or datetime.now(pytz.UTC)))
+    if since is not None:
+        since_micros = timestamp_to_micros(_utc_iso(since))
+    else:
+        since_micros = until_micros - aggregates.rollup_window(bucket)
+
+    buckets = []
+    for start, counts in aggregates.timeseries(bucket, since_micros, until_micros):
+        if estado is not None:
+            counts = {estado: counts[estado]} if estado in counts else {}
+            if not counts:
+                continue
+        buckets.append(TimeseriesBucket(start=micros_to_timestamp(start), counts=counts))
+    return TimeseriesResponse(bucket=bucket, buckets=buckets)
 
 @app.get("/last_predictions",
     summary="Obtener las últimas 5 predicciones",
-    description="Devuelve las últimas 5 predicciones realizadas, ordenadas por fecha descendente.",
+    description="Devuelve las últimas predicciones realizadas (5 por defecto), ordenadas por fecha descendente y opcionalmente filtradas por rango de tiempo y estado.",
     response_description="Una lista de objetos JSON con estado y timestamp.",
     response_model=List[PredictionResponse]
 )
-def get_last_predictions() -> List[PredictionResponse]:
-    """Return the last 5 predictions made, sorted by timestamp in descending order."""
-    all_predictions = []
-    for i in range(1, 4):
-        file_path = f'/app/prediction/predictions_{i}.json'
-        try:
-            with open(file_path, 'r') as f:
-                predictions = json.load(f)
-                all_predictions.extend(predictions)
-        except (FileNotFoundError, json.JSONDecodeError):
-            continue
-    
-    # Sort by timestamp and take last 5
-    sorted_predictions = sorted(all_predictions, key=lambda x: x['timestamp'], reverse=True)[:5]
-    return [PredictionResponse(estado=p['estado'], timestamp=p['timestamp']) for p in sorted_predictions]
+async def get_last_predictions(
+    since: SinceQuery = None,
+    until: UntilQuery = None,
+    estado: EstadoQuery = None,
+    limit: Annotated[int, Query(ge=1, le=1000, description="Número máximo de predicciones.")] = 5,
+) -> List[PredictionResponse]:
+    """Return the last `limit` predictions made, sorted by timestamp in descending order."""
+    if since is None and until is None and estado is None and limit <= aggregates.top_k:
+        last_predictions = aggregates.last(limit)
+    else:
+        started = time.perf_counter()
+        last_predictions = await run_in_threadpool(prediction_store.query, _utc_iso(since), _utc_iso(until), estado, limit)
+        _time_query.observe(time.perf_counter() - started)
+    return [PredictionResponse(estado=p['estado'], timestamp=p['timestamp']) for p in last_predictions]
 
 @app.get("/last_prediction_date",
     summary="Obtener la fecha de la última predicción",
     description="Devuelve la fecha y hora de la última predicción realizada.",
     response_description="Un objeto JSON con la fecha y hora de la última predicción."
 )
-def get_last_prediction_date() -> Dict[str, str]:
+async def get_last_prediction_date() -> Dict[str, str]:
     """Return the date and time of the last prediction made."""
-    all_predictions = []
-    for i in range(1, 4):
-        file_path = f'/app/prediction/predictions_{i}.json'
-        try:
-            with open(file_path, 'r') as f:
-                predictions = json.load(f)
-                all_predictions.extend(predictions)
-        except (FileNotFoundError, json.JSONDecodeError):
-            continue
-    
-    if not all_predictions:
+    latest_prediction = aggregates.latest()
+    if latest_prediction is None:
         raise HTTPException(status_code=404, detail="No se han realizado predicciones.")
     
-    # Find the most recent prediction
-    latest_prediction = max(all_predictions, key=lambda x: x['timestamp'])
     return {"last_prediction_date": latest_prediction['timestamp']}
 
+REPORT_FILENAME = 'ReportePredicciones.txt'
+
+# (aggregates version, report bytes, Base64 text) of the last generated report
+_report_cache = None
+
+def build_report():
+    """
+    Return (report_bytes, base64_text) for the current aggregates.
+
+    The report is only regenerated when the aggregates version changes, i.e.
+    after a new prediction is committed; otherwise it comes from the cache.
+    It is built from the in-memory aggregates only, so the report endpoints
+    run it inline on the event loop.
+    """
+    global _report_cache
+    version = aggregates.version
+    cached = _report_cache
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+    started = time.perf_counter()
+
+    latest_prediction = aggregates.latest()
+    if latest_prediction is None:
+        raise HTTPException(status_code=404, detail="No se han realizado predicciones.")
+    counts = aggregates.counts()
+    last_predictions = aggregates.last(5)
+
+    # Create report content
+    report_lines = [
+        "Reporte de Predicciones de Estado de Salud",
+        "=" * 45,
+        "",
+        f"Fecha de la última predicción: {latest_prediction['timestamp']}",
+        "",
+        "Conteo de predicciones por categoría:",
+        "-" * 45
+    ]
+    
+    for estado, count in counts.items():
+        report_lines.append(f"{estado}: {count}")
+    
+    report_lines.extend([
+        "",
+        "Últimas 5 predicciones:",
+        "-" * 45
+    ])
+    
+    for pred in last_predictions:
+        report_lines.append(f"Estado: {pred['estado']}, Timestamp: {pred['timestamp']}")
+    
+    # Combine lines into a single string
+    report_content = "\n".join(report_lines)
+    
+    # Encode to Base64
+    report_bytes = report_content.encode('utf-8')
+    base64_encoded = base64.b64encode(report_bytes).decode('utf-8')
+
+    # Tagged with the version read before building: a concurrent commit only causes a rebuild next time
+    _report_cache = (version, report_bytes, base64_encoded)
+    _time_report.observe(time.perf_counter() - started)
+    return report_bytes, base64_encoded
+
 @app.get("/getReport",
     summary="Obtener reporte de predicciones en Base64",
     description="Genera un archivo TXT con los resultados de última predicción, conteo de predicciones por categoría y las últimas 5 predicciones, codificado en Base64.",
     response_description="Un objeto JSON con el reporte en formato Base64.",
     response_model=ReportResponse
 )
-def get_report() -> ReportResponse:
+async def get_report() -> ReportResponse:
     """
     Generate a Base64-encoded TXT report containing:
     - Last prediction date
@@ -237,69 +783,213 @@ def get_report() -> ReportResponse:
     - Last 5 predictions
     """
     try:
-        # Fetch data from existing endpoints
-        last_date = get_last_prediction_date()
-        counts = get_prediction_counts()
-        last_predictions = get_last_predictions()
-
-        # Create report content
-        report_lines = [
-            "Reporte de Predicciones de Estado de Salud",
-            "=" * 45,
-            "",
-            f"Fecha de la última predicción: {last_date['last_prediction_date']}",
-            "",
-            "Conteo de predicciones por categoría:",
-            "-" * 45
-        ]
-        
-        for estado, count in counts.items():
-            report_lines.append(f"{estado}: {count}")
-        
-        report_lines.extend([
-            "",
-            "Últimas 5 predicciones:",
-            "-" * 45
-        ])
-        
-        for pred in last_predictions:
-            report_lines.append(f"Estado: {pred.estado}, Timestamp: {pred.timestamp}")
-        
-        # Combine lines into a single string
-        report_content = "\n".join(report_lines)
-        
-        # Encode to Base64
-        report_bytes = report_content.encode('utf-8')
-        base64_encoded = base64.b64encode(report_bytes).decode('utf-8')
-        
-        return ReportResponse(report_base64=base64_encoded, filename='ReportePredicciones.txt')
+        _, base64_encoded = build_report()
+        return ReportResponse(report_base64=base64_encoded, filename=REPORT_FILENAME)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al generar el reporte: {str(e)}")
 
+@app.get("/getReport/raw",
+    summary="Obtener reporte de predicciones en texto plano",
+    description="Devuelve el mismo reporte que /getReport como archivo TXT (text/plain) en streaming, sin la sobrecarga de Base64.",
+    response_description="El reporte en texto plano.",
+    response_class=StreamingResponse
+)
+async def get_report_raw() -> StreamingResponse:
+    """Stream the TXT report without Base64 encoding."""
+    try:
+        report_bytes, _ = build_report()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al generar el reporte: {str(e)}")
+
+    # An async generator, so that sending the chunks does not hop to a worker thread
+    async def chunks(size: int = 65536):
+        for start in range(0, len(report_bytes), size):
+            yield report_bytes[start:start + size]
+
+    return StreamingResponse(
+        chunks(),
+        media_type='text/plain; charset=utf-8',
+        headers={'Content-Disposition': f'attachment; filename="{REPORT_FILENAME}"'},
+    )
+
+@app.get("/export",
+    summary="Exportar el historial de predicciones",
+    description="Devuelve en streaming el historial completo de predicciones (estado, timestamp, edad, sexo e índice arterial), opcionalmente filtrado por rango de tiempo y estado, en formato Parquet (un grupo de filas por lote) o como flujo Arrow IPC. Se genera por lotes desde el almacenamiento, con memoria constante, e incluye las predicciones guardadas al empezar la exportación. Requiere pyarrow.",
+    response_description="El archivo Parquet o el flujo Arrow IPC.",
+    response_class=StreamingResponse
+)
+async def export_predictions(
+    format: Annotated[Literal['parquet', 'arrow'], Query(description="Formato de salida.")] = 'parquet',
+    since: SinceQuery = None,
+    until: UntilQuery = None,
+    estado: EstadoQuery = None,
+) -> StreamingResponse:
+    """
+    Stream the prediction history as Parquet or Arrow IPC.
+
+    The export is a sync generator, so Starlette reads and encodes each
+    batch in a worker thread and the event loop keeps serving predictions.
+    """
+    # pyarrow is optional and only imported on the first export
+    try:
+        from .export import EXPORT_EXTENSIONS, EXPORT_MEDIA_TYPES, export_stream
+    except ImportError:
+        raise HTTPException(status_code=501, detail="La exportación requiere pyarrow (pip install pyarrow).")
+
+    return StreamingResponse(
+        export_stream(prediction_store, format, _utc_iso(since), _utc_iso(until), estado),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="predicciones.{EXPORT_EXTENSIONS[format]}"'},
+    )
+
+@app.get("/events",
+    summary="Recibir predicciones en tiempo real",
+    description="Flujo Server-Sent Events: al conectarse se envía un evento `snapshot` (conteos, últimas predicciones y última predicción) y después un evento `prediction` por cada escritura, con los conteos actualizados y las nuevas predicciones (hasta 100, la más reciente primero). Un cliente que se retrasa recibe un nuevo `snapshot` en lugar de los eventos perdidos.",
+    response_description="Un flujo text/event-stream.",
+    response_class=StreamingResponse
+)
+async def get_events(request: Request) -> StreamingResponse:
+    """Stream live prediction updates to the dashboard; a stream whose client went away ends at the next heartbeat."""
+    return StreamingResponse(
+        broadcaster.subscribe(snapshot_event, request.is_disconnected),
+        media_type='text/event-stream',
+        # Keep nginx and other proxies from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def history_size() -> int:
+    """Number of predictions in the history, from the aggregates counters."""
+    return sum(aggregates.counts().values())
+
+metrics.gauge('prediction_history_size', 'Número de predicciones guardadas.', history_size)
+metrics.gauge('prediction_write_queue_size', 'Predicciones pendientes en la cola de escritura de este proceso.',
+              lambda: write_queue.qsize() if write_queue is not None else 0)
+metrics.gauge('prediction_events_subscribers', 'Clientes conectados a /events en este proceso.',
+              lambda: broadcaster.subscriber_count)
+
+@app.get("/metrics",
+    summary="Obtener métricas de Prometheus",
+    description="Devuelve en formato de texto de Prometheus el número de peticiones y los histogramas de latencia por ruta, la duración de la evaluación de reglas y de las lecturas y escrituras del almacén, el tamaño del historial de predicciones y el de la cola de escritura. Con PREDICTION_MULTIPROCESS los contadores e histogramas suman todos los workers.",
+    response_description="Las métricas en formato text/plain de Prometheus.",
+    response_class=Response
+)
+def get_metrics() -> Response:
+    """Render every metric in the Prometheus text exposition format."""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/drift",
+    summary="Obtener la deriva de los datos de entrada",
+    description="Compara la distribución de `age` y `arterialIndex` por sexo de las predicciones recibidas con una referencia. Con `reference=model` se comparan las ventanas retenidas (por defecto las últimas 24 horas) con model.csv; con `reference=history`, la ventana actual (por defecto la hora en curso) con las anteriores. Devuelve los cuantiles de ambas distribuciones y el PSI (Population Stability Index): menos de 0.1 es estable, de 0.1 a 0.25 moderado y más de 0.25 significativo. Se calcula con histogramas incrementales, sin recorrer el historial.",
+    response_description="Un objeto JSON con los cuantiles y el PSI por sexo y variable."
+)
+def get_drift(
+    reference: Annotated[Literal['model', 'history'], Query(description="Distribución de referencia.")] = 'model',
+) -> Dict[str, Any]:
+    """Report input drift from the streaming histograms."""
+    current, previous = drift_monitor.histograms()
+    if reference == 'model':
+        current, baseline = merge(current, previous), model_reference
+    else:
+        baseline = previous
+    features = drift_report(current, baseline)
+    scores = [f['psi'] for f in features if f['psi'] is not None]
+    return {
+        "reference": reference,
+        "window_seconds": drift_monitor.window_seconds,
+        "windows": drift_monitor.windows,
+        "max_psi": max(scores) if scores else None,
+        "features": features,
+    }
+
+class RulesActiveRequest(BaseModel):
+    version: str
+
+class RulesShadowsRequest(BaseModel):
+    versions: List[str]
+
+def require_admin(token: Optional[str]):
+    """Reject rule changes unless PREDICTION_ADMIN_TOKEN is set and sent in X-Admin-Token."""
+    if not settings.admin_token or token is None or not hmac.compare_digest(token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="Se requiere un X-Admin-Token válido para modificar las reglas.")
+
+def rules_state() -> Dict[str, Any]:
+    return {
+        "active": rule_registry.active[0],
+        "shadows": rule_registry.shadow_versions,
+        "versions": rule_registry.versions(),
+        "shadow_stats": rule_registry.stats(),
+        "shadow_dropped": rule_registry.dropped,
+    }
+
+AdminToken = Annotated[Optional[str], Header(alias="X-Admin-Token", description="Valor de PREDICTION_ADMIN_TOKEN.")]
+
+@app.get("/rules",
+    summary="Obtener las versiones de reglas",
+    description="Devuelve la versión de reglas activa, las versiones evaluadas en sombra, las versiones disponibles (`default` es conditions.json) y, por versión en sombra, cuántas clasificaciones coinciden con la activa y qué pares de estados difieren. Las estadísticas son del worker que responde.",
+    response_description="Un objeto JSON con la versión activa, las versiones en sombra y sus estadísticas."
+)
+def get_rules() -> Dict[str, Any]:
+    """Describe the rule registry."""
+    return rules_state()
+
+@app.post("/rules/versions/{version}",
+    summary="Añadir una versión de reglas",
+    description="Compila y guarda una nueva versión de reglas con el formato de conditions.json. Las versiones no se pueden sobrescribir. Requiere la cabecera X-Admin-Token.",
+    response_description="El estado de las reglas tras añadir la versión.",
+    status_code=201
+)
+def add_rules_version(version: str, conditions: Annotated[Dict[str, Any], Body()], x_admin_token: AdminToken = None) -> Dict[str, Any]:
+    """Add a rule set version; it is not used until it is activated or shadowed."""
+    require_admin(x_admin_token)
+    try:
+        rule_registry.add(version, conditions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return rules_state()
+
+@app.post("/rules/active",
+    summary="Activar una versión de reglas",
+    description="Cambia de forma atómica la versión de reglas usada por las predicciones, sin pausar ni rechazar las peticiones en curso (que terminan con la versión con la que empezaron). Requiere la cabecera X-Admin-Token.",
+    response_description="El estado de las reglas tras el cambio."
+)
+def set_rules_active(request: RulesActiveRequest, x_admin_token: AdminToken = None) -> Dict[str, Any]:
+    """Swap the active rule set."""
+    require_admin(x_admin_token)
+    try:
+        rule_registry.activate(request.version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return rules_state()
+
+@app.post("/rules/shadows",
+    summary="Elegir las versiones de reglas en sombra",
+    description="Evalúa las versiones indicadas con las entradas de cada predicción, en segundo plano y sin afectar a la respuesta, y cuenta cuántas veces coinciden con la versión activa. Una lista vacía desactiva la evaluación en sombra. Requiere la cabecera X-Admin-Token.",
+    response_description="El estado de las reglas tras el cambio."
+)
+def set_rules_shadows(request: RulesShadowsRequest, x_admin_token: AdminToken = None) -> Dict[str, Any]:
+    """Select the shadow rule sets."""
+    require_admin(x_admin_token)
+    try:
+        rule_registry.set_shadows(request.versions)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return rules_state()
+
 @app.get("/last_prediction",
     summary="Obtener la última predicción",
     description="Devuelve la fecha, hora y estado de la última predicción realizada.",
     response_description="Un objeto JSON con la fecha, hora y estado de la última predicción.",
     response_model=LastPredictionResponse
 )
-def get_last_prediction() -> Dict[str, str]:
+async def get_last_prediction() -> Dict[str, str]:
     """Return the date, time, and state of the last prediction made."""
-    all_predictions = []
-    for i in range(1, 4):
-        file_path = f'/app/prediction/predictions_{i}.json'
-        try:
-            with open(file_path, 'r') as f:
-                predictions = json.load(f)
-                all_predictions.extend(predictions)
-        except (FileNotFoundError, json.JSONDecodeError):
-            continue
-    
-    if not all_predictions:
+    latest_prediction = aggregates.latest()
+    if latest_prediction is None:
         raise HTTPException(status_code=404, detail="No se han realizado predicciones.")
     
-    # Find the most recent prediction
-    latest_prediction = max(all_predictions, key=lambda x: x['timestamp'])
     return {
         "last_prediction_date": latest_prediction['timestamp'],
         "estado": latest_prediction['estado']
@@ -0,0 +1,343 @@
+import argparse
+import csv
+import gc
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .rules import RuleEngine
+from .sampling import EstadoSampler
+from .settings import PREDICTION_DIR
+
+# Same messages as the single-patient /getprediction validation
+ERROR_AGE_TYPE = "La edad debe ser un número entero."
+ERROR_AGE_NEGATIVE = "La edad debe ser un valor no negativo."
+ERROR_ARTERIAL_INDEX_TYPE = "El índice arterial debe ser un número entero."
+ERROR_ARTERIAL_INDEX_NEGATIVE = "El índice arterial debe ser un valor no negativo."
+ERROR_AGE_TOO_LARGE = "La edad debe ser como máximo {}."
+ERROR_ARTERIAL_INDEX_TOO_LARGE = "El índice arterial debe ser como máximo {}."
+ERROR_SEX = "El sexo debe ser 'M' o 'F'."
+
+# Input columns of a scoring CSV (same names as model.csv) and the columns added to the output
+CSV_INPUT_COLUMNS = ('ege', 'sex', 'arterialIndex')
+CSV_OUTPUT_COLUMNS = CSV_INPUT_COLUMNS + ('estado', 'error')
+CSV_CHUNK_ROWS = 10000
+
+_INT64_MIN, _INT64_MAX = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+
+
+def _int_column(values: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (int64 column, mask of rows that are not integers) for a column of JSON values.
+
+    All-integer columns are converted in one call; anything else (strings,
+    floats, nulls, out-of-range numbers) is checked row by row. Booleans
+    are checked first: NumPy would turn [True, 30] into the integers 1, 30.
+    """
+    types = set(map(type, values))
+    array = None
+    if bool not in types and np.bool_ not in types:
+        try:
+            array = np.asarray(values)
+        except (OverflowError, ValueError):
+            pass
+    if array is not None and array.ndim == 1 and array.dtype.kind == 'i':
+        return array.astype(np.int64), np.zeros(len(array), dtype=bool)
+
+    column = np.zeros(len(values), dtype=np.int64)
+    invalid = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        if isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)) and _INT64_MIN <= value <= _INT64_MAX:
+            column[i] = value
+        else:
+            invalid[i] = True
+    return column, invalid
+
+
+def score_columns(rule_engine: RuleEngine, sampler: EstadoSampler, ages: Sequence[Any], sexes: Sequence[Any],
+                  arterial_indexes: Sequence[Any], max_age: Optional[int] = None,
+                  max_arterial_index: Optional[int] = None) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+    """
+    Validate and classify a batch of patients given as three equal-length columns.
+
+    Returns (estados, errors): for every row either an estado and None, or
+    None and the validation message that /getprediction would have answered
+    with. Valid rows are classified in one vectorized pass. `max_age` and
+    `max_arterial_index` are the limits of the store the rows will be saved to.
+    """
+    n = len(ages)
+    if len(sexes) != n or len(arterial_indexes) != n:
+        raise ValueError("Las columnas age, sex y arterialIndex deben tener la misma longitud.")
+
+    age_column, age_invalid = _int_column(ages)
+    index_column, index_invalid = _int_column(arterial_indexes)
+    sex_column = np.fromiter(sexes, dtype=object, count=n)
+
+    # Later checks overwrite earlier ones, so each row reports its first problem in /getprediction order
+    errors = np.full(n, None, dtype=object)
+    errors[(sex_column != 'M') & (sex_column != 'F')] = ERROR_SEX
+    if max_arterial_index is not None:
+        errors[~index_invalid & (index_column > max_arterial_index)] = ERROR_ARTERIAL_INDEX_TOO_LARGE.format(max_arterial_index)
+    errors[~index_invalid & (index_column < 0)] = ERROR_ARTERIAL_INDEX_NEGATIVE
+    errors[index_invalid] = ERROR_ARTERIAL_INDEX_TYPE
+    if max_age is not None:
+        errors[~age_invalid & (age_column > max_age)] = ERROR_AGE_TOO_LARGE.format(max_age)
+    errors[~age_invalid & (age_column < 0)] = ERROR_AGE_NEGATIVE
+    errors[age_invalid] = ERROR_AGE_TYPE
+
+    valid = np.flatnonzero(errors == None)  # noqa: E711 (elementwise comparison)
+    estados = np.full(n, None, dtype=object)
+    if len(valid):
+        predicted = rule_engine.classify_many(age_column[valid], sex_column[valid], index_column[valid])
+        estados[valid] = np.array(sampler.sample_many(predicted), dtype=object)
+    return estados.tolist(), errors.tolist()
+
+
+def _parse_int_column(values: List[str]) -> List[Any]:
+    """CSV fields to ints where they are integers; anything else is left as is and fails validation."""
+    try:
+        return np.array(values, dtype=np.str_).astype(np.int64).tolist()
+    except (ValueError, OverflowError):
+        pass
+    parsed: List[Any] = []
+    for value in values:
+        try:
+            parsed.append(int(value))
+        except (TypeError, ValueError):
+            parsed.append(value)
+    return parsed
+
+
+def csv_input_positions(header: Sequence[str]) -> Tuple[int, int, int]:
+    """Positions of the ege, sex and arterialIndex columns in a CSV header; other columns are ignored."""
+    names = [name.strip() for name in header]
+    missing = [column for column in CSV_INPUT_COLUMNS if column not in names]
+    if missing:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(missing)}. Se esperan {','.join(CSV_INPUT_COLUMNS)}.")
+    return tuple(names.index(column) for column in CSV_INPUT_COLUMNS)
+
+
+def score_csv(rule_engine: RuleEngine, sampler: EstadoSampler, rows: Iterable[List[str]],
+              positions: Tuple[int, int, int], chunk_rows: int = CSV_CHUNK_ROWS, max_age: Optional[int] = None,
+              max_arterial_index: Optional[int] = None) -> Iterator[Tuple[List[Tuple[Any, ...]], List[Tuple[int, str, int, str]]]]:
+    """
+    Score CSV rows (without the header) `chunk_rows` at a time.
+
+    Yields, per chunk, the output rows (`CSV_OUTPUT_COLUMNS`) and the
+    (age, sex, arterialIndex, estado) of the valid rows, so the caller can
+    save them; only one chunk is held in memory at a time. The limits are
+    those of score_columns().
+    """
+    rows = iter(rows)
+    width = max(positions) + 1
+    while True:
+        chunk = list(islice(rows, chunk_rows))
+        if not chunk:
+            return
+        # Short rows get empty fields, which fail validation
+        chunk = [row if len(row) >= width else row + [''] * (width - len(row)) for row in chunk]
+        ages, sexes, arterial_indexes = ([row[i] for row in chunk] for i in positions)
+        parsed_ages, parsed_indexes = _parse_int_column(ages), _parse_int_column(arterial_indexes)
+        estados, errors = score_columns(rule_engine, sampler, parsed_ages, sexes, parsed_indexes,
+                                        max_age, max_arterial_index)
+        output = list(zip(ages, sexes, arterial_indexes, estados, errors))
+        yield output, [row for row in zip(parsed_ages, sexes, parsed_indexes, estados) if row[3] is not None]
+
+
+def format_csv(rows: Iterable[Sequence[Any]]) -> bytes:
+    """Encode rows as UTF-8 CSV; None becomes an empty field."""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _read_csv_blocks(path: str, block_bytes: int) -> Iterator[Tuple[Tuple[int, int, int], bytes]]:
+    """
+    Split a CSV into blocks of whole lines, each tagged with the input column positions.
+
+    Workers parse their own blocks, so the parent only does I/O. Fields must
+    not contain quoted line breaks (model.csv-style numeric files never do).
+    """
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf-8-sig')
+        if not header:
+            return
+        positions = csv_input_positions(next(csv.reader([header])))
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                return
+            yield positions, block + f.readline()
+
+
+def _read_parquet_blocks(path: str, batch_rows: int) -> Iterator[Tuple[List[Any], List[Any], List[Any]]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Leer Parquet requiere pyarrow: pip install pyarrow")
+    parquet_file = pq.ParquetFile(path)
+    csv_input_positions(parquet_file.schema_arrow.names)
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=list(CSV_INPUT_COLUMNS)):
+        yield tuple(batch.column(column).to_pylist() for column in CSV_INPUT_COLUMNS)
+
+
+class _CsvOutput:
+    def __init__(self, path: Optional[str]):
+        self._file = open(path, 'wb') if path else sys.stdout.buffer
+        self._file.write(format_csv([CSV_OUTPUT_COLUMNS]))
+
+    def write(self, payload: bytes) -> None:
+        self._file.write(payload)
+
+    def close(self) -> None:
+        if self._file is sys.stdout.buffer:
+            self._file.flush()
+        else:
+            self._file.close()
+
+
+class _ParquetOutput:
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Escribir Parquet requiere pyarrow: pip install pyarrow")
+        self._pa = pa
+        self._pq = pq
+        self._path = path
+        self._writer = None
+
+    def write(self, payload: Tuple[List[Any], ...]) -> None:
+        # Inputs are written as read (invalid values included), so every column is stored as text
+        arrays = [self._pa.array([None if v is None else str(v) for v in column], type=self._pa.string())
+                  for column in payload]
+        table = self._pa.Table.from_arrays(arrays, names=list(CSV_OUTPUT_COLUMNS))
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        if self._writer is None:
+            self.write(tuple([] for _ in CSV_OUTPUT_COLUMNS))
+        self._writer.close()
+
+
+def load_scoring(conditions_path: str, model_path: str) -> Tuple[RuleEngine, EstadoSampler]:
+    """The RuleEngine and EstadoSampler that get_prediction uses, built from conditions.json and model.csv."""
+    with open(conditions_path, 'r') as f:
+        rule_engine = RuleEngine(json.load(f))
+    with open(model_path, 'r', encoding='utf-8', newline='') as f:
+        sampler = EstadoSampler(row['estado'] for row in csv.DictReader(f))
+    return rule_engine, sampler
+
+
+# Per-process state of the batch CLI workers
+_worker_scoring: Optional[Tuple[RuleEngine, EstadoSampler]] = None
+_worker_output = 'csv'
+
+
+def _init_worker(conditions_path: str, model_path: str, output_format: str) -> None:
+    global _worker_scoring, _worker_output
+    _worker_scoring = load_scoring(conditions_path, model_path)
+    _worker_output = output_format
+
+
+def _score_block(block) -> Tuple[Any, int, int]:
+    """
+    Score one block in a worker: a (positions, CSV bytes) pair or a tuple of input columns.
+
+    Returns (payload, rows, errors) where the payload is ready for the output:
+    CSV bytes, or the output columns for Parquet.
+    """
+    rule_engine, sampler = _worker_scoring
+    # A block allocates millions of short-lived, acyclic objects: skip the cyclic GC passes they would trigger
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _score_block_payload(rule_engine, sampler, block)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _score_block_payload(rule_engine: RuleEngine, sampler: EstadoSampler, block) -> Tuple[Any, int, int]:
+    if isinstance(block[1], bytes):
+        positions, data = block
+        rows = score_csv(rule_engine, sampler, csv.reader(io.StringIO(data.decode('utf-8'))), positions,
+                         chunk_rows=sys.maxsize)
+        output = next(rows, ([], []))[0]
+    else:
+        ages, sexes, arterial_indexes = block
+        estados, errors = score_columns(rule_engine, sampler, ages, sexes, arterial_indexes)
+        output = list(zip(ages, sexes, arterial_indexes, estados, errors))
+    errors = sum(row[4] is not None for row in output)
+    if _worker_output == 'parquet':
+        return tuple(map(list, zip(*output))) if output else tuple([] for _ in CSV_OUTPUT_COLUMNS), len(output), errors
+    return format_csv(output), len(output), errors
+
+
+def score_blocks(blocks: Iterable, workers: int, conditions_path: str, model_path: str,
+                 output_format: str = 'csv') -> Iterator[Tuple[Any, int, int]]:
+    """Score `blocks` on `workers` processes, yielding results in input order with a bounded number in flight."""
+    if workers <= 1:
+        _init_worker(conditions_path, model_path, output_format)
+        for block in blocks:
+            yield _score_block(block)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(conditions_path, model_path, output_format)) as executor:
+        pending = deque()
+        for block in blocks:
+            pending.append(executor.submit(_score_block, block))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Puntuación por lotes (CSV o Parquet) con las mismas reglas y muestreo que /getprediction."
+    )
+    parser.add_argument('input', help="Archivo .csv o .parquet con las columnas ege, sex y arterialIndex.")
+    parser.add_argument('-o', '--output', help="Archivo .csv o .parquet de salida (por defecto, CSV por la salida estándar).")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="Procesos de puntuación.")
+    parser.add_argument('--block-size', type=int, default=4 * 1024 * 1024,
+                        help="Bytes de CSV (o filas de Parquet / 40) por bloque enviado a cada proceso.")
+    parser.add_argument('--conditions', default=os.path.join(PREDICTION_DIR, 'conditions.json'))
+    parser.add_argument('--model', default=os.path.join(PREDICTION_DIR, 'model.csv'))
+    args = parser.parse_args(argv)
+
+    if args.input.endswith('.parquet'):
+        # About 40 bytes per row in the CSV layout
+        blocks = _read_parquet_blocks(args.input, max(1, args.block_size // 40))
+    else:
+        blocks = _read_csv_blocks(args.input, args.block_size)
+    output_format = 'parquet' if args.output and args.output.endswith('.parquet') else 'csv'
+    output = _ParquetOutput(args.output) if output_format == 'parquet' else _CsvOutput(args.output)
+
+    started = time.perf_counter()
+    rows = errors = 0
+    try:
+        for payload, block_rows, block_errors in score_blocks(blocks, args.workers, args.conditions, args.model, output_format):
+            output.write(payload)
+            rows += block_rows
+            errors += block_errors
+    finally:
+        output.close()
+    elapsed = time.perf_counter() - started
+    print(f"{rows} filas ({errors} con error) en {elapsed:.2f} s: {rows / elapsed if elapsed else 0:.0f} filas/s "
+          f"con {args.workers} procesos", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
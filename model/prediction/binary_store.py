@@ -0,0 +1,326 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .rollups import MAX_ESTADOS, micros_to_timestamp, timestamp_to_micros
+from .storage import PredictionStore
+
+_MAGIC = b'PREDBIN1'
+_NAME_BYTES = 64
+# magic, record size, number of estados, records removed by compaction; the estado names start at byte 64
+_HEADER = struct.Struct('<8sIIQ')
+_N_ESTADOS_AT = 12
+_NAMES_AT = 64
+# The records start on a page boundary, so the whole array can be memory-mapped with an offset
+HEADER_BYTES = 4096
+
+# timestamp (UTC epoch microseconds), arterialIndex, age, sex code, estado code
+_RECORD = struct.Struct('<qihBB')
+RECORD_BYTES = _RECORD.size
+
+# Sex codes; 0 marks records saved without input features (e.g. migrated ones), whose age and index are -1
+SEXES = (None, 'M', 'F')
+_SEX_CODES = {sex: code for code, sex in enumerate(SEXES)}
+_AGE_MAX = 2**15 - 1
+_ARTERIAL_INDEX_MAX = 2**31 - 1
+
+
+def record_dtype():
+    """NumPy structured dtype of one stored record (NumPy is only imported when asked for)."""
+    import numpy as np
+    return np.dtype([('timestamp', '<i8'), ('arterial_index', '<i4'), ('age', '<i2'), ('sex', 'u1'),
+                     ('estado', 'u1')])
+
+
+class BinaryPredictionStore(PredictionStore):
+    """
+    Prediction history as fixed-width 16-byte records.
+
+    After a 4 KiB header holding the estado names, each record packs the
+    timestamp as integer microseconds, the age, sex and arterial index of the
+    patient and the estado as an index into the name table. Appends are one
+    os.pwrite() after the last whole record under an flock, so several worker
+    processes can share the file and register new estados safely, and a torn
+    trailing record left by a crash is ignored by readers and overwritten by
+    the next append. Readers memory-map the file: as_array() is a zero-copy
+    NumPy view for analytics, and time and estado filters are answered with
+    vectorized masks.
+
+    The position of a record is its 1-based number in the whole history.
+    compact() writes the newer records to a new file, with the number of
+    removed ones in the header, and renames it over the old one under the
+    flock; every handle reopens the path once it sees its file was replaced.
+    """
+
+    max_age = _AGE_MAX
+    max_arterial_index = _ARTERIAL_INDEX_MAX
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._names: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._base = 0
+        # Descriptors of replaced files, left open for readers still mapping them
+        self._retired: List[int] = []
+        with self._exclusive():
+            if os.fstat(self._fd).st_size == 0:
+                header = _HEADER.pack(_MAGIC, RECORD_BYTES, 0, 0)
+                os.pwrite(self._fd, header.ljust(HEADER_BYTES, b'\0'), 0)
+            self._load_names()
+
+    @contextmanager
+    def _exclusive(self):
+        with self._lock:
+            while True:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                if os.fstat(self._fd).st_nlink:
+                    break
+                # Another handle compacted the store: move to the new file
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self._reopen()
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _reopen(self) -> None:
+        """Switch to the file now at `path` (caller holds the thread lock)."""
+        self._retired.append(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _refresh(self) -> int:
+        """The descriptor of the current file, for readers, after reading its header."""
+        with self._lock:
+            if not os.fstat(self._fd).st_nlink:
+                self._reopen()
+            self._load_names()
+            return self._fd
+
+    # Estado name table
+
+    def _load_names(self) -> None:
+        header = os.pread(self._fd, HEADER_BYTES, 0)
+        magic, record_bytes, n, self._base = _HEADER.unpack_from(header)
+        if magic != _MAGIC or record_bytes != RECORD_BYTES:
+            raise ValueError(f"{self.path} no es un archivo de predicciones binario compatible")
+        while len(self._names) < n:
+            start = _NAMES_AT + len(self._names) * _NAME_BYTES
+            name = header[start:start + _NAME_BYTES].rstrip(b'\0').decode('utf-8')
+            self._codes[name] = len(self._names)
+            self._names.append(name)
+
+    def _estado_code(self, estado: str) -> int:
+        """Code of `estado`, registering it in the header if needed (caller holds the lock)."""
+        code = self._codes.get(estado)
+        if code is not None:
+            return code
+        self._load_names()
+        code = self._codes.get(estado)
+        if code is not None:
+            return code
+        encoded = estado.encode('utf-8')
+        code = len(self._names)
+        if code >= MAX_ESTADOS or len(encoded) > _NAME_BYTES:
+            raise ValueError(f"No se puede registrar el estado '{estado}' en el almacenamiento binario")
+        os.pwrite(self._fd, encoded.ljust(_NAME_BYTES, b'\0'), _NAMES_AT + code * _NAME_BYTES)
+        os.pwrite(self._fd, struct.pack('<I', code + 1), _N_ESTADOS_AT)
+        self._codes[estado] = code
+        self._names.append(estado)
+        return code
+
+    def estado_names(self) -> List[str]:
+        """Estado names indexed by the `estado` codes of as_array()."""
+        self._refresh()
+        return list(self._names)
+
+    # Writes
+
+    def _pack(self, record: Dict[str, Any]) -> bytes:
+        age, sex, arterial_index = record.get('age'), record.get('sex'), record.get('arterialIndex')
+        if sex is None:
+            age = arterial_index = -1
+        elif sex not in _SEX_CODES or not 0 <= age <= _AGE_MAX or not 0 <= arterial_index <= _ARTERIAL_INDEX_MAX:
+            raise ValueError(f"Datos de entrada fuera de rango para el almacenamiento binario: "
+                             f"age={age}, sex={sex}, arterialIndex={arterial_index}")
+        return _RECORD.pack(timestamp_to_micros(record['timestamp']), arterial_index, age, _SEX_CODES[sex],
+                            self._estado_code(record['estado']))
+
+    def append_many(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Append several records with one write."""
+        with self._exclusive():
+            # Batches share one timestamp and a few distinct inputs: pack each distinct record once
+            packed: Dict[tuple, bytes] = {}
+            parts = []
+            for record in records:
+                key = tuple(record.items())
+                data = packed.get(key)
+                if data is None:
+                    data = packed[key] = self._pack(record)
+                parts.append(data)
+            data = b''.join(parts)
+            if not data:
+                return
+            written = os.pwrite(self._fd, data, HEADER_BYTES + self._count() * RECORD_BYTES)
+        if written != len(data):
+            raise OSError(f"Escritura incompleta en {self.path}: {written} de {len(data)} bytes")
+
+    def fsync(self) -> None:
+        os.fsync(self._fd)
+
+    def watermark(self) -> int:
+        fd = self._refresh()
+        return self._base + self._count(fd)
+
+    @staticmethod
+    def _copy_range(fd: int, out, offset: int, end: int) -> int:
+        while offset < end:
+            chunk = os.pread(fd, min(1 << 20, end - offset), offset)
+            out.write(chunk)
+            offset += len(chunk)
+        return offset
+
+    def compact(self, position: int) -> None:
+        """
+        Drop the records up to `position`, copying the rest to a new file.
+
+        The bulk of the copy runs while appends go on; the flock is only held
+        to copy the records appended meanwhile, write the header and rename
+        the new file over the old one. Callers serialize compactions (see
+        compaction.py).
+        """
+        fd = self._refresh()
+        n = self._count(fd)
+        removed = min(position - self._base, n)
+        if removed <= 0:
+            return
+        tmp_path = f'{self.path}.compact'
+        with open(tmp_path, 'wb') as out:
+            # The header is written last, with the estados registered during the copy
+            out.write(bytes(HEADER_BYTES))
+            offset = self._copy_range(fd, out, HEADER_BYTES + removed * RECORD_BYTES, HEADER_BYTES + n * RECORD_BYTES)
+            out.flush()
+            os.fsync(out.fileno())
+            with self._exclusive():
+                if self._fd != fd:
+                    # Replaced by another compaction since the copy started
+                    out.close()
+                    os.unlink(tmp_path)
+                    return
+                self._load_names()
+                self._copy_range(fd, out, offset, HEADER_BYTES + self._count() * RECORD_BYTES)
+                header = bytearray(os.pread(fd, HEADER_BYTES, 0))
+                _HEADER.pack_into(header, 0, _MAGIC, RECORD_BYTES, len(self._names), self._base + removed)
+                out.seek(0)
+                out.write(header)
+                out.flush()
+                os.fsync(out.fileno())
+                out.close()
+                os.replace(tmp_path, self.path)
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self._reopen()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                self._load_names()
+
+    # Reads
+
+    def _count(self, fd: Optional[int] = None) -> int:
+        return (os.fstat(self._fd if fd is None else fd).st_size - HEADER_BYTES) // RECORD_BYTES
+
+    def _record(self, timestamp: int, arterial_index: int, age: int, sex: int, estado: int) -> Dict[str, Any]:
+        record = {"estado": self._names[estado], "timestamp": micros_to_timestamp(timestamp)}
+        if sex:
+            record.update(age=age, sex=SEXES[sex], arterialIndex=arterial_index)
+        return record
+
+    def iter_from(self, position: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Yield the records after `position` in append order (without importing NumPy)."""
+        fd = self._refresh()
+        base, n = self._base, self._count(fd)
+        first = max(position - base, 0)
+        if n <= first:
+            return
+        with mmap.mmap(fd, HEADER_BYTES + n * RECORD_BYTES, prot=mmap.PROT_READ) as mapped:
+            view = memoryview(mapped)[HEADER_BYTES + first * RECORD_BYTES:]
+            try:
+                for i, values in enumerate(_RECORD.iter_unpack(view), base + first + 1):
+                    yield i, self._record(*values)
+            finally:
+                view.release()
+
+    def as_array(self):
+        """Zero-copy, read-only NumPy view of every record (dtype `record_dtype()`)."""
+        return self._array()[0]
+
+    def _array(self):
+        """(as_array(), position of its first record - 1), both from the same file."""
+        import numpy as np
+        fd = self._refresh()
+        base, n = self._base, self._count(fd)
+        if n <= 0:
+            return np.empty(0, dtype=record_dtype()), base
+        # Mapped through the descriptor, so a concurrent compaction cannot swap the file underneath
+        with open(os.dup(fd), 'rb') as f:
+            return np.memmap(f, dtype=record_dtype(), mode='r', offset=HEADER_BYTES, shape=(n,)), base
+
+    def _mask(self, array, since: Optional[str], until: Optional[str], estado: Optional[str], skip: int = 0):
+        """
+        Indexes of the records matching the filters, ignoring the first `skip`,
+        or None if an estado that was never stored is asked for.
+        """
+        import numpy as np
+        mask = np.ones(len(array), dtype=bool)
+        mask[:skip] = False
+        if since is not None:
+            mask &= array['timestamp'] >= timestamp_to_micros(since)
+        if until is not None:
+            mask &= array['timestamp'] < timestamp_to_micros(until)
+        if estado is not None:
+            names = self.estado_names()
+            if estado not in names:
+                return None
+            mask &= array['estado'] == names.index(estado)
+        return np.flatnonzero(mask)
+
+    def query(self, since: Optional[str] = None, until: Optional[str] = None,
+              estado: Optional[str] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        import numpy as np
+        array = self.as_array()
+        positions = self._mask(array, since, until, estado)
+        if positions is None or not len(positions):
+            return []
+        timestamps = array['timestamp'][positions]
+        if len(positions) > limit:
+            # The limit-th newest timestamp; among equal timestamps the earliest stored ones win, like a stable sort
+            threshold = np.partition(timestamps, len(timestamps) - limit)[len(timestamps) - limit]
+            above = positions[timestamps > threshold]
+            positions = np.concatenate([above, positions[timestamps == threshold][:limit - len(above)]])
+            timestamps = array['timestamp'][positions]
+        order = np.lexsort((positions, -timestamps))
+        self.estado_names()
+        return [self._record(*row) for row in array[positions[order]].tolist()]
+
+    def count_by_estado(self, since: Optional[str] = None, until: Optional[str] = None,
+                        estado: Optional[str] = None, after: int = 0) -> Dict[str, int]:
+        import numpy as np
+        array, base = self._array()
+        positions = self._mask(array, since, until, estado, max(after - base, 0))
+        if positions is None or not len(positions):
+            return {}
+        names = self.estado_names()
+        counts = np.bincount(array['estado'][positions], minlength=len(names))
+        return {names[code]: int(count) for code, count in enumerate(counts) if count}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            for fd in self._retired:
+                os.close(fd)
+            self._retired = []
@@ -0,0 +1,283 @@
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .aggregates import PredictionAggregates
+from .rollups import timestamp_to_micros
+from .storage import STORE_BACKENDS, PredictionStore, open_store
+
+SNAPSHOT_SUFFIX = '.snapshot.json'
+
+# Compacted records are summarized per estado and hour
+SUMMARY_BUCKET_MICROS = 3600 * 1000000
+
+# Records folded into the snapshot aggregates per add_many() call
+_FOLD_CHUNK = 10000
+
+# Filtered counts start over when a compaction replaced the snapshot while they were reading
+_COUNT_RETRIES = 5
+
+
+def snapshot_path(store: PredictionStore) -> str:
+    """The snapshot of a store lives next to it, so that it is never applied to another store."""
+    return store.path + SNAPSHOT_SUFFIX
+
+
+def _stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+
+# path -> (file stamp, snapshot): filtered counts only parse the file again after it changes
+_snapshot_cache: Dict[str, Tuple[Any, Optional[Dict[str, Any]]]] = {}
+
+
+def read_snapshot(store: PredictionStore) -> Optional[Dict[str, Any]]:
+    """
+    The last snapshot written by compact(), or None.
+
+    A snapshot holds the aggregates state (PredictionAggregates.export()) up
+    to the record at `position`; every record up to `compacted` has been
+    removed from the store and is only counted in `summary`, as
+    {hour start in epoch microseconds: {estado: count}}, and `retained` raw
+    records remain between the two.
+    """
+    path = snapshot_path(store)
+    stamp = _stamp(path)
+    cached = _snapshot_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    snapshot = None
+    if stamp is not None:
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        snapshot['summary'] = {int(start): counts for start, counts in snapshot['summary'].items()}
+    _snapshot_cache[path] = (stamp, snapshot)
+    return snapshot
+
+
+def _write_snapshot(path: str, snapshot: Dict[str, Any]) -> None:
+    data = dict(snapshot, summary={str(start): counts for start, counts in snapshot['summary'].items()})
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_aggregates(aggregates, store: PredictionStore) -> None:
+    """
+    Rebuild `aggregates` from the snapshot plus the records after it, or from the whole store.
+
+    Also finishes a compaction interrupted between writing its snapshot and
+    removing the records.
+    """
+    snapshot = read_snapshot(store)
+    if snapshot is not None:
+        store.compact(snapshot['compacted'])
+    aggregates.load(store, snapshot)
+
+
+def _due(records: Iterable[tuple], excess: int, cutoff: Optional[int]) -> Iterator[tuple]:
+    """The leading (position, timestamp, ...) records to compact: the first `excess`, then those older than `cutoff`."""
+    for i, record in enumerate(records):
+        if i >= excess and (cutoff is None or timestamp_to_micros(record[1]) >= cutoff):
+            return
+        yield record
+
+
+def _limits(retained: int, retain_records: int, retain_seconds: float, now: Optional[float]) -> Tuple[int, Optional[int]]:
+    """(records over the count limit, age cutoff in epoch microseconds) for `retained` stored records."""
+    excess = max(retained - retain_records, 0) if retain_records else 0
+    cutoff = None
+    if retain_seconds:
+        cutoff = int(((time.time() if now is None else now) - retain_seconds) * 1000000)
+    return excess, cutoff
+
+
+def compaction_boundary(records: List[Tuple[int, str]], retain_records: int = 0, retain_seconds: float = 0,
+                        now: Optional[float] = None) -> int:
+    """
+    Position of the last record to compact, given the (position, timestamp) of the stored records, oldest first.
+
+    Raw records beyond the newest `retain_records`, or older than
+    `retain_seconds`, are compacted (0 disables either limit). Only a prefix
+    of the history is ever compacted, so a record written late with an older
+    timestamp waits for the ones before it. Returns 0 when nothing is due.
+    """
+    boundary = 0
+    if retain_records or retain_seconds:
+        for record in _due(records, *_limits(len(records), retain_records, retain_seconds, now)):
+            boundary = record[0]
+    return boundary
+
+
+def compact(store: PredictionStore, retain_records: int = 0, retain_seconds: float = 0, top_k: int = 5,
+            now: Optional[float] = None) -> Optional[Dict[str, int]]:
+    """
+    Snapshot the aggregates of `store` and compact the records outside the retention window.
+
+    The previous snapshot is brought up to date with the records written
+    since, the records to compact are added to the hourly summary, and the
+    new snapshot is written before anything is removed from the store, so a
+    crash in between leaves a snapshot that load_aggregates() completes.
+    A run only reads the records written since the last one plus those it
+    compacts: the snapshot keeps the number of raw records still stored,
+    and the scan of the oldest ones stops at the first record to keep.
+    Only one process compacts a store at a time (an flock next to the
+    snapshot); returns None if another one is already at it, else the
+    snapshot position, the compacted position and the number of records
+    compacted in this run.
+    """
+    path = snapshot_path(store)
+    lock_fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        previous = read_snapshot(store)
+        aggregates = PredictionAggregates(top_k=top_k)
+        position = compacted = retained = 0
+        summary: Dict[int, Dict[str, int]] = {}
+        if previous is not None:
+            position, compacted = previous['position'], previous['compacted']
+            summary = {start: dict(counts) for start, counts in previous['summary'].items()}
+            aggregates.rebuild([], previous['aggregates'])
+            retained = previous.get('retained')
+            if retained is None:
+                # Snapshot written before the count was kept: count the raw records once
+                retained = sum(1 for record_position, _ in store.iter_from(compacted) if record_position <= position)
+
+        # Fold in what was written since the last run
+        new_records = []
+        added = 0
+        for position, record in store.iter_from(position):
+            new_records.append(record)
+            if len(new_records) >= _FOLD_CHUNK:
+                aggregates.add_many(new_records)
+                added += len(new_records)
+                new_records = []
+        aggregates.add_many(new_records)
+        added += len(new_records)
+        retained += added
+
+        removed = 0
+        if retain_records or retain_seconds:
+            excess, cutoff = _limits(retained, retain_records, retain_seconds, now)
+            with closing(store.iter_from(compacted)) as records:
+                stored = ((record_position, record['timestamp'], record['estado'])
+                          for record_position, record in records if record_position <= position)
+                for record_position, timestamp, estado in _due(stored, excess, cutoff):
+                    start = timestamp_to_micros(timestamp) // SUMMARY_BUCKET_MICROS * SUMMARY_BUCKET_MICROS
+                    counts = summary.setdefault(start, {})
+                    counts[estado] = counts.get(estado, 0) + 1
+                    compacted = record_position
+                    removed += 1
+            retained -= removed
+
+        if previous is None or added or removed:
+            _write_snapshot(path, {"position": position, "compacted": compacted, "retained": retained,
+                                   "summary": summary, "aggregates": aggregates.export()})
+        if removed:
+            store.compact(compacted)
+        return {"position": position, "compacted": compacted, "removed": removed}
+    finally:
+        os.close(lock_fd)
+
+
+def count_by_estado(store: PredictionStore, since: Optional[str] = None, until: Optional[str] = None,
+                    estado: Optional[str] = None) -> Dict[str, int]:
+    """
+    store.count_by_estado() plus the compacted records.
+
+    Compacted records only survive as hourly counts, so over the compacted
+    part of the history a time filter counts the hours that start within it.
+    The stored records are counted from the compacted position of the same
+    snapshot, so a concurrent compaction never counts a record twice.
+    """
+    for _ in range(_COUNT_RETRIES):
+        snapshot = read_snapshot(store)
+        if snapshot is None:
+            counts = store.count_by_estado(since, until, estado)
+        else:
+            counts = Counter(store.count_by_estado(since, until, estado, after=snapshot['compacted']))
+            since_micros = timestamp_to_micros(since) if since is not None else None
+            until_micros = timestamp_to_micros(until) if until is not None else None
+            for start, hour in snapshot['summary'].items():
+                if (since_micros is None or start >= since_micros) and (until_micros is None or start < until_micros):
+                    for name, count in hour.items():
+                        if estado is None or name == estado:
+                            counts[name] += count
+            counts = dict(counts)
+        if read_snapshot(store) is snapshot:
+            return counts
+    return counts
+
+
+class CompactionThread:
+    """Runs `compact` every `interval` seconds in a daemon thread; errors are kept in `last_error`."""
+
+    def __init__(self, compact: Callable[[], Any], interval: float):
+        self.compact = compact
+        self.interval = interval
+        self.last_result = None
+        self.last_error: Optional[BaseException] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='prediction-compaction', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_result = self.compact()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compactar el historial de predicciones y escribir una instantánea de los agregados."
+    )
+    parser.add_argument('--data-dir', default=os.environ.get('PREDICTION_DATA_DIR', os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument('--store', default=os.environ.get('PREDICTION_STORE', 'jsonl'), choices=STORE_BACKENDS)
+    parser.add_argument('--retain-records', type=int, default=int(os.environ.get('PREDICTION_RETAIN_RECORDS') or 0),
+                        help="Predicciones recientes que se conservan completas (0: sin límite).")
+    parser.add_argument('--retain-days', type=float, default=float(os.environ.get('PREDICTION_RETAIN_DAYS') or 0),
+                        help="Días de predicciones que se conservan completas (0: sin límite).")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.store, args.data_dir)
+    try:
+        result = compact(store, args.retain_records, args.retain_days * 86400)
+    finally:
+        store.close()
+    if result is None:
+        raise SystemExit("Otro proceso está compactando el historial.")
+    print(f"{result['removed']} predicciones compactadas; instantánea en la posición {result['position']} "
+          f"({snapshot_path(store)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Iterable, Tuple
+
+from starlette.datastructures import Headers
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against `etag`."""
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _not_modified(headers: Headers, etag: str, modified: float) -> bool:
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class ConditionalGetMiddleware:
+    """
+    ETag / Last-Modified validators and 304 answers for read-only endpoints.
+
+    `validators()` returns the current (etag, last modification time) of the
+    data behind `paths`, without touching storage. A GET whose If-None-Match
+    (or, without it, If-Modified-Since) still matches gets a 304 before the
+    endpoint runs; other successful responses carry the validators plus
+    `Cache-Control: no-cache`, so browsers and proxies keep the body and
+    revalidate it on every use.
+    """
+
+    def __init__(self, app, paths: Iterable[str], validators: Callable[[], Tuple[str, float]]):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.validators = validators
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD') or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        etag, modified = self.validators()
+        validator_headers = [
+            (b'etag', etag.encode('latin-1')),
+            (b'last-modified', formatdate(modified if modified is not None else time.time(), usegmt=True).encode('latin-1')),
+            (b'cache-control', b'no-cache'),
+        ]
+        if _not_modified(Headers(scope=scope), etag, modified or 0.0):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': validator_headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        async def send_with_validators(message):
+            if message['type'] == 'http.response.start' and message['status'] == 200:
+                message = dict(message, headers=list(message.get('headers', [])) + validator_headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
@@ -0,0 +1,254 @@
+import glob
+import math
+import mmap
+import os
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Input features and their number of histogram bins: one bin per integer value, the last one also
+# holds every larger value, so quantiles are exact below it
+FEATURES = (('age', 128), ('arterialIndex', 512))
+SEXES = ('M', 'F')
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Usual PSI reading: below 0.1 no significant change, above 0.25 a significant shift
+PSI_MODERATE, PSI_SIGNIFICANT = 0.1, 0.25
+# Bins of the PSI: deciles of the reference distribution
+_PSI_BINS = 10
+# Share given to empty bins so that the logarithm stays finite
+_PSI_EPSILON = 1e-4
+
+# Histogram layout of one window: for each sex, the bins of every feature
+_OFFSETS: Dict[Tuple[str, str], int] = {}
+_WINDOW_SLOTS = 0
+for _sex in SEXES:
+    for _feature, _bins in FEATURES:
+        _OFFSETS[_sex, _feature] = _WINDOW_SLOTS
+        _WINDOW_SLOTS += _bins
+_BINS = dict(FEATURES)
+_AGE_TOP, _ARTERIAL_INDEX_TOP = _BINS['age'] - 1, _BINS['arterialIndex'] - 1
+
+Histograms = Dict[Tuple[str, str], List[int]]
+
+
+def empty_histograms() -> Histograms:
+    return {(sex, feature): [0] * bins for sex in SEXES for feature, bins in FEATURES}
+
+
+def reference_histograms(rows: Iterable[Tuple[int, str, int]]) -> Histograms:
+    """Histograms of (age, sex, arterialIndex) rows, e.g. the training data in model.csv."""
+    histograms = empty_histograms()
+    for age, sex, arterial_index in rows:
+        if sex in SEXES:
+            histograms[sex, 'age'][min(max(age, 0), _AGE_TOP)] += 1
+            histograms[sex, 'arterialIndex'][min(max(arterial_index, 0), _ARTERIAL_INDEX_TOP)] += 1
+    return histograms
+
+
+def merge(*histograms: Histograms) -> Histograms:
+    merged = empty_histograms()
+    for h in histograms:
+        for key, counts in h.items():
+            merged[key] = [a + b for a, b in zip(merged[key], counts)]
+    return merged
+
+
+def quantiles(counts: Sequence[int], qs: Sequence[float] = QUANTILES) -> Optional[List[int]]:
+    """Value of each (ascending) quantile, like numpy's 'lower' method, or None for an empty histogram."""
+    total = sum(counts)
+    if not total:
+        return None
+    ranks = [math.floor(q * (total - 1)) for q in qs]
+    result = []
+    seen = 0
+    for value, count in enumerate(counts):
+        seen += count
+        while len(result) < len(ranks) and ranks[len(result)] < seen:
+            result.append(value)
+        if len(result) == len(ranks):
+            break
+    return result
+
+
+def psi(reference: Sequence[int], current: Sequence[int]) -> Optional[float]:
+    """
+    Population Stability Index of `current` against `reference`.
+
+    The bins are the deciles of the reference (merged when the reference has
+    few distinct values). None if either histogram is empty.
+    """
+    reference_total, current_total = sum(reference), sum(current)
+    if not reference_total or not current_total:
+        return None
+    # Bin upper edges (inclusive) at the reference deciles
+    edges = sorted(set(quantiles(reference, [i / _PSI_BINS for i in range(1, _PSI_BINS)])))
+    edges.append(len(reference) - 1)
+    score = 0.0
+    start = 0
+    for edge in edges:
+        if edge < start:
+            continue
+        expected = max(sum(reference[start:edge + 1]) / reference_total, _PSI_EPSILON)
+        actual = max(sum(current[start:edge + 1]) / current_total, _PSI_EPSILON)
+        score += (actual - expected) * math.log(actual / expected)
+        start = edge + 1
+    return score
+
+
+def _named(values: Optional[List[int]]) -> Optional[Dict[str, int]]:
+    if values is None:
+        return None
+    return {f"p{round(q * 100):02d}": value for q, value in zip(QUANTILES, values)}
+
+
+def drift_level(score: Optional[float]) -> Optional[str]:
+    if score is None:
+        return None
+    if score < PSI_MODERATE:
+        return 'estable'
+    return 'moderado' if score < PSI_SIGNIFICANT else 'significativo'
+
+
+class DriftMonitor:
+    """
+    Streaming histograms of the age and arterialIndex of every prediction, per sex.
+
+    Counts are kept in a ring of `windows` time windows of `window_seconds`
+    each, in a flat int64 buffer of constant size: an observation is two
+    counter increments, and reports never touch the prediction history.
+    Like the rollups, a window reuses its slot once it falls out of the
+    retained range.
+
+    With `directory`, every worker process counts into its own memory-mapped
+    file and reports sum the files of the workers started by the same parent
+    (files left by a previous run are removed), as MetricsRegistry does.
+    Increments are not locked; a rare lost count under thread contention is
+    accepted.
+    """
+
+    def __init__(self, window_seconds: int = 3600, windows: int = 24, directory: Optional[str] = None):
+        self.window_seconds = window_seconds
+        self.windows = windows
+        self.directory = directory
+        self._slots = windows * (1 + _WINDOW_SLOTS)
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._group = str(os.getppid())
+            for path in glob.glob(os.path.join(directory, '*_*.drift')):
+                if os.path.basename(path).split('_', 1)[0] != self._group:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            self._path = os.path.join(directory, f'{self._group}_{os.getpid()}.drift')
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.ftruncate(self._fd, 8 * self._slots)
+            self._buffer = mmap.mmap(self._fd, 8 * self._slots)
+        else:
+            self._buffer = bytearray(8 * self._slots)
+        self._q = memoryview(self._buffer).cast('q')
+
+    def _window_base(self, now: Optional[float]) -> int:
+        """Offset of the counts of the window containing `now`, clearing the slot if it held an older window."""
+        window = int((time.time() if now is None else now) // self.window_seconds)
+        slot = window % self.windows
+        q = self._q
+        # Window ids are stored +1 so that a zeroed slot means "empty"
+        if q[slot] != window + 1:
+            with self._lock:
+                if q[slot] != window + 1:
+                    base = self.windows + slot * _WINDOW_SLOTS
+                    q[base:base + _WINDOW_SLOTS] = memoryview(bytes(8 * _WINDOW_SLOTS)).cast('q')
+                    q[slot] = window + 1
+        return self.windows + slot * _WINDOW_SLOTS
+
+    def observe(self, age: int, sex: str, arterial_index: int, now: Optional[float] = None) -> None:
+        """Count one validated prediction input."""
+        offset = _OFFSETS.get((sex, 'age'))
+        if offset is None:
+            return
+        base = self._window_base(now)
+        q = self._q
+        q[base + offset + min(age, _AGE_TOP)] += 1
+        q[base + _OFFSETS[sex, 'arterialIndex'] + min(arterial_index, _ARTERIAL_INDEX_TOP)] += 1
+
+    def observe_many(self, ages: Sequence[int], sexes: Sequence[str], arterial_indexes: Sequence[int],
+                     now: Optional[float] = None) -> None:
+        """Count a batch of validated inputs with one histogram pass per sex and feature."""
+        import numpy as np
+        if not len(ages):
+            return
+        base = self._window_base(now)
+        sexes = np.asarray(sexes, dtype=object)
+        columns = {'age': np.asarray(ages, dtype=np.int64), 'arterialIndex': np.asarray(arterial_indexes, dtype=np.int64)}
+        q = self._q
+        for sex in SEXES:
+            rows = sexes == sex
+            if not rows.any():
+                continue
+            for feature, bins in FEATURES:
+                counts = np.bincount(np.clip(columns[feature][rows], 0, bins - 1), minlength=bins)
+                start = base + _OFFSETS[sex, feature]
+                for value in np.flatnonzero(counts).tolist():
+                    q[start + value] += int(counts[value])
+
+    def _buffers(self) -> List[Sequence[int]]:
+        if not self.directory:
+            return [self._q]
+        buffers = []
+        for path in glob.glob(os.path.join(self.directory, f'{self._group}_*.drift')):
+            values = array('q')
+            try:
+                with open(path, 'rb') as f:
+                    values.frombytes(f.read())
+            except FileNotFoundError:
+                continue
+            if len(values) == self._slots:
+                buffers.append(values)
+        return buffers
+
+    def histograms(self, now: Optional[float] = None) -> Tuple[Histograms, Histograms]:
+        """(histograms of the window containing `now`, histograms of the older retained windows)."""
+        current_window = int((time.time() if now is None else now) // self.window_seconds)
+        current, previous = empty_histograms(), empty_histograms()
+        for q in self._buffers():
+            for slot in range(self.windows):
+                window = q[slot] - 1
+                if window < 0 or not current_window - self.windows < window <= current_window:
+                    continue
+                target = current if window == current_window else previous
+                base = self.windows + slot * _WINDOW_SLOTS
+                for key, offset in _OFFSETS.items():
+                    counts = target[key]
+                    start = base + offset
+                    for i, count in enumerate(q[start:start + len(counts)]):
+                        if count:
+                            counts[i] += count
+        return current, previous
+
+    def close(self) -> None:
+        if self.directory:
+            self._q.release()
+            self._buffer.close()
+            os.close(self._fd)
+
+
+def drift_report(current: Histograms, reference: Histograms) -> List[Dict]:
+    """Per sex and feature: counts, quantiles of both distributions, PSI and its reading."""
+    report = []
+    for (sex, feature), counts in current.items():
+        score = psi(reference[sex, feature], counts)
+        report.append({
+            "sex": sex,
+            "feature": feature,
+            "count": sum(counts),
+            "reference_count": sum(reference[sex, feature]),
+            "quantiles": _named(quantiles(counts)),
+            "reference_quantiles": _named(quantiles(reference[sex, feature])),
+            "psi": score,
+            "drift": drift_level(score),
+        })
+    return report
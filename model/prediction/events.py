@@ -0,0 +1,98 @@
+import asyncio
+import json
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+# Queue markers: replace the backlog with a fresh snapshot, or end the stream
+_RESYNC = object()
+_CLOSE = object()
+
+
+def format_event(event: str, data: Dict) -> str:
+    """A Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class EventBroadcaster:
+    """
+    In-memory fan-out of Server-Sent Events to every /events subscriber.
+
+    publish() can be called from any thread (request threads, the
+    write-behind writer): the message is serialized once and handed to the
+    event loop, which puts it on each subscriber's bounded queue. A
+    subscriber that falls `max_queue` messages behind loses its backlog and
+    gets a single fresh snapshot instead, so a slow client never holds
+    memory or slows down the others.
+    """
+
+    def __init__(self, max_queue: int = 100, heartbeat: float = 15.0):
+        self.max_queue = max_queue
+        self.heartbeat = heartbeat
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._closed = False
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._closed = False
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, message: str) -> None:
+        """Send a formatted message to every subscriber; a no-op while nobody listens."""
+        loop = self._loop
+        if loop is None or not self._subscribers or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._fan_out(message)
+        else:
+            loop.call_soon_threadsafe(self._fan_out, message)
+
+    def _fan_out(self, message) -> None:
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow consumer: drop what it has not read and resynchronize it
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(_CLOSE if message is _CLOSE else _RESYNC)
+
+    async def subscribe(self, snapshot: Callable[[], str],
+                        disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator[str]:
+        """
+        Yield `snapshot()`, then every published message, with comment heartbeats while idle.
+
+        The stream ends on close(), or at a heartbeat once `disconnected()`
+        says the client has gone away.
+        """
+        if self._closed:
+            return
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue)
+        self._subscribers.add(queue)
+        try:
+            yield snapshot()
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    if disconnected is not None and await disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if message is _CLOSE:
+                    return
+                yield snapshot() if message is _RESYNC else message
+        finally:
+            self._subscribers.discard(queue)
+
+    def close(self) -> None:
+        """End every open stream, and any opened later, until the next start(), e.g. at shutdown."""
+        self._closed = True
+        if self._loop is not None and self._subscribers and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._fan_out, _CLOSE)
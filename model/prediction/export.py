@@ -0,0 +1,179 @@
+import argparse
+import os
+import sys
+from contextlib import closing
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from .rollups import timestamp_to_micros
+from .storage import STORE_BACKENDS, PredictionStore, open_store
+
+EXPORT_FORMATS = ('parquet', 'arrow')
+EXPORT_MEDIA_TYPES = {'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.stream'}
+EXPORT_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrows'}
+
+# Rows per Arrow record batch, i.e. per Parquet row group and per chunk sent to the client
+EXPORT_BATCH_ROWS = 65536
+
+SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('estado', pa.string()),
+    # Null for records written before the patient inputs were stored
+    ('age', pa.int64()),
+    ('sex', pa.string()),
+    ('arterialIndex', pa.int64()),
+])
+
+
+class _ChunkSink:
+    """Write-only file object that keeps what a pyarrow writer emits until take() hands it out."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _read_chunk(store: PredictionStore, position: int, end: int, rows: int, since: Optional[str],
+                until: Optional[str], estado: Optional[str]) -> Tuple[int, List[Dict[str, Any]], bool]:
+    """
+    (position reached, matching records, finished) after scanning at most `rows` records from `position`.
+
+    The store iterator is opened and closed within the call, so a streamed
+    export can resume on another thread (SQLite connections are per thread).
+    """
+    matching = []
+    scanned = 0
+    with closing(store.iter_from(position)) as records:
+        for record_position, record in islice(records, rows):
+            if record_position > end:
+                return position, matching, True
+            position = record_position
+            scanned += 1
+            timestamp = record['timestamp']
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp >= until:
+                continue
+            if estado is not None and record['estado'] != estado:
+                continue
+            matching.append(record)
+    return position, matching, scanned < rows
+
+
+def iter_record_batches(store: PredictionStore, since: Optional[str] = None, until: Optional[str] = None,
+                        estado: Optional[str] = None, batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[pa.RecordBatch]:
+    """
+    The matching records of `store`, in append order, as Arrow record batches of up to `batch_rows` rows.
+
+    Only the records stored when the export starts are included, so a long
+    export has a well-defined end while predictions keep arriving. Records
+    already folded into a snapshot by the compaction are not included.
+    """
+    end = store.watermark()
+    position = 0
+    pending: List[Dict[str, Any]] = []
+    finished = False
+    while not finished:
+        position, matching, finished = _read_chunk(store, position, end, batch_rows, since, until, estado)
+        pending.extend(matching)
+        while len(pending) >= batch_rows or (finished and pending):
+            yield _record_batch(pending[:batch_rows])
+            pending = pending[batch_rows:]
+
+
+def _record_batch(records: List[Dict[str, Any]]) -> pa.RecordBatch:
+    return pa.record_batch([
+        pa.array([timestamp_to_micros(r['timestamp']) for r in records], type=SCHEMA.field('timestamp').type),
+        pa.array([r['estado'] for r in records], type=pa.string()),
+        pa.array([r.get('age') for r in records], type=pa.int64()),
+        pa.array([r.get('sex') for r in records], type=pa.string()),
+        pa.array([r.get('arterialIndex') for r in records], type=pa.int64()),
+    ], schema=SCHEMA)
+
+
+def export_stream(store: PredictionStore, format: str = 'parquet', since: Optional[str] = None,
+                  until: Optional[str] = None, estado: Optional[str] = None,
+                  batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """
+    Encode the matching history as Parquet (one row group per batch) or as an Arrow IPC stream.
+
+    Yields the bytes of each batch as soon as it is encoded, so memory use
+    depends on `batch_rows`, not on the size of the history. An empty
+    export is still a valid file with the schema and no rows.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: '{format}'")
+    sink = _ChunkSink()
+    if format == 'parquet':
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), SCHEMA, compression='zstd')
+    else:
+        writer = ipc.new_stream(pa.PythonFile(sink, mode='w'), SCHEMA)
+    with writer:
+        for batch in iter_record_batches(store, since, until, estado, batch_rows):
+            writer.write_batch(batch)
+            data = sink.take()
+            if data:
+                yield data
+    data = sink.take()
+    if data:
+        yield data
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Exportar el historial de predicciones en formato Parquet o Arrow IPC.")
+    parser.add_argument('--data-dir', default=os.environ.get('PREDICTION_DATA_DIR', os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument('--store', default=os.environ.get('PREDICTION_STORE', 'jsonl'), choices=STORE_BACKENDS)
+    parser.add_argument('--format', default='parquet', choices=EXPORT_FORMATS)
+    parser.add_argument('--since', help="Solo predicciones con timestamp >= since (ISO-8601 en UTC).")
+    parser.add_argument('--until', help="Solo predicciones con timestamp < until (ISO-8601 en UTC).")
+    parser.add_argument('--estado', help="Solo predicciones con este estado.")
+    parser.add_argument('--batch-rows', type=int, default=EXPORT_BATCH_ROWS,
+                        help="Filas por lote (grupo de filas en Parquet).")
+    parser.add_argument('--output', required=True, help="Archivo de salida ('-' para la salida estándar).")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.store, args.data_dir)
+    try:
+        out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            size = 0
+            for data in export_stream(store, args.format, args.since, args.until, args.estado, args.batch_rows):
+                out.write(data)
+                size += len(data)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    finally:
+        store.close()
+    if args.output != '-':
+        print(f"{size} bytes exportados a {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
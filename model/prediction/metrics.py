@@ -0,0 +1,304 @@
+import glob
+import json
+import mmap
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from 100 µs to 10 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+# float64 slots per process; each counter takes 1, each histogram len(buckets) + 2
+_CAPACITY = 65536
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Counter:
+    __slots__ = ('_values', '_slot')
+
+    def __init__(self, values: memoryview, slot: int):
+        self._values = values
+        self._slot = slot
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._values[self._slot] += amount
+
+
+class _Histogram:
+    __slots__ = ('_values', '_base', '_sum', '_bounds')
+
+    def __init__(self, values: memoryview, slot: int, bounds: Tuple[float, ...]):
+        self._values = values
+        self._base = slot
+        self._sum = slot + len(bounds) + 1
+        self._bounds = bounds
+
+    def observe(self, value: float) -> None:
+        # Buckets are stored non-cumulative (one increment per observation) and summed when rendered
+        values = self._values
+        values[self._base + bisect_left(self._bounds, value)] += 1
+        values[self._sum] += value
+
+
+class _Family:
+    def __init__(self, registry: 'MetricsRegistry', name: str, labelnames: Sequence[str]):
+        self._registry = registry
+        self.name = name
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """The child for these label values, created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._create(tuple(str(v) for v in values))
+        return child
+
+
+class CounterFamily(_Family):
+    def _create(self, values: Tuple[str, ...]) -> _Counter:
+        return _Counter(self._registry._values, self._registry._allocate(self.name, values, 1))
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class HistogramFamily(_Family):
+    def __init__(self, registry: 'MetricsRegistry', name: str, labelnames: Sequence[str], buckets: Sequence[float]):
+        super().__init__(registry, name, labelnames)
+        self.buckets = tuple(float(b) for b in buckets)
+
+    def _create(self, values: Tuple[str, ...]) -> _Histogram:
+        slot = self._registry._allocate(self.name, values, len(self.buckets) + 2)
+        return _Histogram(self._registry._values, slot, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class MetricsRegistry:
+    """
+    Counters, histograms and scrape-time gauges rendered in the Prometheus text format.
+
+    Every series owns fixed float64 slots in one flat buffer, so an update is
+    a couple of indexed additions with no lock and no allocation (well under
+    a microsecond). Updates from concurrent threads are not serialized: an
+    increment is only lost if a thread switch lands between its read and
+    its write, which is rare and acceptable for monitoring.
+
+    With `directory`, the buffer is a memory-mapped file per worker process
+    plus a JSON index of its series, and render() sums the files of every
+    worker started by the same parent (uvicorn/gunicorn master), or with
+    the same `group`. Files left by another group, i.e. a previous run of
+    the service, are removed.
+    """
+
+    def __init__(self, directory: Optional[str] = None, group: Optional[str] = None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._families: Dict[str, Tuple[str, str, _Family]] = {}
+        self._gauges: List[Tuple[str, str, Callable[[], float]]] = []
+        self._index: List[Tuple[str, Tuple[str, ...], int]] = []
+        self._next = 0
+        self._pid = os.getpid()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._group = group or str(os.getppid())
+            self._remove_stale_files()
+            base = os.path.join(directory, f'{self._group}_{self._pid}')
+            self._data_path, self._index_path = base + '.db', base + '.json'
+            self._fd = os.open(self._data_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.ftruncate(self._fd, 8 * _CAPACITY)
+            self._buffer = mmap.mmap(self._fd, 8 * _CAPACITY)
+            self._write_index()
+        else:
+            self._buffer = bytearray(8 * _CAPACITY)
+        self._values = memoryview(self._buffer).cast('d')
+
+    def _remove_stale_files(self) -> None:
+        for path in glob.glob(os.path.join(self.directory, '*_*.json')):
+            group = os.path.basename(path).split('_', 1)[0]
+            if group != self._group:
+                for stale in (path, path[:-len('.json')] + '.db'):
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+
+    # Registration
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> CounterFamily:
+        family = CounterFamily(self, name, labelnames)
+        self._families[name] = ('counter', help, family)
+        return family
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> HistogramFamily:
+        family = HistogramFamily(self, name, labelnames, buckets)
+        self._families[name] = ('histogram', help, family)
+        return family
+
+    def gauge(self, name: str, help: str, callback: Callable[[], float]) -> None:
+        """A gauge read from `callback` by the worker answering the scrape."""
+        self._gauges.append((name, help, callback))
+
+    def _allocate(self, name: str, labels: Tuple[str, ...], size: int) -> int:
+        with self._lock:
+            slot = self._next
+            if slot + size > _CAPACITY:
+                raise RuntimeError(f"Sin espacio para la métrica {name}{labels}")
+            self._next += size
+            self._index.append((name, labels, slot))
+            if self.directory:
+                self._write_index()
+        return slot
+
+    def _write_index(self) -> None:
+        tmp_path = f'{self._index_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump([[name, list(labels), slot] for name, labels, slot in self._index], f)
+        os.replace(tmp_path, self._index_path)
+
+    # Exposition
+
+    def _collect(self) -> Dict[Tuple[str, Tuple[str, ...]], List[float]]:
+        """Slot values per series, summed over the worker files when multiprocess."""
+        sizes = {name: (len(family.buckets) + 2 if kind == 'histogram' else 1)
+                 for name, (kind, _, family) in self._families.items()}
+        totals: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+
+        def add(index, values):
+            for name, labels, slot in index:
+                size = sizes.get(name)
+                if size is None:
+                    continue
+                current = totals.setdefault((name, tuple(labels)), [0.0] * size)
+                for i in range(size):
+                    current[i] += values[slot + i]
+
+        if not self.directory:
+            with self._lock:
+                index = list(self._index)
+            add(index, self._values)
+            return totals
+
+        for index_path in glob.glob(os.path.join(self.directory, f'{self._group}_*.json')):
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+                values = array('d')
+                with open(index_path[:-len('.json')] + '.db', 'rb') as f:
+                    values.frombytes(f.read())
+            except (FileNotFoundError, ValueError):
+                continue
+            add(index, values)
+        return totals
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        totals = self._collect()
+        lines = []
+        for name, (kind, help, family) in self._families.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (series, labels), values in sorted(totals.items()):
+                if series != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels_text(family.labelnames, labels)} {_format_value(values[0])}')
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(family.buckets + (float('inf'),), values):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                    lines.append(f'{name}_bucket{_labels_text(family.labelnames, labels, le)} '
+                                 f'{_format_value(cumulative)}')
+                lines.append(f'{name}_count{_labels_text(family.labelnames, labels)} {_format_value(cumulative)}')
+                lines.append(f'{name}_sum{_labels_text(family.labelnames, labels)} {_format_value(values[-1])}')
+        for name, help, callback in self._gauges:
+            try:
+                value = float(callback())
+            except Exception:
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self) -> None:
+        if self.directory:
+            self._values.release()
+            self._buffer.close()
+            os.close(self._fd)
+
+
+class MetricsMiddleware:
+    """
+    Per-route request counts and latency histograms for every HTTP request.
+
+    Requests are labelled with the route template (e.g. "/getprediction"),
+    or "unmatched" for 404s, so arbitrary URLs cannot grow the number of
+    series. Responses sent before routing (a 304 from the conditional GET
+    middleware, a 503 from admission control) are labelled by matching the
+    request against `routes`. Latency is measured until the last body chunk
+    has been sent.
+    """
+
+    def __init__(self, app, requests: CounterFamily, latency: HistogramFamily, routes: Sequence = ()):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.routes = routes
+
+    def _route_path(self, scope) -> str:
+        route = scope.get('route')
+        if route is not None:
+            return getattr(route, 'path', 'unmatched')
+        from starlette.routing import Match
+
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route
+        return partial.path if partial is not None else 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_and_measure(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                path = self._route_path(scope)
+                self.latency.labels(scope['method'], path).observe(time.perf_counter() - started)
+                self.requests.labels(scope['method'], path, status[0]).inc()
+
+        await self.app(scope, receive, send_and_measure)
@@ -0,0 +1,142 @@
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional, Sequence
+
+# Leaf frames in these modules are threads waiting for work (idle executor threads, the event loop in select)
+_IDLE_FILES = ('threading.py', 'selectors.py', 'queue.py')
+
+PROFILE_HEADER = 'x-profile'
+PROFILE_FILE_HEADER = 'x-profile-file'
+
+
+def _collapse(frame) -> Optional[str]:
+    """A stack as 'outer;...;inner' frames, or None for an idle thread."""
+    if os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the Python stack of every busy thread every `interval` seconds.
+
+    Sync endpoints run in a worker thread the middleware does not know in
+    advance, so every thread is sampled (other requests served at the same
+    time may appear in the profile) and threads idle in a wait are skipped.
+    On finish() the thread writes the samples in the collapsed-stack format
+    ("thread;frame;...;frame count" per line, the input of flamegraph.pl,
+    speedscope or inferno) to `path` and calls `on_done`, off the request path.
+    """
+
+    def __init__(self, interval: float, max_duration: float, on_done):
+        super().__init__(name='profiler', daemon=True)
+        self.interval = interval
+        self.max_duration = max_duration
+        self.path: Optional[str] = None
+        self._on_done = on_done
+        self._finished = threading.Event()
+        self.samples: Counter = Counter()
+
+    def finish(self, path: Optional[str]) -> None:
+        """Stop sampling and write the profile to `path` (nothing is written if None)."""
+        self.path = path
+        self._finished.set()
+
+    def run(self) -> None:
+        try:
+            me = threading.get_ident()
+            names = {}
+            deadline = time.monotonic() + self.max_duration
+            while not self._finished.wait(self.interval) and time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = _collapse(frame)
+                    if stack is None:
+                        continue
+                    name = names.get(ident)
+                    if name is None:
+                        names = {t.ident: t.name.replace(';', '_').replace(' ', '_') for t in threading.enumerate()}
+                        name = names.get(ident, str(ident))
+                    self.samples[f'{name};{stack}'] += 1
+            self._finished.wait()
+            if self.path is not None:
+                tmp_path = f'{self.path}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for stack, count in self.samples.most_common():
+                        f.write(f'{stack} {count}\n')
+                os.replace(tmp_path, self.path)
+        finally:
+            self._on_done()
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in sampling profiler for selected requests.
+
+    A request is profiled when it sends the `X-Profile` header with the
+    configured token, or at random with probability `sample_rate` (paths in
+    `exclude`, such as long-lived streams, are never sampled at random). At
+    most `max_concurrent` requests are profiled at once; requests beyond the
+    cap run normally, so enabling it under load adds at most that many
+    sampler threads. The profile of each request is written to `directory`
+    as a collapsed-stack file, named in the `X-Profile-File` response header.
+    """
+
+    def __init__(self, app, directory: str, token: str = '', sample_rate: float = 0.0, max_concurrent: int = 1,
+                 interval: float = 0.001, max_duration: float = 60.0, exclude: Sequence[str] = ()):
+        self.app = app
+        self.directory = directory
+        self.token = token.encode('latin-1')
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_duration = max_duration
+        self.exclude = frozenset(exclude)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._ids = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def _selected(self, scope) -> bool:
+        if self.token:
+            for name, value in scope['headers']:
+                if name == PROFILE_HEADER.encode('latin-1'):
+                    return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and scope['path'] not in self.exclude and random.random() < self.sample_rate
+
+    def _filename(self, scope) -> str:
+        route = getattr(scope.get('route'), 'path', scope['path'])
+        slug = ''.join(c if c.isalnum() else '_' for c in route).strip('_') or 'root'
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        return f'{stamp}-{scope["method"]}-{slug}-{os.getpid()}-{next(self._ids)}.folded'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self._selected(scope) or not self._slots.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        sampler = StackSampler(self.interval, self.max_duration, self._slots.release)
+        filename = None
+
+        async def send_with_filename(message):
+            nonlocal filename
+            if message['type'] == 'http.response.start':
+                filename = self._filename(scope)
+                message = {**message, 'headers': [*message.get('headers', []),
+                                                  (PROFILE_FILE_HEADER.encode('latin-1'), filename.encode('latin-1'))]}
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_filename)
+        finally:
+            sampler.finish(os.path.join(self.directory, filename) if filename else None)
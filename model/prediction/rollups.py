@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import pytz
+
+# Maximum number of distinct estados tracked by the fixed-width aggregate layouts
+MAX_ESTADOS = 32
+
+# Bucket width in seconds and number of buckets retained, per granularity
+GRANULARITIES = {
+    'minute': (60, 2 * 24 * 60),
+    'hour': (3600, 90 * 24),
+    'day': (86400, 10 * 366),
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+_ZERO_COUNTS = memoryview(bytes(8 * MAX_ESTADOS)).cast('q')
+
+
+def timestamp_to_micros(timestamp: str) -> int:
+    """ISO-8601 timestamp to integer microseconds since the Unix epoch."""
+    value = datetime.fromisoformat(timestamp)
+    if value.tzinfo is None:
+        value = pytz.UTC.localize(value)
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def micros_to_timestamp(micros: int) -> str:
+    """Integer microseconds since the Unix epoch to a UTC ISO-8601 timestamp."""
+    return (_EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+class BucketRings:
+    """
+    Per-estado prediction counts in fixed-size time buckets, one ring per granularity.
+
+    The rings live in a flat int64 buffer (a bytearray in-process, the shared
+    memory-mapped file across workers). Each ring slot holds a bucket id plus
+    MAX_ESTADOS counters; a bucket reuses its slot once it falls out of the
+    retained window, so memory is constant and a query touches one slot per
+    bucket in the requested range, never individual predictions. Predictions
+    older than the retained window of a granularity are not counted in it.
+    """
+
+    def __init__(self, q: memoryview):
+        self._q = q
+        self._layout = {}
+        offset = 0
+        for name, (width, capacity) in GRANULARITIES.items():
+            head_at = offset
+            ids_at = head_at + 1
+            counts_at = ids_at + capacity
+            self._layout[name] = (width * 1000000, capacity, head_at, ids_at, counts_at)
+            offset = counts_at + capacity * MAX_ESTADOS
+
+    @staticmethod
+    def slots() -> int:
+        """Number of int64 slots the rings need."""
+        return sum(1 + capacity * (1 + MAX_ESTADOS) for _, capacity in GRANULARITIES.values())
+
+    def add(self, micros: int, estado_index: int, count: int = 1) -> None:
+        for layout in self._layout.values():
+            self._add(layout, micros, estado_index, count)
+
+    def _add(self, layout: tuple, micros: int, estado_index: int, count: int) -> None:
+        q = self._q
+        width, capacity, head_at, ids_at, counts_at = layout
+        # Bucket ids are stored +1 so that a zeroed slot means "empty"
+        bucket = micros // width
+        head = q[head_at] - 1
+        if bucket > head:
+            q[head_at] = bucket + 1
+        elif bucket <= head - capacity:
+            return
+        slot = bucket % capacity
+        if q[ids_at + slot] - 1 != bucket:
+            q[ids_at + slot] = bucket + 1
+            base = counts_at + slot * MAX_ESTADOS
+            q[base:base + MAX_ESTADOS] = _ZERO_COUNTS
+        q[counts_at + slot * MAX_ESTADOS + estado_index] += count
+
+    def export(self) -> Dict[str, List[Tuple[int, List[int]]]]:
+        """Every retained non-empty bucket, per granularity, as returned by query(); restore() reads it back."""
+        return {name: self.query(name, 0, 2**62) for name in self._layout}
+
+    def restore(self, granularity: str, buckets: List[Tuple[int, Dict[int, int]]]) -> None:
+        """Add exported (bucket start, {estado index: count}) buckets, oldest first, to one granularity."""
+        layout = self._layout[granularity]
+        for start, counts in buckets:
+            for estado_index, count in counts.items():
+                self._add(layout, start, estado_index, count)
+
+    def query(self, granularity: str, since_micros: int, until_micros: int) -> List[Tuple[int, List[int]]]:
+        """(bucket start in epoch microseconds, counts per estado index) for the non-empty buckets in [since, until)."""
+        q = self._q
+        width, capacity, head_at, ids_at, counts_at = self._layout[granularity]
+        head = q[head_at] - 1
+        first = max(since_micros // width, head - capacity + 1)
+        last = min((until_micros - 1) // width, head)
+        result = []
+        for bucket in range(first, last + 1):
+            slot = bucket % capacity
+            if q[ids_at + slot] != bucket + 1:
+                continue
+            base = counts_at + slot * MAX_ESTADOS
+            counts = q[base:base + MAX_ESTADOS].tolist()
+            if any(counts):
+                result.append((bucket * width, counts))
+        return result
+
+    def window(self, granularity: str) -> int:
+        """Length of the retained window of `granularity`, in microseconds."""
+        width, capacity = self._layout[granularity][:2]
+        return width * capacity
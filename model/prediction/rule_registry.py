@@ -0,0 +1,269 @@
+import json
+import os
+import re
+import threading
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .rules import RuleEngine
+
+DEFAULT_VERSION = 'default'
+STATE_FILENAME = 'state.json'
+
+_VERSION_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+
+
+def _bounds(conditions: dict) -> List[Any]:
+    """Every age and arterial index bound of a conditions.json document."""
+    bounds = [conditions['default_threshold']['arterial_index']]
+    for condition in conditions['conditions']:
+        bounds.extend(condition['age_range'])
+        for rule in condition['rules']:
+            bounds.extend(rule['arterial_index'])
+    return bounds
+
+
+def compile_rules(conditions: dict) -> RuleEngine:
+    """Compile a conditions.json document, raising ValueError if it is malformed."""
+    try:
+        engine = RuleEngine(conditions)
+        # Exercise both lookup paths once, so that a broken table fails here and not on live traffic
+        engine.classify(0, 'M', 0)
+        bounds = _bounds(conditions)
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Reglas inválidas: {e!r}")
+    # classify_many compiles the bounds to int64 keys: with a fractional bound, batch and
+    # single-patient predictions would disagree
+    for bound in bounds:
+        if not isinstance(bound, int) or isinstance(bound, bool):
+            raise ValueError(f"Reglas inválidas: los límites de edad e índice arterial deben ser números enteros ({bound!r})")
+    return engine
+
+
+class RuleRegistry:
+    """
+    Precompiled rule set versions, one of them active and any others shadowed.
+
+    The active version is a single (name, engine) tuple replaced in one
+    assignment: a request reads it once and keeps using the engine it got,
+    so a swap never pauses or fails in-flight classifications.
+
+    Shadow evaluation is off the response path: the request appends its
+    inputs and live estado to a bounded deque and a background thread
+    classifies them with every shadow version, counting agreements and
+    disagreements (and calling `on_result(version, agreed, disagreed)`).
+    If the thread falls `max_pending` items behind, new items are dropped
+    and counted rather than slowing requests down.
+
+    Versions are stored as `<version>.json` under `directory` (created on
+    the first change), with the active and shadow selection in state.json,
+    so that a restart (or, via reload(), another worker process) picks up
+    the same configuration. The 'default' version is conditions.json.
+    """
+
+    def __init__(self, directory: str, default_conditions: dict,
+                 on_result: Optional[Callable[[str, int, int], None]] = None, max_pending: int = 10000):
+        self.directory = directory
+        self.on_result = on_result
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._engines: Dict[str, RuleEngine] = {DEFAULT_VERSION: compile_rules(default_conditions)}
+        self.active: Tuple[str, RuleEngine] = (DEFAULT_VERSION, self._engines[DEFAULT_VERSION])
+        self._shadows: Tuple[Tuple[str, RuleEngine], ...] = ()
+        self._pending: deque = deque()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._stats: Dict[str, Counter] = {}
+        self._dropped = 0
+        self._state_stamp = None
+        self.reload()
+
+    # Versions
+
+    def _path(self, version: str) -> str:
+        return os.path.join(self.directory, f'{version}.json')
+
+    def _engine(self, version: str) -> RuleEngine:
+        """The compiled engine of `version`, loading it from its file if needed (caller holds the lock)."""
+        engine = self._engines.get(version)
+        if engine is None:
+            try:
+                with open(self._path(version), 'r') as f:
+                    conditions = json.load(f)
+            except (FileNotFoundError, ValueError):
+                raise KeyError(f"Versión de reglas desconocida: '{version}'")
+            engine = self._engines[version] = compile_rules(conditions)
+        return engine
+
+    def versions(self) -> List[str]:
+        try:
+            names = {name[:-len('.json')] for name in os.listdir(self.directory)
+                     if name.endswith('.json') and name != STATE_FILENAME}
+        except FileNotFoundError:
+            names = set()
+        return sorted(names | {DEFAULT_VERSION})
+
+    def add(self, version: str, conditions: dict) -> None:
+        """Compile and store a new version; existing versions are immutable."""
+        if not _VERSION_NAME.match(version) or version == DEFAULT_VERSION or f'{version}.json' == STATE_FILENAME:
+            raise ValueError(f"Nombre de versión inválido: '{version}'")
+        engine = compile_rules(conditions)
+        with self._lock:
+            if version in self._engines or os.path.exists(self._path(version)):
+                raise FileExistsError(f"La versión de reglas '{version}' ya existe")
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f'{self._path(version)}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(conditions, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self._path(version))
+            self._engines[version] = engine
+
+    # Selection
+
+    def activate(self, version: str) -> None:
+        """Make `version` the active rule set for every following classification."""
+        with self._lock:
+            self.active = (version, self._engine(version))
+            self._save_state()
+
+    def set_shadows(self, versions: Sequence[str]) -> None:
+        """Evaluate `versions` in the background on every classification (an empty list stops shadowing)."""
+        with self._lock:
+            self._shadows = tuple((version, self._engine(version)) for version in dict.fromkeys(versions))
+            self._save_state()
+
+    @property
+    def shadow_versions(self) -> List[str]:
+        return [version for version, _ in self._shadows]
+
+    def _save_state(self) -> None:
+        state = {"active": self.active[0], "shadows": self.shadow_versions}
+        path = os.path.join(self.directory, STATE_FILENAME)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{path}.tmp', path)
+        self._state_stamp = self._stamp()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, STATE_FILENAME))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+
+    def reload(self) -> None:
+        """Apply state.json if it changed since it was last read or written (e.g. by another worker)."""
+        stamp = self._stamp()
+        if stamp is None or stamp == self._state_stamp:
+            return
+        with self._lock:
+            try:
+                with open(os.path.join(self.directory, STATE_FILENAME), 'r') as f:
+                    state = json.load(f)
+                active = (state['active'], self._engine(state['active']))
+                shadows = tuple((version, self._engine(version)) for version in state.get('shadows', []))
+            except (FileNotFoundError, ValueError, KeyError):
+                return
+            self.active, self._shadows = active, shadows
+            self._state_stamp = stamp
+
+    # Shadow evaluation
+
+    def shadow(self, age: int, sex: str, arterial_index: int, estado: str) -> None:
+        """Queue one classification, with the estado the active version gave, for the shadow versions."""
+        if not self._shadows:
+            return
+        if len(self._pending) >= self.max_pending:
+            self._dropped += 1
+            return
+        self._pending.append((None, age, sex, arterial_index, estado))
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def shadow_many(self, engine: RuleEngine, ages: Sequence[int], sexes: Sequence[str],
+                    arterial_indexes: Sequence[int]) -> None:
+        """
+        Queue a batch classified with `engine` (the active one when the batch started).
+
+        The live estados are recomputed by the background thread, so the batch
+        path does not have to keep its pre-sampling estados around.
+        """
+        if not self._shadows or not len(ages):
+            return
+        if len(self._pending) >= self.max_pending:
+            self._dropped += len(ages)
+            return
+        self._pending.append((engine, ages, sexes, arterial_indexes, None))
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def start(self) -> None:
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='rules-shadow', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.drain()
+            if not self._running:
+                return
+
+    def _evaluate(self, item) -> None:
+        engine, ages, sexes, arterial_indexes, estado = item
+        live = None
+        for version, shadow_engine in self._shadows:
+            if engine is None:
+                pairs = [(estado, shadow_engine.classify(ages, sexes, arterial_indexes))]
+            else:
+                if live is None:
+                    live = engine.classify_many(ages, sexes, arterial_indexes)
+                pairs = zip(live, shadow_engine.classify_many(ages, sexes, arterial_indexes))
+            stats = self._stats.setdefault(version, Counter())
+            agreed = disagreed = 0
+            for active_estado, shadow_estado in pairs:
+                if active_estado == shadow_estado:
+                    agreed += 1
+                else:
+                    disagreed += 1
+                    stats[active_estado, shadow_estado] += 1
+            stats['agree'] += agreed
+            stats['disagree'] += disagreed
+            if self.on_result is not None:
+                self.on_result(version, agreed, disagreed)
+
+    def drain(self) -> None:
+        """Evaluate everything queued so far in the calling thread."""
+        while self._pending:
+            self._evaluate(self._pending.popleft())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per shadow version: agreements, disagreements and how often each (active, shadow) estado pair differed."""
+        result = {}
+        for version, counter in list(self._stats.items()):
+            counter = dict(counter)
+            agree, disagree = counter.pop('agree', 0), counter.pop('disagree', 0)
+            pairs = sorted(counter.items(), key=lambda item: -item[1])
+            result[version] = {
+                "agree": agree,
+                "disagree": disagree,
+                "agreement": agree / (agree + disagree) if agree + disagree else None,
+                "disagreements": [{"active": a, "shadow": b, "count": n} for (a, b), n in pairs],
+            }
+        return result
+
+    @property
+    def dropped(self) -> int:
+        """Shadow evaluations skipped because the background thread was behind."""
+        return self._dropped
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,152 @@
+from bisect import bisect_right
+from typing import Dict, List, Sequence, Tuple
+
+NO_ENFERMO = 'NO ENFERMO'
+ENFERMEDAD_AGUDA = 'ENFERMEDAD AGUDA'
+
+# Lower bound used for the first interval of every lookup table, so any
+# integer input (even below the smallest range) lands in a valid slot.
+_NEG_INF = float('-inf')
+
+# Arterial indexes beyond +/-_MAX_INDEX are clamped by classify_many, which
+# gives every table its own _TABLE_SPAN-wide range of int64 keys
+_MAX_INDEX = 2 ** 40
+_TABLE_SPAN = 2 ** 42
+
+
+def evaluate_conditions(conditions: dict, age: int, sex: str, arterial_index: int) -> str:
+    """
+    Reference evaluation of the rules: first matching condition/rule wins,
+    otherwise the default_threshold decides between 'NO ENFERMO' and
+    'ENFERMEDAD AGUDA'. Only used while compiling a RuleEngine.
+    """
+    estado = None
+    for condition in conditions['conditions']:
+        age_range = condition['age_range']
+        if age_range[0] <= age <= age_range[1]:
+            for rule in condition['rules']:
+                if rule['sex'] == sex and rule['arterial_index'][0] <= arterial_index <= rule['arterial_index'][1]:
+                    estado = rule['estado']
+                    break
+            if estado:
+                break
+
+    if not estado:
+        if arterial_index <= conditions['default_threshold']['arterial_index']:
+            estado = NO_ENFERMO
+        else:
+            estado = ENFERMEDAD_AGUDA
+    return estado
+
+
+def _interval_table(bounds: set, evaluate) -> Tuple[List[float], List[str]]:
+    """
+    Split the integer line at `bounds` and evaluate each piece once.
+
+    Returns (starts, estados) where estados[i] applies to every integer in
+    [starts[i], starts[i + 1]). Adjacent pieces with the same estado are merged.
+    """
+    points = sorted(bounds)
+    starts: List[float] = [_NEG_INF]
+    estados: List[str] = [evaluate(points[0] - 1)]
+    for point in points:
+        estado = evaluate(point)
+        if estado != estados[-1]:
+            starts.append(point)
+            estados.append(estado)
+    return starts, estados
+
+
+class RuleEngine:
+    """
+    conditions.json compiled into bisectable interval tables.
+
+    Ages are split into segments where the set of matching conditions is
+    constant; each (segment, sex) pair gets its own arterial index table with
+    the default_threshold fallback already folded in. Classification is two
+    binary searches and does no I/O; `classify_many` runs the same searches
+    over whole NumPy arrays.
+    """
+
+    def __init__(self, conditions: dict):
+        threshold = conditions['default_threshold']['arterial_index']
+
+        age_bounds = set()
+        for condition in conditions['conditions']:
+            age_bounds.add(condition['age_range'][0])
+            age_bounds.add(condition['age_range'][1] + 1)
+        sexes = {rule['sex'] for condition in conditions['conditions'] for rule in condition['rules']}
+
+        def segment_tables(age: int) -> Dict[str, Tuple[List[float], List[str]]]:
+            bounds_by_sex: Dict[str, set] = {sex: {threshold + 1} for sex in sexes}
+            for condition in conditions['conditions']:
+                if condition['age_range'][0] <= age <= condition['age_range'][1]:
+                    for rule in condition['rules']:
+                        bounds_by_sex[rule['sex']].add(rule['arterial_index'][0])
+                        bounds_by_sex[rule['sex']].add(rule['arterial_index'][1] + 1)
+            return {
+                sex: _interval_table(bounds, lambda ai, sex=sex: evaluate_conditions(conditions, age, sex, ai))
+                for sex, bounds in bounds_by_sex.items()
+            }
+
+        points = sorted(age_bounds) if age_bounds else [0]
+        self._age_starts: List[float] = [_NEG_INF] + points
+        self._segments = [segment_tables(points[0] - 1)] + [segment_tables(point) for point in points]
+        # Sexes that never appear in a rule only ever hit the default threshold
+        self._default_table = _interval_table({threshold + 1}, lambda ai: evaluate_conditions(conditions, 0, None, ai))
+        self._sexes = sorted(sexes)
+        # Built by the first classify_many call, so single classifications never import NumPy
+        self._np_keys = None
+
+    def _compile_arrays(self, sexes: List[str]) -> None:
+        """
+        Array form of the tables for classify_many.
+
+        Every (segment, sex code) table is laid out in one sorted int64 array
+        of keys `table * _TABLE_SPAN + start`, so a whole batch is classified
+        with a single searchsorted on `table * _TABLE_SPAN + arterial_index`.
+        """
+        import numpy as np
+
+        self._sex_codes = {sex: code for code, sex in enumerate(sexes)}
+        self._default_sex_code = len(sexes)
+        self._np_age_starts = np.array(self._age_starts, dtype=np.float64)
+        names: Dict[str, int] = {}
+        keys: List[int] = []
+        codes: List[int] = []
+        table = 0
+        for segment in self._segments:
+            for sex in sexes + [None]:
+                starts, estados = segment.get(sex, self._default_table)
+                for start, estado in zip(starts, estados):
+                    keys.append(table * _TABLE_SPAN + int(max(start, -_MAX_INDEX - 1)))
+                    codes.append(names.setdefault(estado, len(names)))
+                table += 1
+        self._np_keys = np.array(keys, dtype=np.int64)
+        self._np_codes = np.array(codes, dtype=np.int64)
+        self._np_estados = np.array(list(names), dtype=object)
+
+    def classify(self, age: int, sex: str, arterial_index: int) -> str:
+        """Return the estado for the given inputs."""
+        segment = self._segments[bisect_right(self._age_starts, age) - 1]
+        starts, estados = segment.get(sex, self._default_table)
+        return estados[bisect_right(starts, arterial_index) - 1]
+
+    def classify_many(self, ages: Sequence[int], sexes: Sequence[str], arterial_indexes: Sequence[int]) -> List[str]:
+        """Return the estado for every (age, sex, arterial_index) row, like `classify` row by row."""
+        import numpy as np
+
+        if self._np_keys is None:
+            self._compile_arrays(self._sexes)
+        ages = np.asarray(ages, dtype=np.int64)
+        arterial_indexes = np.clip(np.asarray(arterial_indexes, dtype=np.int64), -_MAX_INDEX, _MAX_INDEX)
+        if len(ages) == 0:
+            return []
+        segments = np.searchsorted(self._np_age_starts, ages, side='right') - 1
+        sexes = np.asarray(sexes, dtype=object)
+        sex_codes = np.full(len(ages), self._default_sex_code, dtype=np.int64)
+        for sex, code in self._sex_codes.items():
+            sex_codes[sexes == sex] = code
+        tables = segments * (self._default_sex_code + 1) + sex_codes
+        positions = np.searchsorted(self._np_keys, tables * _TABLE_SPAN + arterial_indexes, side='right') - 1
+        return self._np_estados[self._np_codes[positions]].tolist()
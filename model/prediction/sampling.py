@@ -0,0 +1,43 @@
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+
+class EstadoSampler:
+    """
+    Per-estado sampling table built once from model.csv.
+
+    For each estado the table keeps the tuple of `estado` values of the
+    matching rows, so drawing a final estado is a single random index into a
+    preallocated tuple instead of filtering the DataFrame on every request.
+    """
+
+    def __init__(self, estados: Iterable[str]):
+        table: Dict[str, list] = defaultdict(list)
+        for estado in estados:
+            table[estado].append(estado)
+        self._table: Dict[str, Tuple[str, ...]] = {estado: tuple(rows) for estado, rows in table.items()}
+        # Estados that can sample to something other than themselves
+        self._random = {estado for estado, rows in self._table.items() if set(rows) != {estado}}
+
+    def sample(self, estado: str) -> str:
+        """Draw a final estado for `estado`, or return it unchanged if model.csv has no matching rows."""
+        candidates = self._table.get(estado)
+        if not candidates:
+            return estado
+        return random.choice(candidates)
+
+    def sample_many(self, estados: Iterable[str]) -> List[str]:
+        """`sample` for every estado, drawing all the rows of one estado in a single call."""
+        result = list(estados)
+        if self._random.isdisjoint(result):
+            return result
+        positions: Dict[str, List[int]] = defaultdict(list)
+        for i, estado in enumerate(result):
+            positions[estado].append(i)
+        for estado, rows in positions.items():
+            candidates = self._table.get(estado)
+            if candidates:
+                for i, drawn in zip(rows, random.choices(candidates, k=len(rows))):
+                    result[i] = drawn
+        return result
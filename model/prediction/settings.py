@@ -0,0 +1,134 @@
+import os
+from dataclasses import dataclass
+
+PREDICTION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_choice(name: str, default: str, choices) -> str:
+    value = os.environ.get(name, default).strip().lower()
+    if value not in choices:
+        raise ValueError(f"{name} debe ser uno de {sorted(choices)}, no '{value}'")
+    return value
+
+
+@dataclass
+class Settings:
+    """Runtime configuration of the prediction service, read from PREDICTION_* environment variables."""
+
+    data_dir: str = PREDICTION_DIR
+    # 'jsonl' (append-only log), 'sqlite' (WAL database with indexed queries)
+    # or 'binary' (fixed-width records, memory-mapped)
+    store: str = 'jsonl'
+    # Every write goes through the writer thread: 'sync' commits each request's records right away,
+    # 'write_behind' waits up to write_batch_delay_ms to group them and applies the fsync policy
+    write_mode: str = 'sync'
+    # Share counters and latest records between uvicorn/gunicorn worker processes
+    multiprocess: bool = False
+    # Memory-mapped file holding the shared state; defaults to <data_dir>/aggregates.shm
+    shared_state_path: str = ''
+    # With write_behind: 'durable' answers once the batch is written, 'enqueued' as soon as it is queued
+    write_ack: str = 'durable'
+    write_queue_size: int = 10000
+    write_batch_size: int = 256
+    write_batch_delay_ms: int = 5
+    # 'batch' fsyncs every flushed batch, 'periodic' at most every fsync_interval_ms, 'never' leaves it to the OS
+    fsync: str = 'batch'
+    fsync_interval_ms: int = 1000
+    # Largest number of patients accepted by POST /getpredictions
+    max_batch_size: int = 100000
+    # Messages an /events subscriber may fall behind before it is resynchronized with a snapshot
+    events_queue_size: int = 100
+    # With multiprocess: how often /events checks for predictions committed by other workers
+    events_poll_ms: int = 500
+    # Per-worker metric files summed by /metrics; defaults to <data_dir>/metrics with multiprocess
+    metrics_dir: str = ''
+    # Profiling is off unless a token (sent in the X-Profile header) or a sample rate is set
+    profile_token: str = ''
+    profile_sample_rate: float = 0.0
+    # Collapsed-stack profiles; defaults to <data_dir>/profiles
+    profile_dir: str = ''
+    profile_max_concurrent: int = 1
+    profile_interval_ms: int = 1
+    # /drift histograms: retained windows of drift_window_minutes each
+    drift_window_minutes: int = 60
+    drift_windows: int = 24
+    # Per-worker drift histogram files; defaults to <data_dir>/drift with multiprocess
+    drift_dir: str = ''
+    # Rule set versions uploaded through /rules; defaults to <data_dir>/rules
+    rules_dir: str = ''
+    # Active and shadow rule versions at startup (empty keeps the ones saved in <rules_dir>/state.json)
+    rules_active: str = ''
+    rules_shadow: str = ''
+    # Token required (X-Admin-Token header) by the endpoints that change the rules; unset disables them
+    admin_token: str = ''
+    # Raw records kept in the store: the newest retain_records and those of the last retain_days (0: no limit);
+    # older ones are folded into the snapshot's hourly summary by the compaction
+    retain_records: int = 0
+    retain_days: float = 0.0
+    # How often the history is snapshotted (and compacted, if a retention limit is set); 0 disables it
+    compaction_interval_minutes: int = 60
+    # Admission control: prediction requests running at once per worker (0 disables it), how many more may
+    # wait and for how long; requests beyond that get a 503 with Retry-After
+    admission_max_concurrent: int = 32
+    admission_queue_size: int = 64
+    admission_queue_timeout_ms: int = 1000
+    # Separate limit for the read endpoints, so that a burst of predictions cannot starve the dashboards
+    admission_read_max_concurrent: int = 16
+    admission_retry_after_seconds: int = 1
+
+    @classmethod
+    def from_env(cls) -> 'Settings':
+        return cls(
+            data_dir=os.environ.get('PREDICTION_DATA_DIR', PREDICTION_DIR),
+            store=_env_choice('PREDICTION_STORE', 'jsonl', {'jsonl', 'sqlite', 'binary'}),
+            multiprocess=_env_bool('PREDICTION_MULTIPROCESS', False),
+            shared_state_path=os.environ.get('PREDICTION_SHARED_STATE_PATH', ''),
+            write_mode=_env_choice('PREDICTION_WRITE_MODE', 'sync', {'sync', 'write_behind'}),
+            write_ack=_env_choice('PREDICTION_WRITE_ACK', 'durable', {'durable', 'enqueued'}),
+            write_queue_size=_env_int('PREDICTION_WRITE_QUEUE_SIZE', 10000),
+            write_batch_size=_env_int('PREDICTION_WRITE_BATCH_SIZE', 256),
+            write_batch_delay_ms=_env_int('PREDICTION_WRITE_BATCH_DELAY_MS', 5),
+            fsync=_env_choice('PREDICTION_FSYNC', 'batch', {'batch', 'periodic', 'never'}),
+            fsync_interval_ms=_env_int('PREDICTION_FSYNC_INTERVAL_MS', 1000),
+            max_batch_size=_env_int('PREDICTION_MAX_BATCH_SIZE', 100000),
+            events_queue_size=_env_int('PREDICTION_EVENTS_QUEUE_SIZE', 100),
+            events_poll_ms=_env_int('PREDICTION_EVENTS_POLL_MS', 500),
+            metrics_dir=os.environ.get('PREDICTION_METRICS_DIR', ''),
+            profile_token=os.environ.get('PREDICTION_PROFILE_TOKEN', ''),
+            profile_sample_rate=_env_float('PREDICTION_PROFILE_SAMPLE_RATE', 0.0),
+            profile_dir=os.environ.get('PREDICTION_PROFILE_DIR', ''),
+            profile_max_concurrent=_env_int('PREDICTION_PROFILE_MAX_CONCURRENT', 1),
+            profile_interval_ms=_env_int('PREDICTION_PROFILE_INTERVAL_MS', 1),
+            drift_window_minutes=_env_int('PREDICTION_DRIFT_WINDOW_MINUTES', 60),
+            drift_windows=_env_int('PREDICTION_DRIFT_WINDOWS', 24),
+            drift_dir=os.environ.get('PREDICTION_DRIFT_DIR', ''),
+            rules_dir=os.environ.get('PREDICTION_RULES_DIR', ''),
+            rules_active=os.environ.get('PREDICTION_RULES_ACTIVE', ''),
+            rules_shadow=os.environ.get('PREDICTION_RULES_SHADOW', ''),
+            admin_token=os.environ.get('PREDICTION_ADMIN_TOKEN', ''),
+            retain_records=_env_int('PREDICTION_RETAIN_RECORDS', 0),
+            retain_days=_env_float('PREDICTION_RETAIN_DAYS', 0.0),
+            compaction_interval_minutes=_env_int('PREDICTION_COMPACTION_INTERVAL_MINUTES', 60),
+            admission_max_concurrent=_env_int('PREDICTION_ADMISSION_MAX_CONCURRENT', 32),
+            admission_queue_size=_env_int('PREDICTION_ADMISSION_QUEUE_SIZE', 64),
+            admission_queue_timeout_ms=_env_int('PREDICTION_ADMISSION_QUEUE_TIMEOUT_MS', 1000),
+            admission_read_max_concurrent=_env_int('PREDICTION_ADMISSION_READ_MAX_CONCURRENT', 16),
+            admission_retry_after_seconds=_env_int('PREDICTION_ADMISSION_RETRY_AFTER_SECONDS', 1),
+        )
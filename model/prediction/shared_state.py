@@ -0,0 +1,334 @@
+import fcntl
+import mmap
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .rollups import MAX_ESTADOS, BucketRings, micros_to_timestamp, timestamp_to_micros
+from .storage import PredictionStore
+
+SHARED_STATE_FILENAME = 'aggregates.shm'
+
+_MAGIC = 0x5052454441474703  # b'PREDAGG' + layout version
+_NAME_BYTES = 64
+
+# int64 header slots
+_H_MAGIC, _H_SEQLOCK, _H_GENERATION, _H_WATERMARK, _H_N_ESTADOS, _H_TOP_K, _H_RECENT_LEN, _H_NEXT_SEQ, \
+    _H_LATEST_TS, _H_LATEST_SEQ, _H_LATEST_ESTADO, _H_VERSION, _H_EPOCH, _H_MODIFIED = range(14)
+_HEADER_SLOTS = 16
+
+_READ_RETRIES = 100
+
+
+class SharedAggregates:
+    """
+    PredictionAggregates shared by every worker process through a memory-mapped file.
+
+    The file holds the per-estado counters, the `top_k` most recent records,
+    the latest record and the time-bucket rollups as fixed-width int64 slots,
+    plus a table of estado names.
+    Writers serialize on an flock of the file (and a thread lock inside the
+    process) and append to the store while holding it, so the segment always
+    matches the store up to the recorded watermark; a worker that starts and
+    finds a different watermark rebuilds the segment from storage. Readers do
+    not lock: a seqlock lets them copy a consistent snapshot and retry if a
+    writer was active. Timestamps are kept as UTC epoch microseconds.
+    """
+
+    def __init__(self, path: str, top_k: int = 5):
+        self.path = path
+        self.top_k = top_k
+        self._thread_lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._counts_at = _HEADER_SLOTS
+        self._recent_at = self._counts_at + MAX_ESTADOS
+        self._rings_at = self._recent_at + 3 * top_k
+        self._slots = self._rings_at + BucketRings.slots()
+        self._names_at = self._slots * 8
+        size = self._names_at + MAX_ESTADOS * _NAME_BYTES
+        with self._exclusive():
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        self._view = memoryview(self._mmap)
+        self._q = self._view.cast('q')
+        self._rings_view = self._q[self._rings_at:self._slots]
+        self._rings = BucketRings(self._rings_view)
+        # (generation, names, name -> index); replaced as a whole, never modified in place
+        self._names_table: Tuple[int, List[str], Dict[str, int]] = (-1, [], {})
+
+    @contextmanager
+    def _exclusive(self):
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        """Exclusive lock plus an odd seqlock value while the segment is modified."""
+        with self._exclusive():
+            self._q[_H_SEQLOCK] += 1
+            try:
+                self._sync_names()
+                yield
+            finally:
+                self._q[_H_SEQLOCK] += 1
+
+    def _read(self, snapshot):
+        """Run `snapshot` until it sees a state no writer touched; fall back to the lock."""
+        q = self._q
+        for _ in range(_READ_RETRIES):
+            before = q[_H_SEQLOCK]
+            if before & 1:
+                continue
+            result = snapshot()
+            if q[_H_SEQLOCK] == before:
+                return result
+        with self._exclusive():
+            return snapshot()
+
+    # Estado name table
+
+    def _sync_names(self) -> Tuple[List[str], Dict[str, int]]:
+        """
+        The (names, index) table brought up to date with the segment.
+
+        Readers call this without the lock, so the table is extended on a copy
+        and published with one assignment; callers use the returned table, as
+        another thread may publish an older one right after.
+        """
+        generation, names, index = self._names_table
+        # A rebuild in another worker may have renumbered the estados
+        current = self._q[_H_GENERATION]
+        if current != generation:
+            generation, names, index = current, [], {}
+        n = self._q[_H_N_ESTADOS]
+        if len(names) < n:
+            names, index = list(names), dict(index)
+            while len(names) < n:
+                i = len(names)
+                start = self._names_at + i * _NAME_BYTES
+                name = bytes(self._mmap[start:start + _NAME_BYTES]).rstrip(b'\0').decode('utf-8')
+                names.append(name)
+                index[name] = i
+        self._names_table = (generation, names, index)
+        return names, index
+
+    def _estado_index(self, estado: str) -> int:
+        """Index of `estado` in the name table, registering it if needed (caller holds the lock)."""
+        generation, _, index = self._names_table
+        if generation == self._q[_H_GENERATION] and estado in index:
+            return index[estado]
+        _, index = self._sync_names()
+        if estado in index:
+            return index[estado]
+        encoded = estado.encode('utf-8')
+        n = self._q[_H_N_ESTADOS]
+        if n >= MAX_ESTADOS or len(encoded) > _NAME_BYTES:
+            raise ValueError(f"No se puede registrar el estado '{estado}' en el estado compartido")
+        start = self._names_at + n * _NAME_BYTES
+        self._mmap[start:start + _NAME_BYTES] = encoded.ljust(_NAME_BYTES, b'\0')
+        self._q[_H_N_ESTADOS] = n + 1
+        self._sync_names()
+        return n
+
+    def _name(self, index: int) -> str:
+        names = self._names_table[1]
+        if index >= len(names):
+            names = self._sync_names()[0]
+        return names[index]
+
+    # Writes
+
+    def _reset(self, watermark: int) -> None:
+        q = self._q
+        seqlock, generation, version = q[_H_SEQLOCK], q[_H_GENERATION], q[_H_VERSION]
+        for i in range(self._slots):
+            q[i] = 0
+        self._mmap[self._names_at:] = b'\0' * (len(self._mmap) - self._names_at)
+        q[_H_SEQLOCK] = seqlock
+        q[_H_GENERATION] = generation + 1
+        q[_H_VERSION] = version + 1
+        self._sync_names()
+        q[_H_MAGIC] = _MAGIC
+        q[_H_TOP_K] = self.top_k
+        q[_H_LATEST_ESTADO] = -1
+        q[_H_WATERMARK] = watermark
+        # A new segment file starts again at version 1; the epoch keeps its versions apart from the old ones
+        q[_H_EPOCH] = random.getrandbits(62)
+        q[_H_MODIFIED] = int(time.time() * 1000000)
+
+    def _add(self, record: Dict[str, str]) -> None:
+        estado = self._estado_index(record['estado'])
+        ts = timestamp_to_micros(record['timestamp'])
+        self._q[self._counts_at + estado] += 1
+        self._rings.add(ts, estado)
+        self._push_recent(ts, estado)
+
+    def _add_many(self, records: List[Dict[str, str]]) -> None:
+        # Counters and rollups once per (timestamp, estado); a batch usually shares one timestamp
+        micros = {}
+        codes = {}
+        for (timestamp, name), count in Counter((r['timestamp'], r['estado']) for r in records).items():
+            estado = codes[name] = self._estado_index(name)
+            ts = micros.get(timestamp)
+            if ts is None:
+                ts = micros[timestamp] = timestamp_to_micros(timestamp)
+            self._q[self._counts_at + estado] += count
+            self._rings.add(ts, estado, count)
+        for record in records:
+            self._push_recent(micros[record['timestamp']], codes[record['estado']])
+
+    def _push_recent(self, ts: int, estado: int) -> None:
+        q = self._q
+        seq = q[_H_NEXT_SEQ]
+        q[_H_NEXT_SEQ] = seq + 1
+
+        # Recent entries rank by (timestamp, -seq), as in PredictionAggregates
+        ts_at, seq_at, estado_at = self._recent_at, self._recent_at + self.top_k, self._recent_at + 2 * self.top_k
+        n = q[_H_RECENT_LEN]
+        if n < self.top_k:
+            slot = n
+            q[_H_RECENT_LEN] = n + 1
+        else:
+            slot = min(range(n), key=lambda i: (q[ts_at + i], -q[seq_at + i]))
+            if (ts, -seq) <= (q[ts_at + slot], -q[seq_at + slot]):
+                slot = None
+        if slot is not None:
+            q[ts_at + slot] = ts
+            q[seq_at + slot] = seq
+            q[estado_at + slot] = estado
+
+        if q[_H_LATEST_ESTADO] < 0 or (ts, -seq) > (q[_H_LATEST_TS], -q[_H_LATEST_SEQ]):
+            q[_H_LATEST_TS] = ts
+            q[_H_LATEST_SEQ] = seq
+            q[_H_LATEST_ESTADO] = estado
+
+    def load(self, store: PredictionStore, snapshot: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Attach to the segment, rebuilding it unless it already matches the store.
+
+        The rebuild reads every record of `store`, or starts from the state of
+        a snapshot and reads only the records after its position.
+        """
+        with self._writing():
+            watermark = store.watermark()
+            if (self._q[_H_MAGIC] == _MAGIC and self._q[_H_TOP_K] == self.top_k
+                    and self._q[_H_WATERMARK] == watermark):
+                self._sync_names()
+                return
+            self._reset(watermark)
+            position = 0
+            if snapshot is not None:
+                self._restore(snapshot['aggregates'])
+                position = snapshot['position']
+            for _, record in store.iter_from(position):
+                self._add(record)
+
+    def _restore(self, state: Dict[str, Any]) -> None:
+        """Load an exported PredictionAggregates state into the freshly reset segment."""
+        q = self._q
+        for estado, count in state['counts'].items():
+            q[self._counts_at + self._estado_index(estado)] += count
+        for granularity, buckets in state['rollups'].items():
+            self._rings.restore(granularity, [
+                (start, {self._estado_index(estado): count for estado, count in counts.items()})
+                for start, counts in buckets
+            ])
+        for seq, record in state['recent']:
+            q[_H_NEXT_SEQ] = seq
+            self._push_recent(timestamp_to_micros(record['timestamp']), self._estado_index(record['estado']))
+        q[_H_NEXT_SEQ] = state['seq']
+
+    def rebuild(self, records: Iterable[Dict[str, str]]) -> None:
+        """Reset the segment and fold in `records` (in storage order)."""
+        with self._writing():
+            self._reset(0)
+            for record in records:
+                self._add(record)
+
+    def commit(self, store: PredictionStore, records: List[Dict[str, str]]) -> None:
+        """Append `records` to the store and fold them in, atomically with respect to other workers."""
+        with self._writing():
+            store.append_many(records)
+            self._add_many(records)
+            self._q[_H_WATERMARK] = store.watermark()
+            self._q[_H_VERSION] += 1
+            self._q[_H_MODIFIED] = int(time.time() * 1000000)
+
+    def touch(self) -> None:
+        """Bump the version in every worker after a change the segment does not track, such as a compaction."""
+        with self._writing():
+            self._q[_H_VERSION] += 1
+            self._q[_H_MODIFIED] = int(time.time() * 1000000)
+
+    # Reads
+
+    @property
+    def version(self) -> int:
+        """Increases with every commit, rebuild or touch in any worker; used to invalidate derived caches."""
+        return self._q[_H_VERSION]
+
+    @property
+    def epoch(self) -> int:
+        """Random token set when the segment is (re)built, shared by every worker."""
+        return self._q[_H_EPOCH]
+
+    @property
+    def modified(self) -> float:
+        """Unix time of the last commit or rebuild in any worker."""
+        return self._q[_H_MODIFIED] / 1000000
+
+    def counts(self) -> Dict[str, int]:
+        """Number of predictions per estado, across all workers."""
+        def snapshot():
+            q = self._q
+            return [q[self._counts_at + i] for i in range(q[_H_N_ESTADOS])]
+        return {self._name(i): count for i, count in enumerate(self._read(snapshot)) if count}
+
+    def last(self, n: Optional[int] = None) -> List[Dict[str, str]]:
+        """The `n` (at most top_k) most recent records, newest first."""
+        k = self.top_k
+
+        def snapshot():
+            q = self._q
+            at = self._recent_at
+            return [(q[at + i], -q[at + k + i], q[at + 2 * k + i]) for i in range(q[_H_RECENT_LEN])]
+        entries = sorted(self._read(snapshot), reverse=True)[:n]
+        return [{"estado": self._name(estado), "timestamp": micros_to_timestamp(ts)} for ts, _, estado in entries]
+
+    def latest(self) -> Optional[Dict[str, str]]:
+        """The most recent record, or None if nothing has been saved yet."""
+        def snapshot():
+            q = self._q
+            return q[_H_LATEST_TS], q[_H_LATEST_ESTADO]
+        ts, estado = self._read(snapshot)
+        if estado < 0:
+            return None
+        return {"estado": self._name(estado), "timestamp": micros_to_timestamp(ts)}
+
+    def timeseries(self, granularity: str, since_micros: int, until_micros: int) -> List[Tuple[int, Dict[str, int]]]:
+        """Per-estado counts of the non-empty `granularity` buckets in [since, until), oldest first."""
+        buckets = self._read(lambda: self._rings.query(granularity, since_micros, until_micros))
+        return [
+            (start, {self._name(i): count for i, count in enumerate(counts) if count})
+            for start, counts in buckets
+        ]
+
+    def rollup_window(self, granularity: str) -> int:
+        return self._rings.window(granularity)
+
+    def close(self) -> None:
+        self._rings = None
+        self._rings_view.release()
+        self._q.release()
+        self._view.release()
+        self._mmap.close()
+        os.close(self._fd)
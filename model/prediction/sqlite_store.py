@@ -0,0 +1,149 @@
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .storage import PredictionStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    age INTEGER,
+    sex TEXT,
+    arterial_index INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_timestamp ON predictions (timestamp, estado);
+CREATE INDEX IF NOT EXISTS idx_predictions_estado ON predictions (estado, timestamp);
+"""
+
+# Input feature columns added after the first schema; older databases get them with ALTER TABLE
+_FEATURE_COLUMNS = (('age', 'INTEGER'), ('sex', 'TEXT'), ('arterial_index', 'INTEGER'))
+
+
+def _where(since: Optional[str], until: Optional[str], estado: Optional[str], after: int = 0):
+    """
+    Build the index hint and WHERE clause for a query.
+
+    Per-estado filters are served from the (estado, timestamp) index and pure
+    time ranges from the (timestamp, estado) one; the hint keeps the planner
+    from scanning a whole index to satisfy a GROUP BY when no statistics exist.
+    """
+    if estado is not None:
+        hint = ' INDEXED BY idx_predictions_estado'
+    elif since is not None or until is not None:
+        hint = ' INDEXED BY idx_predictions_timestamp'
+    else:
+        hint = ''
+    clauses, params = [], []
+    if since is not None:
+        clauses.append('timestamp >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('timestamp < ?')
+        params.append(until)
+    if estado is not None:
+        clauses.append('estado = ?')
+        params.append(estado)
+    if after:
+        # Both indexes end with the rowid, so this filter keeps them covering
+        clauses.append('id > ?')
+        params.append(after)
+    return hint + ((' WHERE ' + ' AND '.join(clauses)) if clauses else ''), params
+
+
+class SQLitePredictionStore(PredictionStore):
+    """
+    Prediction store backed by SQLite in WAL mode.
+
+    Readers never block the writer and vice versa, and several worker
+    processes can share the same database file. Time-range and per-estado
+    queries are answered from the (timestamp, estado) and (estado, timestamp)
+    covering indexes (query() returns only estado and timestamp for that
+    reason; the input features come back from iter_records()). Each thread
+    gets its own connection. The position of a record is its id; compact()
+    always leaves the newest row in place so that ids are never reused.
+    """
+
+    # SQLite integers are 64-bit
+    max_age = max_arterial_index = 2**63 - 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(predictions)')}
+        for name, sql_type in _FEATURE_COLUMNS:
+            if name not in existing:
+                conn.execute(f'ALTER TABLE predictions ADD COLUMN {name} {sql_type}')
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def append_many(self, records: Iterable[Dict[str, str]]) -> None:
+        rows = [(r['timestamp'], r['estado'], r.get('age'), r.get('sex'), r.get('arterialIndex')) for r in records]
+        if not rows:
+            return
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO predictions (timestamp, estado, age, sex, arterial_index) VALUES (?, ?, ?, ?, ?)', rows)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def iter_from(self, position: int) -> Iterator[Tuple[int, Dict[str, str]]]:
+        cursor = self._connection().execute(
+            'SELECT id, estado, timestamp, age, sex, arterial_index FROM predictions WHERE id > ? ORDER BY id',
+            (position,))
+        for row_id, estado, timestamp, age, sex, arterial_index in cursor:
+            if sex is None:
+                yield row_id, {"estado": estado, "timestamp": timestamp}
+            else:
+                yield row_id, {"estado": estado, "timestamp": timestamp, "age": age, "sex": sex,
+                               "arterialIndex": arterial_index}
+
+    def compact(self, position: int) -> None:
+        conn = self._connection()
+        # Without AUTOINCREMENT, SQLite gives a new row the largest id + 1: deleting the last row would reuse ids
+        conn.execute('DELETE FROM predictions WHERE id <= ? AND id < (SELECT MAX(id) FROM predictions)', (position,))
+
+    def watermark(self) -> int:
+        return self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM predictions').fetchone()[0]
+
+    def query(self, since: Optional[str] = None, until: Optional[str] = None,
+              estado: Optional[str] = None, limit: int = 5) -> List[Dict[str, str]]:
+        where, params = _where(since, until, estado)
+        cursor = self._connection().execute(
+            f'SELECT estado, timestamp FROM predictions{where} ORDER BY timestamp DESC LIMIT ?',
+            params + [limit],
+        )
+        return [{"estado": estado, "timestamp": timestamp} for estado, timestamp in cursor]
+
+    def count_by_estado(self, since: Optional[str] = None, until: Optional[str] = None,
+                        estado: Optional[str] = None, after: int = 0) -> Dict[str, int]:
+        where, params = _where(since, until, estado, after)
+        cursor = self._connection().execute(
+            f'SELECT estado, COUNT(*) FROM predictions{where} GROUP BY estado', params
+        )
+        return dict(cursor.fetchall())
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
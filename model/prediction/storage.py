@@ -0,0 +1,336 @@
+import argparse
+import fcntl
+import heapq
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+LOG_FILENAME = 'predictions.jsonl'
+SQLITE_FILENAME = 'predictions.sqlite3'
+BINARY_FILENAME = 'predictions.bin'
+STORE_BACKENDS = ('jsonl', 'sqlite', 'binary')
+LEGACY_FILENAMES = [f'predictions_{i}.json' for i in range(1, 4)]
+
+# Reused for every line: json.dumps() builds a new encoder per call when given options
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+# First line of a compacted log: the bytes removed from its start, padded to a fixed width
+_LOG_HEADER_KEY = b'{"compacted_bytes": '
+_LOG_HEADER_BYTES = 64
+
+
+def _matches(record: Dict[str, str], since: Optional[str], until: Optional[str], estado: Optional[str]) -> bool:
+    if since is not None and record['timestamp'] < since:
+        return False
+    if until is not None and record['timestamp'] >= until:
+        return False
+    return estado is None or record['estado'] == estado
+
+
+class PredictionStore:
+    """
+    Storage backend for the prediction history.
+
+    Records hold the `estado` and `timestamp` of a prediction plus, when
+    known, the `age`, `sex` and `arterialIndex` it was computed from.
+    Timestamps are UTC ISO-8601 strings, which sort chronologically, and time
+    filters are `since` (inclusive) and `until` (exclusive) in the same format.
+    The default query methods scan `iter_records()`; backends with indexes
+    override them.
+
+    Every record has a position that grows with each append and does not
+    change when older records are removed by compact(), so a snapshot taken
+    at a position can be brought up to date by replaying iter_from() it.
+    """
+
+    # Largest age and arterialIndex the backend can store (None: no limit); the endpoints reject larger inputs
+    max_age: Optional[int] = None
+    max_arterial_index: Optional[int] = None
+
+    def append(self, record: Dict[str, str]) -> None:
+        """Append a single prediction record."""
+        self.append_many([record])
+
+    def append_many(self, records: Iterable[Dict[str, str]]) -> None:
+        raise NotImplementedError
+
+    def fsync(self) -> None:
+        """Flush appended records to stable storage."""
+
+    def iter_records(self) -> Iterator[Dict[str, str]]:
+        """Yield every stored record in append order."""
+        for _, record in self.iter_from(0):
+            yield record
+
+    def iter_from(self, position: int) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """Yield (position, record) for every stored record after `position`, in append order."""
+        raise NotImplementedError
+
+    def watermark(self) -> int:
+        """Position of the last stored record (0 for a new store); it grows whenever records are appended."""
+        raise NotImplementedError
+
+    def compact(self, position: int) -> None:
+        """Remove every record up to `position` (inclusive); the positions of the others do not change."""
+        raise NotImplementedError
+
+    def query(self, since: Optional[str] = None, until: Optional[str] = None,
+              estado: Optional[str] = None, limit: int = 5) -> List[Dict[str, str]]:
+        """The `limit` most recent matching records, newest first."""
+        matching = (r for r in self.iter_records() if _matches(r, since, until, estado))
+        return heapq.nlargest(limit, matching, key=lambda x: x['timestamp'])
+
+    def count_by_estado(self, since: Optional[str] = None, until: Optional[str] = None,
+                        estado: Optional[str] = None, after: int = 0) -> Dict[str, int]:
+        """Number of matching records per estado, among those after position `after`."""
+        return dict(Counter(r['estado'] for _, r in self.iter_from(after) if _matches(r, since, until, estado)))
+
+    def close(self) -> None:
+        """Release open files or connections."""
+
+
+class PredictionLog(PredictionStore):
+    """
+    Append-only, line-delimited JSON log of predictions.
+
+    Every append is a single os.write() on a descriptor opened with O_APPEND,
+    so it costs O(1) regardless of the history size and concurrent writers
+    (threads or uvicorn/gunicorn worker processes) never overwrite each other.
+
+    The position of a record is the byte offset of its end in the whole
+    history. compact() rewrites the log without its first records, under an
+    exclusive flock, and records the removed bytes in a fixed-width first
+    line; appends hold a shared flock and reopen the path when the file they
+    had open was replaced.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._fd_lock = threading.Lock()
+
+    def _descriptor(self) -> int:
+        if self._fd is None:
+            with self._fd_lock:
+                if self._fd is None:
+                    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def append_many(self, records: Iterable[Dict[str, str]]) -> None:
+        """Append several records with one write."""
+        # Batches repeat the same few records (one timestamp, a handful of estados): encode each once
+        lines: Dict[tuple, str] = {}
+        parts = []
+        for record in records:
+            key = tuple(record.items())
+            line = lines.get(key)
+            if line is None:
+                line = lines[key] = _ENCODER.encode(record) + '\n'
+            parts.append(line)
+        data = ''.join(parts).encode('utf-8')
+        if not data:
+            return
+        # flock is per open file, so the threads of this process also take turns on the descriptor
+        with self._fd_lock:
+            while True:
+                fd = self._fd if self._fd is not None else os.open(
+                    self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._fd = fd
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                if os.fstat(fd).st_nlink:
+                    break
+                # compact() replaced the file while we were waiting
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+                self._fd = None
+            try:
+                written = os.write(fd, data)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        if written != len(data):
+            raise OSError(f"Escritura incompleta en {self.path}: {written} de {len(data)} bytes")
+
+    def fsync(self) -> None:
+        os.fsync(self._descriptor())
+
+    @staticmethod
+    def _header(f) -> Tuple[int, int]:
+        """(bytes removed by compaction, length of the header line) of an open log."""
+        line = f.read(_LOG_HEADER_BYTES)
+        if line.startswith(_LOG_HEADER_KEY) and len(line) == _LOG_HEADER_BYTES:
+            return json.loads(line)['compacted_bytes'], _LOG_HEADER_BYTES
+        return 0, 0
+
+    def watermark(self) -> int:
+        try:
+            with open(self.path, 'rb') as f:
+                base, header = self._header(f)
+                return base + os.fstat(f.fileno()).st_size - header
+        except FileNotFoundError:
+            return 0
+
+    def iter_from(self, position: int) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """Yield the records after `position`, skipping torn or invalid lines."""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            base, header = self._header(f)
+            offset = max(position, base)
+            f.seek(header + offset - base)
+            for line in f:
+                offset += len(line)
+                try:
+                    yield offset, json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    @staticmethod
+    def _copy_rest(f, out) -> None:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                return
+            out.write(chunk)
+
+    def compact(self, position: int) -> None:
+        """
+        Drop the records up to `position`, copying the rest to a new file.
+
+        The bulk of the copy runs while appends go on; the exclusive flock is
+        only held to copy what was appended meanwhile and to rename the new
+        file over the old one. Callers serialize compactions (see compaction.py).
+        """
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        tmp_path = f'{self.path}.compact'
+        try:
+            with open(fd, 'rb', closefd=False) as f:
+                base, header = self._header(f)
+                if position <= base:
+                    return
+                f.seek(header + position - base)
+                with open(tmp_path, 'wb') as out:
+                    out.write(_LOG_HEADER_KEY + f'{position}}}'.ljust(_LOG_HEADER_BYTES - len(_LOG_HEADER_KEY) - 1).encode() + b'\n')
+                    self._copy_rest(f, out)
+                    out.flush()
+                    os.fsync(out.fileno())
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    if not os.fstat(fd).st_nlink:
+                        # Replaced by another compaction since we opened it
+                        os.unlink(tmp_path)
+                        return
+                    self._copy_rest(f, out)
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp_path, self.path)
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        with self._fd_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def open_store(backend: str, data_dir: str) -> PredictionStore:
+    """Open the prediction store selected by PREDICTION_STORE ('jsonl', 'sqlite' or 'binary')."""
+    if backend == 'jsonl':
+        return PredictionLog(os.path.join(data_dir, LOG_FILENAME))
+    if backend == 'sqlite':
+        from .sqlite_store import SQLitePredictionStore
+        return SQLitePredictionStore(os.path.join(data_dir, SQLITE_FILENAME))
+    if backend == 'binary':
+        from .binary_store import BinaryPredictionStore
+        return BinaryPredictionStore(os.path.join(data_dir, BINARY_FILENAME))
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
+
+
+def migrate_json_predictions(data_dir: str, store: PredictionStore) -> int:
+    """
+    One-shot migration of the legacy predictions_{1,2,3}.json arrays into the store.
+
+    Records are appended in timestamp order and each migrated file is renamed
+    to `<name>.migrated`, so running the migrator twice is harmless. A file
+    that cannot be parsed is reported on stderr and left in place, to be
+    repaired and migrated by a later run. Returns the number of migrated records.
+    """
+    records: List[Dict[str, str]] = []
+    migrated_paths = []
+    for filename in LEGACY_FILENAMES:
+        file_path = os.path.join(data_dir, filename)
+        try:
+            with open(file_path, 'r') as f:
+                content = f.read()
+        except FileNotFoundError:
+            continue
+        # An empty file holds no predictions (the legacy code could leave one behind)
+        if content.strip():
+            try:
+                records.extend(json.loads(content))
+            except json.JSONDecodeError as e:
+                print(f"No se pudo leer {file_path} ({e}); se deja sin migrar", file=sys.stderr)
+                continue
+        migrated_paths.append(file_path)
+
+    records.sort(key=lambda x: x['timestamp'])
+    store.append_many({"estado": r['estado'], "timestamp": r['timestamp']} for r in records)
+    for file_path in migrated_paths:
+        os.replace(file_path, file_path + '.migrated')
+    return len(records)
+
+
+def copy_records(source: PredictionStore, target: PredictionStore, chunk: int = 10000) -> int:
+    """Append every record of `source` to `target`, in order and in bulk appends; returns the number copied."""
+    count = 0
+    batch: List[Dict[str, str]] = []
+    for record in source.iter_records():
+        batch.append(record)
+        if len(batch) >= chunk:
+            target.append_many(batch)
+            count += len(batch)
+            batch = []
+    target.append_many(batch)
+    return count + len(batch)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Herramientas de almacenamiento de predicciones.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help="Migrar predictions_{1,2,3}.json al almacenamiento configurado.")
+    migrate.add_argument('--data-dir', default=os.environ.get('PREDICTION_DATA_DIR', os.path.dirname(os.path.abspath(__file__))))
+    migrate.add_argument('--store', default=os.environ.get('PREDICTION_STORE', 'jsonl'), choices=STORE_BACKENDS)
+    convert = subparsers.add_parser('convert', help="Copiar el historial de un backend de almacenamiento a otro.")
+    convert.add_argument('--data-dir', default=os.environ.get('PREDICTION_DATA_DIR', os.path.dirname(os.path.abspath(__file__))))
+    convert.add_argument('--from', dest='source', required=True, choices=STORE_BACKENDS)
+    convert.add_argument('--to', dest='target', required=True, choices=STORE_BACKENDS)
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        store = open_store(args.store, args.data_dir)
+        try:
+            count = migrate_json_predictions(args.data_dir, store)
+        finally:
+            store.close()
+        print(f"{count} predicciones migradas a {store.path}")
+    elif args.command == 'convert':
+        if args.source == args.target:
+            parser.error("--from y --to deben ser distintos")
+        source, target = open_store(args.source, args.data_dir), open_store(args.target, args.data_dir)
+        try:
+            count = copy_records(source, target)
+        finally:
+            source.close()
+            target.close()
+        print(f"{count} predicciones copiadas de {source.path} a {target.path}")
+
+
+if __name__ == "__main__":
+    main()
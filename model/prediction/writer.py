@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from .storage import PredictionStore
+
+_STOP = object()
+
+
+class WriteQueueFull(Exception):
+    """Raised when the write-behind queue cannot take more records."""
+
+
+class WriteBehindQueue:
+    """
+    Bounded write-behind queue with group commit.
+
+    Records are queued by the request handlers and a single background thread
+    passes them to `commit` (which appends them to `store` and updates the
+    aggregates) in batches of at most `max_batch` records (records submitted
+    together are never split), waiting at most `max_delay` seconds for a
+    batch to fill. Each submitted record gets
+    a Future that resolves once its batch has been written (and fsynced, per
+    `fsync` policy), so callers can choose between waiting for durability or
+    returning as soon as the record is queued. A submission the store
+    rejects as invalid fails on its own; the rest of its batch is written.
+    """
+
+    def __init__(self, store: PredictionStore, commit: Callable[[List[Dict[str, str]]], None],
+                 max_queue: int = 10000, max_batch: int = 256, max_delay: float = 0.005,
+                 fsync: str = 'batch', fsync_interval: float = 1.0, put_timeout: float = 1.0):
+        self.store = store
+        self.commit = commit
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.put_timeout = put_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict[str, str], block: bool = True) -> Future:
+        """
+        Queue a record for writing.
+
+        Raises WriteQueueFull if the queue stays full for put_timeout, or at
+        once with block=False (for callers on the event loop).
+        """
+        return self.submit_many([record], block)
+
+    def submit_many(self, records: List[Dict[str, str]], block: bool = True) -> Future:
+        """Queue records that are written together, in the same batch, with a single Future for all of them."""
+        future: Future = Future()
+        try:
+            self._queue.put((records, future), block, self.put_timeout)
+        except queue.Full:
+            raise WriteQueueFull("La cola de escritura de predicciones está llena.")
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write everything still queued, then stop the background thread."""
+        if self._thread is None:
+            return
+        self._queue.put((_STOP, None))
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval if self._dirty else None)
+            except queue.Empty:
+                self._maybe_fsync(force=True)
+                continue
+
+            batch = []
+            size = 0
+            deadline = time.monotonic() + self.max_delay
+            while True:
+                if item[0] is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+                if size >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+        # Drain whatever was queued behind the stop marker
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.max_batch):
+            self._commit(leftover[start:start + self.max_batch])
+        self._maybe_fsync(force=True)
+
+    def _commit(self, batch: list) -> None:
+        if not batch:
+            return
+        records = [record for records, _ in batch for record in records]
+        try:
+            self.commit(records)
+            self._dirty = self.fsync != 'never'
+            self._maybe_fsync(force=self.fsync == 'batch')
+        except (ValueError, OverflowError) as e:
+            # Records the store cannot hold are rejected before anything is written: retry the
+            # submissions one by one, so that only the offending one fails
+            if len(batch) > 1:
+                for item in batch:
+                    self._commit([item])
+                return
+            batch[0][1].set_exception(e)
+            return
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for _, future in batch:
+            future.set_result(None)
+
+    def _maybe_fsync(self, force: bool) -> None:
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        if force or now - self._last_fsync >= self.fsync_interval:
+            self.store.fsync()
+            self._last_fsync = now
+            self._dirty = False
@@ -0,0 +1,210 @@
+"""
+In-process benchmark of every endpoint of the prediction API.
+
+Drives the real FastAPI `app` through httpx's ASGI transport (no sockets),
+after seeding prediction histories of the requested sizes, and reports
+throughput and p50/p95/p99 latency per endpoint as JSON. With --thresholds
+the results are checked against absolute limits and against the growth of
+the median latency between the smallest and the largest history, which is
+what catches full scans and O(history) writes coming back regardless of the
+speed of the machine.
+
+Usage (from the repository root):
+    python -m tests.benchmarks.bench_endpoints --sizes 1000,100000,1000000 \\
+        --output bench.json --thresholds tests/benchmarks/thresholds.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import math
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import pytz
+
+from model.prediction import application
+from model.prediction.storage import open_store
+
+ESTADOS = ["NO ENFERMO", "ENFERMEDAD LEVE", "ENFERMEDAD AGUDA", "ENFERMEDAD CRÓNICA", "ENFERMEDAD TERMINAL"]
+
+ENDPOINTS = {
+    "/getprediction": lambda rng: {"age": rng.randint(0, 90), "sex": rng.choice("MF"), "arterialIndex": rng.randint(0, 400)},
+    "/prediction_counts": None,
+    "/last_predictions": None,
+    "/last_prediction": None,
+    "/getReport": None,
+}
+
+
+def seed_history(store, size, chunk=50000):
+    """Append `size` predictions, one per second ending now, in chunks."""
+    rng = random.Random(size)
+    start = datetime.now(pytz.UTC) - timedelta(seconds=size)
+    for offset in range(0, size, chunk):
+        store.append_many(
+            {"estado": rng.choice(ESTADOS), "timestamp": (start + timedelta(seconds=i)).isoformat()}
+            for i in range(offset, min(size, offset + chunk))
+        )
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+async def bench_endpoint(client, path, params_factory, requests, concurrency, rng):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        params = params_factory(rng) if params_factory else None
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(path, params=params)
+            latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def bench_size(size, args):
+    """Seed a fresh data directory with `size` predictions and benchmark every endpoint."""
+    with tempfile.TemporaryDirectory() as data_dir:
+        settings = application.settings
+        settings.data_dir = data_dir
+        settings.store = args.store
+        settings.multiprocess = args.multiprocess
+        settings.write_mode = args.write_mode
+
+        store = open_store(args.store, data_dir)
+        seed_started = time.perf_counter()
+        seed_history(store, size)
+        seed_seconds = time.perf_counter() - seed_started
+
+        application.prediction_store = store
+        application.aggregates = application.create_aggregates(settings)
+        application._report_cache = None
+
+        results = {"seed_seconds": round(seed_seconds, 3), "endpoints": {}}
+        startup_started = time.perf_counter()
+        async with application.lifespan(application.app):
+            results["startup_seconds"] = round(time.perf_counter() - startup_started, 3)
+            transport = httpx.ASGITransport(app=application.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                rng = random.Random(0)
+                for path, params_factory in ENDPOINTS.items():
+                    # Warm-up, also fills caches like the report
+                    gc.collect()
+                    for _ in range(min(20, args.requests)):
+                        await client.get(path, params=params_factory(rng) if params_factory else None)
+                    results["endpoints"][path] = await bench_endpoint(
+                        client, path, params_factory, args.requests, args.concurrency, rng
+                    )
+        close = getattr(application.aggregates, "close", None)
+        if close is not None:
+            close()
+        store.close()
+        return results
+
+
+def check_thresholds(report, thresholds):
+    """Return the list of threshold violations in `report`."""
+    failures = []
+    sizes = sorted(report["results"], key=int)
+    for path, limits in thresholds.get("endpoints", {}).items():
+        for size in sizes:
+            stats = report["results"][size]["endpoints"].get(path)
+            if stats is None:
+                continue
+            if stats["errors"]:
+                failures.append(f"{path} @ {size}: {stats['errors']} errores")
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                limit = limits.get(f"max_{metric}")
+                if limit is not None and stats[metric] > limit:
+                    failures.append(f"{path} @ {size}: {metric}={stats[metric]} > {limit}")
+            limit = limits.get("min_throughput_rps")
+            if limit is not None and stats["throughput_rps"] < limit:
+                failures.append(f"{path} @ {size}: throughput_rps={stats['throughput_rps']} < {limit}")
+        growth = limits.get("max_p50_growth", thresholds.get("max_p50_growth"))
+        if growth is not None and len(sizes) > 1:
+            smallest = report["results"][sizes[0]]["endpoints"][path]["p50_ms"]
+            largest = report["results"][sizes[-1]]["endpoints"][path]["p50_ms"]
+            if smallest > 0 and largest / smallest > growth:
+                failures.append(
+                    f"{path}: p50 crece x{largest / smallest:.1f} de {sizes[0]} a {sizes[-1]} registros (máximo x{growth})"
+                )
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark en proceso de los endpoints de la API de predicción.")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="Tamaños de historial separados por comas.")
+    parser.add_argument("--requests", type=int, default=1000, help="Peticiones por endpoint y tamaño.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Peticiones simultáneas.")
+    parser.add_argument("--store", default="jsonl", choices=["jsonl", "sqlite", "binary"])
+    parser.add_argument("--write-mode", default="sync", choices=["sync", "write_behind"])
+    parser.add_argument("--multiprocess", action="store_true", help="Usar el estado compartido entre workers.")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, salida estándar).")
+    parser.add_argument("--thresholds", help="Archivo JSON con los umbrales de regresión.")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {
+        "meta": {
+            "timestamp": datetime.now(pytz.UTC).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "store": args.store,
+            "write_mode": args.write_mode,
+            "multiprocess": args.multiprocess,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        print(f"Benchmark con {size} predicciones...", file=sys.stderr)
+        report["results"][str(size)] = asyncio.run(bench_size(size, args))
+
+    failures = []
+    if args.thresholds:
+        with open(args.thresholds, "r") as f:
+            failures = check_thresholds(report, json.load(f))
+        report["threshold_failures"] = failures
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    for failure in failures:
+        print(f"REGRESIÓN: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
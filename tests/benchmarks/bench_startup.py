@@ -0,0 +1,108 @@
+"""
+Cold-start benchmark of the backend.
+
+Starts fresh interpreters the way the backend container does (importing
+`prediction.application` from the model/ directory, with an empty data
+directory), and reports the import time, the time to run the FastAPI
+startup, the peak RSS and whether heavy modules were imported. With
+--thresholds the medians are checked against the "startup" section of the
+thresholds file; violations exit non-zero.
+
+Usage (from the repository root):
+    python -m tests.benchmarks.bench_startup --runs 5 --thresholds tests/benchmarks/thresholds.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "model")
+
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "sqlite3"]
+
+# Runs in the child interpreter
+CHILD = """
+import asyncio, json, resource, sys, time
+started = time.perf_counter()
+from prediction import application
+imported = time.perf_counter()
+
+async def startup():
+    async with application.lifespan(application.app):
+        pass
+
+asyncio.run(startup())
+ready = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "startup_seconds": ready - imported,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy_modules": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_once(data_dir):
+    """Start one interpreter; returns its measurements plus the total process wall time."""
+    env = dict(os.environ, PREDICTION_DATA_DIR=data_dir)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=MODEL_DIR, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_seconds"] = time.perf_counter() - started
+    return result
+
+
+def check_thresholds(report, thresholds):
+    """Return the list of threshold violations in `report`."""
+    limits = thresholds.get("startup", {})
+    failures = []
+    for metric in ("import_seconds", "startup_seconds", "process_seconds", "rss_mb"):
+        limit = limits.get(f"max_{metric}")
+        if limit is not None and report["median"][metric] > limit:
+            failures.append(f"{metric}={report['median'][metric]:.3f} > {limit}")
+    for name in limits.get("forbidden_modules", []):
+        if name in report["heavy_modules"]:
+            failures.append(f"el arranque importa {name}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del arranque en frío del backend.")
+    parser.add_argument("--runs", type=int, default=5, help="Número de arranques medidos.")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, salida estándar).")
+    parser.add_argument("--thresholds", help="Archivo JSON con los umbrales de regresión.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        runs = [run_once(data_dir) for _ in range(args.runs)]
+    metrics = ("import_seconds", "startup_seconds", "process_seconds", "rss_mb")
+    report = {
+        "runs": runs,
+        "median": {metric: round(statistics.median(run[metric] for run in runs), 4) for metric in metrics},
+        "heavy_modules": sorted({name for run in runs for name in run["heavy_modules"]}),
+    }
+
+    failures = []
+    if args.thresholds:
+        with open(args.thresholds, "r") as f:
+            failures = check_thresholds(report, json.load(f))
+        report["threshold_failures"] = failures
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for failure in failures:
+        print(f"REGRESIÓN: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
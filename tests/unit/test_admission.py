@@ -0,0 +1,131 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from model.prediction.admission import AdmissionMiddleware, PriorityClass
+
+
+class _Rejected:
+    """Counter family stub recording the labels of each rejection."""
+
+    def __init__(self):
+        self.seen = []
+
+    def labels(self, *values):
+        self.seen.append(values)
+        return self
+
+    def inc(self, amount=1.0):
+        pass
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        """An app whose requests block until released, behind the admission middleware."""
+        self.release = None
+        self.running = 0
+        self.rejected = _Rejected()
+
+        async def app(scope, receive, send):
+            self.running += 1
+            try:
+                await self.release.wait()
+            finally:
+                self.running -= 1
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+
+        self.predict = PriorityClass('predict', ["/getprediction"], max_concurrent=2, queue_size=1, queue_timeout=None)
+        self.read = PriorityClass('read', ["/prediction_counts"], max_concurrent=1, queue_size=0)
+        self.middleware = AdmissionMiddleware(app, [self.predict, self.read], retry_after=2, rejected=self.rejected)
+
+    async def _request(self, path):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await self.middleware({'type': 'http', 'path': path, 'method': 'GET'}, None, send)
+        return messages
+
+    def test_limits_queue_and_priority_classes(self):
+        """Beyond the limit and the queue requests get a 503, while other classes and /health still run."""
+        async def scenario():
+            self.release = asyncio.Event()
+            admitted = [asyncio.ensure_future(self._request("/getprediction")) for _ in range(3)]
+            await asyncio.sleep(0)
+            self.assertEqual((self.running, self.predict.queued), (2, 1))
+
+            shed = await self._request("/getprediction")
+            self.assertEqual(shed[0]['status'], 503)
+            self.assertIn((b'retry-after', b'2'), shed[0]['headers'])
+            self.assertIn("sobrecargado", json.loads(shed[1]['body'])["detail"])
+
+            reads = [asyncio.ensure_future(self._request("/prediction_counts")),
+                     asyncio.ensure_future(self._request("/health"))]
+            await asyncio.sleep(0)
+            self.assertEqual(self.running, 4)
+
+            self.release.set()
+            results = await asyncio.gather(*admitted, *reads)
+            self.assertEqual([messages[0]['status'] for messages in results], [200] * 5)
+            self.assertEqual((self.predict.active, self.read.active), (0, 0))
+
+        asyncio.run(scenario())
+        self.assertEqual(self.rejected.seen, [('predict', 'queue_full')])
+
+    def test_queue_timeout(self):
+        """A queued request that waits longer than the queue timeout is shed, and its slot is not leaked."""
+        self.predict.queue_timeout = 0.01
+
+        async def scenario():
+            self.release = asyncio.Event()
+            running = [asyncio.ensure_future(self._request("/getprediction")) for _ in range(2)]
+            await asyncio.sleep(0)
+            timed_out = await self._request("/getprediction")
+            self.assertEqual(timed_out[0]['status'], 503)
+            self.assertEqual(self.predict.queued, 0)
+            self.release.set()
+            await asyncio.gather(*running)
+            self.assertEqual(self.predict.active, 0)
+
+        asyncio.run(scenario())
+        self.assertEqual(self.rejected.seen, [('predict', 'timeout')])
+
+    def test_timeout_after_handover(self):
+        """A slot handed over just as the queue timeout fires is released, not leaked."""
+        priority = PriorityClass('predict', ["/getprediction"], max_concurrent=1, queue_size=1, queue_timeout=1)
+
+        async def wait_for(waiter, timeout):
+            # The running request finishes, then the timeout wins the race (possible since Python 3.12)
+            priority.release()
+            raise asyncio.TimeoutError
+
+        async def scenario():
+            self.assertIsNone(await priority.acquire())
+            with mock.patch('model.prediction.admission.asyncio.wait_for', wait_for):
+                self.assertEqual(await priority.acquire(), 'timeout')
+            self.assertEqual((priority.active, priority.queued), (0, 0))
+
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter(self):
+        """A client that disconnects while queued gives its place back."""
+        async def scenario():
+            self.release = asyncio.Event()
+            running = [asyncio.ensure_future(self._request("/getprediction")) for _ in range(2)]
+            waiting = asyncio.ensure_future(self._request("/getprediction"))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            self.assertEqual(self.predict.queued, 0)
+            self.release.set()
+            await asyncio.gather(*running)
+            self.assertEqual(self.predict.active, 0)
+
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import random
+import unittest
+from collections import Counter
+
+from model.prediction.aggregates import PredictionAggregates
+from model.prediction.rollups import timestamp_to_micros
+
+ESTADOS = ["NO ENFERMO", "ENFERMEDAD LEVE", "ENFERMEDAD AGUDA", "ENFERMEDAD CRÓNICA", "ENFERMEDAD TERMINAL"]
+
+
+class TestPredictionAggregates(unittest.TestCase):
+    def _records(self, n, seed=7):
+        """Generate records with out-of-order and duplicated timestamps."""
+        rng = random.Random(seed)
+        return [
+            {"estado": rng.choice(ESTADOS), "timestamp": f"2025-01-01T00:{rng.randrange(60):02d}:00+00:00"}
+            for _ in range(n)
+        ]
+
+    def test_matches_full_scan(self):
+        """Counters, last 5 and latest match a full scan of the history."""
+        records = self._records(500)
+        aggregates = PredictionAggregates(top_k=5)
+        aggregates.rebuild(records[:200])
+        for record in records[200:]:
+            aggregates.add(record)
+
+        self.assertEqual(aggregates.counts(), dict(Counter(r["estado"] for r in records)))
+        self.assertEqual(aggregates.last(5), sorted(records, key=lambda x: x["timestamp"], reverse=True)[:5])
+        self.assertEqual(aggregates.latest(), max(records, key=lambda x: x["timestamp"]))
+
+    def test_timeseries_buckets(self):
+        """Rollups count per bucket and drop buckets that fall out of the retained window."""
+        aggregates = PredictionAggregates()
+        aggregates.rebuild([
+            {"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:30+00:00"},
+            {"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-01T00:00:59.999999+00:00"},
+            {"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:01:00+00:00"},
+        ])
+        minute = 60 * 1000000
+        start = timestamp_to_micros("2025-01-01T00:00:00+00:00")
+        self.assertEqual(aggregates.timeseries("minute", start, start + 2 * minute), [
+            (start, {"NO ENFERMO": 1, "ENFERMEDAD LEVE": 1}),
+            (start + minute, {"NO ENFERMO": 1}),
+        ])
+        # Three days later the minute ring has wrapped around, the day ring has not
+        aggregates.add({"estado": "NO ENFERMO", "timestamp": "2025-01-04T00:00:30+00:00"})
+        self.assertEqual(aggregates.timeseries("minute", start, start + 2 * minute), [])
+        self.assertEqual(len(aggregates.timeseries("day", start, start + 4 * 1440 * minute)), 2)
+
+    def test_empty(self):
+        """An empty history has no counts and no latest record."""
+        aggregates = PredictionAggregates()
+        self.assertEqual(aggregates.counts(), {})
+        self.assertEqual(aggregates.last(5), [])
+        self.assertIsNone(aggregates.latest())
+
+
+if __name__ == "__main__":
+    unittest.main()
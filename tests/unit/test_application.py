@@ -0,0 +1,428 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import uvicorn
+from fastapi.testclient import TestClient
+
+from model.prediction import application
+from model.prediction.aggregates import PredictionAggregates
+from model.prediction.binary_store import BinaryPredictionStore
+from model.prediction.storage import LOG_FILENAME, PredictionLog
+
+
+def _parse_event(message):
+    """(event, data) of a Server-Sent Events message."""
+    lines = dict(line.split(": ", 1) for line in message.strip().split("\n"))
+    return lines["event"], json.loads(lines["data"])
+
+
+class TestApplication(unittest.TestCase):
+    """Drive the real FastAPI app against a temporary data directory."""
+
+    def setUp(self):
+        """Point the application state at an empty data directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self._saved = (application.prediction_store, application.aggregates)
+        application.prediction_store = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        application.aggregates = PredictionAggregates(top_k=5)
+        application._report_cache = None
+        self.client = TestClient(application.app)
+        self.client.__enter__()
+
+    def tearDown(self):
+        """Restore the application state and remove the data directory."""
+        self.client.__exit__(None, None, None)
+        application.prediction_store.close()
+        application.prediction_store, application.aggregates = self._saved
+        self.tmpdir.cleanup()
+
+    def test_read_endpoints_before_predictions(self):
+        """Read endpoints are empty, or 404, before any prediction."""
+        self.assertEqual(self.client.get("/prediction_counts").json(), {})
+        self.assertEqual(self.client.get("/last_predictions").json(), [])
+        self.assertEqual(self.client.get("/last_prediction_date").status_code, 404)
+        self.assertEqual(self.client.get("/last_prediction").status_code, 404)
+
+    def test_prediction_updates_read_endpoints(self):
+        """Saved predictions are reflected by every read endpoint."""
+        cases = [(20, "M", 120, "NO ENFERMO"), (20, "F", 130, "ENFERMEDAD LEVE"), (20, "F", 170, "ENFERMEDAD AGUDA")]
+        for age, sex, arterial_index, expected in cases:
+            response = self.client.get("/getprediction", params={"age": age, "sex": sex, "arterialIndex": arterial_index})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["estado"], expected)
+
+        self.assertEqual(
+            self.client.get("/prediction_counts").json(),
+            {"NO ENFERMO": 1, "ENFERMEDAD LEVE": 1, "ENFERMEDAD AGUDA": 1},
+        )
+        last_predictions = self.client.get("/last_predictions").json()
+        self.assertEqual([p["estado"] for p in last_predictions], ["ENFERMEDAD AGUDA", "ENFERMEDAD LEVE", "NO ENFERMO"])
+        last_prediction = self.client.get("/last_prediction").json()
+        self.assertEqual(last_prediction["estado"], "ENFERMEDAD AGUDA")
+        self.assertEqual(self.client.get("/last_prediction_date").json()["last_prediction_date"],
+                         last_prediction["last_prediction_date"])
+
+    def test_aggregates_rebuilt_at_startup(self):
+        """A restarted app answers from the records already in storage."""
+        application.prediction_store.append({"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"})
+        with TestClient(application.app) as client:
+            self.assertEqual(client.get("/prediction_counts").json(), {"NO ENFERMO": 1})
+
+    def test_write_behind_mode(self):
+        """With the write-behind queue, durable acks still show up in the read endpoints."""
+        self.client.__exit__(None, None, None)
+        application.settings.write_mode = "write_behind"
+        try:
+            with TestClient(application.app) as client:
+                for _ in range(3):
+                    client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 120})
+                self.assertEqual(client.get("/prediction_counts").json(), {"NO ENFERMO": 3})
+        finally:
+            application.settings.write_mode = "sync"
+            self.client.__enter__()
+        self.assertEqual(len(list(application.prediction_store.iter_records())), 3)
+
+    def test_shutdown_with_event_subscriber(self):
+        """With a graceful shutdown timeout, an open /events stream cannot hold up the stop (and the queue drain)."""
+        self.client.__exit__(None, None, None)
+        self.addCleanup(self.client.__enter__)
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(application.app, log_level="error", timeout_graceful_shutdown=1))
+        thread = threading.Thread(target=asyncio.run, args=(server.serve(sockets=[sock]),), daemon=True)
+        thread.start()
+        for _ in range(500):
+            if server.started:
+                break
+            time.sleep(0.01)
+
+        with socket.create_connection(sock.getsockname(), timeout=5) as subscriber:
+            subscriber.sendall(b"GET /events HTTP/1.1\r\nHost: test\r\n\r\n")
+            received = b""
+            while b"event: snapshot" not in received:
+                received += subscriber.recv(65536)
+            server.handle_exit(signal.SIGTERM, None)
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            # The lifespan shutdown ran: the write queue was drained and closed
+            self.assertIsNone(application.write_queue)
+            while subscriber.recv(65536):
+                pass
+        sock.close()
+
+    def test_filtered_queries(self):
+        """since/until/estado/limit filters are answered by the store."""
+        application.prediction_store.append_many([
+            {"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"},
+            {"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-02T00:00:00+00:00"},
+            {"estado": "NO ENFERMO", "timestamp": "2025-01-03T00:00:00+00:00"},
+        ])
+        counts = self.client.get("/prediction_counts", params={"since": "2025-01-02T00:00:00Z"}).json()
+        self.assertEqual(counts, {"ENFERMEDAD LEVE": 1, "NO ENFERMO": 1})
+        last_predictions = self.client.get(
+            "/last_predictions", params={"estado": "NO ENFERMO", "until": "2025-01-03T00:00:00", "limit": 10}
+        ).json()
+        self.assertEqual(last_predictions, [{"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"}])
+        self.assertEqual(self.client.get("/last_predictions", params={"limit": 0}).status_code, 422)
+
+    def test_report_cached_until_new_prediction(self):
+        """The report is rebuilt only when a prediction changes the aggregates version."""
+        self.assertEqual(self.client.get("/getReport").status_code, 500)
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 120})
+
+        first = self.client.get("/getReport").json()
+        cached = application._report_cache
+        self.assertEqual(self.client.get("/getReport").json(), first)
+        self.assertIs(application._report_cache, cached)
+
+        report = base64.b64decode(first["report_base64"]).decode("utf-8")
+        self.assertIn("NO ENFERMO: 1", report)
+        raw = self.client.get("/getReport/raw")
+        self.assertEqual(raw.headers["content-type"], "text/plain; charset=utf-8")
+        self.assertEqual(raw.text, report)
+
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 130})
+        report = base64.b64decode(self.client.get("/getReport").json()["report_base64"]).decode("utf-8")
+        self.assertIn("ENFERMEDAD LEVE: 1", report)
+        self.assertIsNot(application._report_cache, cached)
+
+    def test_timeseries(self):
+        """Per-bucket counts come from the rollups, including records loaded at startup."""
+        application.prediction_store.append_many([
+            {"estado": "NO ENFERMO", "timestamp": "2025-01-01T10:05:00+00:00"},
+            {"estado": "NO ENFERMO", "timestamp": "2025-01-01T10:59:59.500000+00:00"},
+            {"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-01T11:00:00+00:00"},
+            {"estado": "NO ENFERMO", "timestamp": "2025-01-02T09:00:00+00:00"},
+        ])
+        with TestClient(application.app) as client:
+            params = {"bucket": "hour", "since": "2025-01-01T00:00:00Z", "until": "2025-01-03T00:00:00Z"}
+            data = client.get("/prediction_counts/timeseries", params=params).json()
+            self.assertEqual(data, {"bucket": "hour", "buckets": [
+                {"start": "2025-01-01T10:00:00+00:00", "counts": {"NO ENFERMO": 2}},
+                {"start": "2025-01-01T11:00:00+00:00", "counts": {"ENFERMEDAD LEVE": 1}},
+                {"start": "2025-01-02T09:00:00+00:00", "counts": {"NO ENFERMO": 1}},
+            ]})
+
+            params.update(bucket="day", estado="NO ENFERMO")
+            data = client.get("/prediction_counts/timeseries", params=params).json()
+            self.assertEqual([b["counts"] for b in data["buckets"]], [{"NO ENFERMO": 2}, {"NO ENFERMO": 1}])
+
+            client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 120})
+            data = client.get("/prediction_counts/timeseries", params={"bucket": "minute"}).json()
+            self.assertEqual([b["counts"] for b in data["buckets"]], [{"NO ENFERMO": 1}])
+
+    def test_batch_predictions(self):
+        """POST /getpredictions classifies columns or patient lists and reports invalid rows individually."""
+        response = self.client.post("/getpredictions", json={
+            "age": [20, 20, -1, "20"],
+            "sex": ["M", "F", "M", "M"],
+            "arterialIndex": [120, 130, 120, 120],
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["errors"], 2)
+        self.assertEqual(data["predictions"], [
+            {"estado": "NO ENFERMO", "error": None},
+            {"estado": "ENFERMEDAD LEVE", "error": None},
+            {"estado": None, "error": "La edad debe ser un valor no negativo."},
+            {"estado": None, "error": "La edad debe ser un número entero."},
+        ])
+
+        response = self.client.post("/getpredictions", json=[
+            {"age": 20, "sex": "F", "arterialIndex": 170},
+            {"age": 20, "sex": "X", "arterialIndex": 170},
+        ])
+        self.assertEqual([p["estado"] for p in response.json()["predictions"]], ["ENFERMEDAD AGUDA", None])
+
+        # Only the valid rows are saved, with the batch timestamp
+        self.assertEqual(
+            self.client.get("/prediction_counts").json(),
+            {"NO ENFERMO": 1, "ENFERMEDAD LEVE": 1, "ENFERMEDAD AGUDA": 1},
+        )
+        self.assertEqual(self.client.get("/last_prediction").json()["last_prediction_date"], response.json()["timestamp"])
+
+        response = self.client.post("/getpredictions", json={"age": [20], "sex": [], "arterialIndex": []})
+        self.assertEqual(response.status_code, 400)
+
+    def test_store_input_limits(self):
+        """Inputs the binary store cannot hold are rejected up front instead of failing other requests' writes."""
+        self.client.__exit__(None, None, None)
+        application.prediction_store.close()
+        application.prediction_store = BinaryPredictionStore(os.path.join(self.tmpdir.name, "predictions.bin"))
+        self.client.__enter__()
+
+        response = self.client.get("/getprediction", params={"age": 40000, "sex": "M", "arterialIndex": 120})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "La edad debe ser como máximo 32767.")
+        response = self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 2**31})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post("/getpredictions", json={"age": [40000, 20], "sex": ["M", "M"], "arterialIndex": [120, 120]})
+        self.assertEqual(response.json()["predictions"], [
+            {"estado": None, "error": "La edad debe ser como máximo 32767."},
+            {"estado": "NO ENFERMO", "error": None},
+        ])
+        upload = "ege,sex,arterialIndex\n20,M,2147483648\n20,M,120\n".encode("utf-8")
+        response = self.client.post("/getpredictions/csv", files={"file": ("pacientes.csv", upload, "text/csv")})
+        self.assertEqual(response.text.splitlines()[1], "20,M,2147483648,,El índice arterial debe ser como máximo 2147483647.")
+        self.assertEqual(self.client.get("/prediction_counts").json(), {"NO ENFERMO": 2})
+
+    def test_csv_predictions(self):
+        """POST /getpredictions/csv streams the scored rows back in order and saves the valid ones."""
+        upload = "ege,sex,arterialIndex,estado\n20,M,120,X\n20,F,130,X\n-1,M,120,X\n20,M\n".encode("utf-8")
+        response = self.client.post("/getpredictions/csv", files={"file": ("pacientes.csv", upload, "text/csv")})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "text/csv; charset=utf-8")
+        self.assertEqual(response.text.splitlines(), [
+            "ege,sex,arterialIndex,estado,error",
+            "20,M,120,NO ENFERMO,",
+            "20,F,130,ENFERMEDAD LEVE,",
+            "-1,M,120,,La edad debe ser un valor no negativo.",
+            "20,M,,,El índice arterial debe ser un número entero.",
+        ])
+        self.assertEqual(self.client.get("/prediction_counts").json(), {"NO ENFERMO": 1, "ENFERMEDAD LEVE": 1})
+
+        response = self.client.post("/getpredictions/csv", files={"file": ("otro.csv", b"age,sex\n20,M\n", "text/csv")})
+        self.assertEqual(response.status_code, 400)
+
+    def test_events_announce_commits(self):
+        """Committed predictions are pushed to /events subscribers with the updated counters."""
+        async def scenario():
+            application.broadcaster.start(asyncio.get_running_loop())
+            stream = application.broadcaster.subscribe(application.snapshot_event)
+            event, data = _parse_event(await stream.__anext__())
+            self.assertEqual((event, data["counts"], data["latest"]), ("snapshot", {}, None))
+
+            await application.get_prediction(20, "M", 120)
+            event, data = _parse_event(await stream.__anext__())
+            self.assertEqual(event, "prediction")
+            self.assertEqual(data["counts"], {"NO ENFERMO": 1})
+            self.assertEqual([p["estado"] for p in data["predictions"]], ["NO ENFERMO"])
+            await stream.aclose()
+        asyncio.run(scenario())
+
+    def test_conditional_get(self):
+        """Read endpoints carry validators and answer a matching If-None-Match with 304 until the next write."""
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 120})
+        for path in ("/prediction_counts", "/last_predictions", "/last_prediction", "/getReport"):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["etag"]
+            self.assertIn("last-modified", response.headers)
+
+            cached = self.client.get(path, headers={"If-None-Match": etag})
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.content, b"")
+            self.assertEqual(cached.headers["etag"], etag)
+            modified = self.client.get(path, headers={"If-Modified-Since": response.headers["last-modified"]})
+            self.assertEqual(modified.status_code, 304)
+
+        # Filtered queries are validated by the same version
+        response = self.client.get("/last_predictions", params={"estado": "NO ENFERMO"})
+        self.assertEqual(self.client.get("/last_predictions", params={"estado": "NO ENFERMO"},
+                                         headers={"If-None-Match": response.headers["etag"]}).status_code, 304)
+
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 130})
+        response = self.client.get("/prediction_counts", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+        self.assertNotIn("etag", self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 130}).headers)
+
+    def test_compaction_changes_etag(self):
+        """A compaction that removes records invalidates the validators of filtered queries."""
+        for arterial_index in (120, 130, 170):
+            self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": arterial_index})
+        params = {"estado": "NO ENFERMO"}
+        etag = self.client.get("/last_predictions", params=params).headers["etag"]
+
+        with mock.patch.object(application.settings, "retain_records", 1):
+            self.assertEqual(application.compact_history()["removed"], 2)
+        response = self.client.get("/last_predictions", params=params, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        self.assertNotEqual(response.headers["etag"], etag)
+
+        # Nothing left to remove: the version stays and the cached answer is still valid
+        etag = response.headers["etag"]
+        with mock.patch.object(application.settings, "retain_records", 1):
+            self.assertEqual(application.compact_history()["removed"], 0)
+        self.assertEqual(self.client.get("/last_predictions", params=params,
+                                         headers={"If-None-Match": etag}).status_code, 304)
+
+    def test_inputs_are_stored(self):
+        """Saved records keep the age, sex and arterialIndex they were predicted from."""
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 120})
+        self.client.post("/getpredictions", json={"age": [45, -1], "sex": ["F", "M"], "arterialIndex": [160, 90]})
+        stored = [{k: r[k] for k in ("age", "sex", "arterialIndex")} for r in application.prediction_store.iter_records()]
+        self.assertEqual(stored, [{"age": 20, "sex": "M", "arterialIndex": 120}, {"age": 45, "sex": "F", "arterialIndex": 160}])
+
+    def test_drift(self):
+        """/drift compares the inputs received with model.csv from the histograms."""
+        self.addCleanup(setattr, application, "drift_monitor", application.drift_monitor)
+        application.drift_monitor = application.DriftMonitor()
+        for age, sex, arterial_index in [(25, "M", 120), (45, "M", 140), (30, "F", 130)]:
+            self.client.get("/getprediction", params={"age": age, "sex": sex, "arterialIndex": arterial_index})
+        self.client.post("/getpredictions", json={"age": [50, -1], "sex": ["F", "M"], "arterialIndex": [150, 90]})
+
+        report = self.client.get("/drift").json()
+        self.assertEqual(report["reference"], "model")
+        features = {(f["sex"], f["feature"]): f for f in report["features"]}
+        self.assertEqual(features["M", "age"]["count"], 2)
+        self.assertEqual(features["M", "age"]["quantiles"], {"p05": 25, "p25": 25, "p50": 25, "p75": 25, "p95": 25})
+        # The women match model.csv exactly
+        self.assertEqual(features["F", "arterialIndex"]["count"], 2)
+        self.assertEqual(features["F", "arterialIndex"]["psi"], 0.0)
+        self.assertEqual(features["F", "arterialIndex"]["drift"], "estable")
+
+        history = self.client.get("/drift", params={"reference": "history"}).json()
+        self.assertIsNone(history["max_psi"])
+        self.assertEqual(self.client.get("/drift", params={"reference": "otra"}).status_code, 422)
+
+    def test_export(self):
+        """/export streams the stored history as Parquet, or answers 501 without pyarrow."""
+        for age in (20, 30, 40):
+            self.client.get("/getprediction", params={"age": age, "sex": "M", "arterialIndex": 120})
+        response = self.client.get("/export", params={"format": "parquet"})
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.assertEqual(response.status_code, 501)
+            return
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/vnd.apache.parquet")
+        self.assertEqual(pq.read_table(io.BytesIO(response.content)).column("age").to_pylist(), [20, 30, 40])
+        self.assertEqual(self.client.get("/export", params={"format": "csv"}).status_code, 422)
+
+    def test_rules(self):
+        """Rule versions are uploaded, shadowed and activated through /rules with the admin token."""
+        self.addCleanup(setattr, application, "rule_registry", application.rule_registry)
+        self.addCleanup(setattr, application.settings, "admin_token", application.settings.admin_token)
+        application.rule_registry = application.RuleRegistry(
+            os.path.join(self.tmpdir.name, "rules"), application.load_conditions(application.CONDITIONS_PATH))
+        application.settings.admin_token = "secreto"
+        strict = {"conditions": [], "default_threshold": {"arterial_index": 100}}
+        headers = {"X-Admin-Token": "secreto"}
+
+        self.assertEqual(self.client.post("/rules/versions/v2", json=strict).status_code, 403)
+        self.assertEqual(self.client.post("/rules/versions/v2", json=strict, headers=headers).status_code, 201)
+        self.assertEqual(self.client.post("/rules/versions/v3", json={}, headers=headers).status_code, 400)
+        self.assertEqual(self.client.post("/rules/shadows", json={"versions": ["v2"]}, headers=headers).status_code, 200)
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 150})
+        self.client.post("/getpredictions", json={"age": [20, 30], "sex": ["M", "F"], "arterialIndex": [90, 150]})
+        application.rule_registry.drain()
+        stats = self.client.get("/rules").json()["shadow_stats"]["v2"]
+        self.assertEqual(stats["agree"] + stats["disagree"], 3)
+
+        self.assertEqual(self.client.post("/rules/active", json={"version": "v9"}, headers=headers).status_code, 404)
+        state = self.client.post("/rules/active", json={"version": "v2"}, headers=headers).json()
+        self.assertEqual((state["active"], state["versions"]), ("v2", ["default", "v2"]))
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 150})
+        self.assertEqual(application.aggregates.latest()["estado"], "ENFERMEDAD AGUDA")
+
+    def test_metrics(self):
+        """/metrics counts requests per route template and times the rules and the store."""
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 120})
+        before = self.client.get("/metrics")
+        self.assertEqual(before.status_code, 200)
+        self.assertTrue(before.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.client.get("/getprediction", params={"age": 20, "sex": "M", "arterialIndex": 120})
+        self.client.get("/no/such/path")
+
+        def value(text, series):
+            return next(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(series + " "))
+
+        after = self.client.get("/metrics").text
+        route = 'method="GET",route="/getprediction"'
+        self.assertEqual(value(after, f'prediction_http_requests_total{{{route},status="200"}}')
+                         - value(before.text, f'prediction_http_requests_total{{{route},status="200"}}'), 1)
+        self.assertGreaterEqual(value(after, f'prediction_http_request_duration_seconds_count{{{route}}}'), 2)
+        self.assertIn('route="unmatched",status="404"', after)
+
+        # Answered by a middleware before routing, but still labelled with the route
+        etag = self.client.get("/prediction_counts").headers["etag"]
+        self.assertEqual(self.client.get("/prediction_counts", headers={"If-None-Match": etag}).status_code, 304)
+        self.assertIn('route="/prediction_counts",status="304"', self.client.get("/metrics").text)
+        for operation in ("classify", "sample", "store_commit"):
+            self.assertGreaterEqual(value(after, f'prediction_operation_duration_seconds_count{{operation="{operation}"}}'), 2)
+        self.assertEqual(value(after, "prediction_history_size"), 2)
+        self.assertEqual(value(after, "prediction_write_queue_size"), 0)
+
+    def test_invalid_input(self):
+        """Invalid parameters are rejected before anything is saved."""
+        response = self.client.get("/getprediction", params={"age": 20, "sex": "X", "arterialIndex": 120})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/prediction_counts").json(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+from model.prediction import batch
+from model.prediction.rules import RuleEngine
+
+PREDICTION_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "model", "prediction")
+CONDITIONS_PATH = os.path.join(PREDICTION_DIR, "conditions.json")
+MODEL_PATH = os.path.join(PREDICTION_DIR, "model.csv")
+
+
+class TestBatchScoring(unittest.TestCase):
+    def setUp(self):
+        """Write a CSV of random patients, with a few invalid rows, to a temporary directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmpdir.name, "pacientes.csv")
+        rng = random.Random(3)
+        self.rows = [[str(rng.randint(0, 90)), rng.choice("MF"), str(rng.randint(0, 300))] for _ in range(3000)]
+        self.rows[10] = ["-5", "M", "120"]
+        self.rows[20] = ["30", "X", "120"]
+        with open(self.input_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["ege", "sex", "arterialIndex"])
+            writer.writerows(self.rows)
+        with open(CONDITIONS_PATH, "r") as f:
+            self.engine = RuleEngine(json.load(f))
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        self.tmpdir.cleanup()
+
+    def _score(self, workers):
+        output_path = os.path.join(self.tmpdir.name, f"salida_{workers}.csv")
+        with redirect_stderr(io.StringIO()) as stderr:
+            batch.main([self.input_path, "-o", output_path, "-w", str(workers), "--block-size", "2048"])
+        self.assertIn("filas/s", stderr.getvalue())
+        with open(output_path, "r", newline="") as f:
+            return list(csv.reader(f))
+
+    def test_output_in_input_order(self):
+        """Every worker count returns the rows in input order, scored like /getprediction."""
+        for workers in (1, 2):
+            output = self._score(workers)
+            self.assertEqual(output[0], list(batch.CSV_OUTPUT_COLUMNS))
+            self.assertEqual([row[:3] for row in output[1:]], self.rows)
+            for (age, sex, arterial_index), row in zip(self.rows, output[1:]):
+                if row[4]:
+                    self.assertEqual(row[3], "")
+                else:
+                    self.assertEqual(row[3], self.engine.classify(int(age), sex, int(arterial_index)))
+            self.assertEqual(output[11][4], batch.ERROR_AGE_NEGATIVE)
+            self.assertEqual(output[21][4], batch.ERROR_SEX)
+
+    def test_booleans_are_rejected(self):
+        """JSON booleans are not integers, whatever the other rows of the column hold."""
+        from model.prediction.sampling import EstadoSampler
+
+        with open(MODEL_PATH, "r", newline="") as f:
+            sampler = EstadoSampler(row["estado"] for row in csv.DictReader(f))
+        estados, errors = batch.score_columns(self.engine, sampler, [True, 30, 40], ["M", "F", "M"], [120, False, 130])
+        self.assertEqual(errors[:2], [batch.ERROR_AGE_TYPE, batch.ERROR_ARTERIAL_INDEX_TYPE])
+        self.assertEqual(estados[:2], [None, None])
+        self.assertIsNone(errors[2])
+
+    def test_store_limits(self):
+        """Values above the limits of the store are row errors, so they never reach the write batch."""
+        from model.prediction.sampling import EstadoSampler
+
+        with open(MODEL_PATH, "r", newline="") as f:
+            sampler = EstadoSampler(row["estado"] for row in csv.DictReader(f))
+        estados, errors = batch.score_columns(self.engine, sampler, [40000, 30, 32767], ["M", "F", "M"],
+                                              [120, 2**31, 2**31 - 1], max_age=32767, max_arterial_index=2**31 - 1)
+        self.assertEqual(errors[:2], [batch.ERROR_AGE_TOO_LARGE.format(32767),
+                                      batch.ERROR_ARTERIAL_INDEX_TOO_LARGE.format(2**31 - 1)])
+        self.assertEqual(estados[:2], [None, None])
+        self.assertIsNone(errors[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
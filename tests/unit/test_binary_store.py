@@ -0,0 +1,116 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from model.prediction.binary_store import HEADER_BYTES, RECORD_BYTES, BinaryPredictionStore
+from model.prediction.storage import BINARY_FILENAME, LOG_FILENAME, PredictionLog, copy_records
+
+ESTADOS = ["NO ENFERMO", "ENFERMEDAD LEVE", "ENFERMEDAD AGUDA", "ENFERMEDAD CRÓNICA", "ENFERMEDAD TERMINAL"]
+
+
+class TestBinaryPredictionStore(unittest.TestCase):
+    def setUp(self):
+        """Fill a binary store and a JSON-lines log with the same records, with and without inputs."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = BinaryPredictionStore(os.path.join(self.tmpdir.name, BINARY_FILENAME))
+        self.log = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        rng = random.Random(5)
+        self.records = []
+        for i in range(300):
+            record = {"estado": rng.choice(ESTADOS),
+                      "timestamp": f"2025-01-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00.{i % 7 + 1:06d}+00:00"}
+            if i % 10:
+                record.update(age=rng.randint(0, 100), sex=rng.choice("MF"), arterialIndex=rng.randint(0, 300))
+            self.records.append(record)
+        self.store.append_many(self.records)
+        self.log.append_many(self.records)
+
+    def tearDown(self):
+        """Close both stores and remove the data directory."""
+        self.store.close()
+        self.log.close()
+        self.tmpdir.cleanup()
+
+    def test_round_trip_keeps_inputs(self):
+        """Records, including age, sex and arterialIndex, come back unchanged and in order."""
+        self.assertEqual(list(self.store.iter_records()), self.records)
+        self.assertEqual(os.path.getsize(self.store.path), HEADER_BYTES + RECORD_BYTES * len(self.records))
+        self.assertEqual(RECORD_BYTES, 16)
+
+    def test_queries_match_scan(self):
+        """Vectorized queries give the same answers as scanning the log, ties included."""
+        filters = [
+            {},
+            {"since": "2025-01-10T00:00:00+00:00"},
+            {"since": "2025-01-05T00:00:00+00:00", "until": "2025-01-20T00:00:00+00:00"},
+            {"estado": "ENFERMEDAD LEVE", "until": "2025-01-15T00:00:00+00:00"},
+            {"estado": "DESCONOCIDO"},
+        ]
+        for kwargs in filters:
+            self.assertEqual(self.store.count_by_estado(**kwargs), self.log.count_by_estado(**kwargs), kwargs)
+            for limit in (1, 5, 40):
+                self.assertEqual(self.store.query(limit=limit, **kwargs), self.log.query(limit=limit, **kwargs), kwargs)
+
+    def test_numpy_view(self):
+        """as_array() maps the records without copying them."""
+        array = self.store.as_array()
+        self.assertIsInstance(array, np.memmap)
+        self.assertEqual(len(array), len(self.records))
+        names = self.store.estado_names()
+        self.assertEqual([names[code] for code in array['estado']], [r["estado"] for r in self.records])
+        with_inputs = [r for r in self.records if "age" in r]
+        self.assertEqual(array['age'][array['sex'] != 0].tolist(), [r["age"] for r in with_inputs])
+        self.assertEqual(array['arterial_index'][array['sex'] == 0].tolist(), [-1] * (len(self.records) - len(with_inputs)))
+
+    def test_torn_record_and_reopen(self):
+        """A partial trailing record is ignored, and a second handle sees the same estado names."""
+        with open(self.store.path, "ab") as f:
+            f.write(b"\x01\x02\x03")
+        other = BinaryPredictionStore(self.store.path)
+        try:
+            self.assertEqual(list(other.iter_records()), self.records)
+        finally:
+            other.close()
+
+    def test_concurrent_writers_register_estados(self):
+        """Handles appending concurrently never lose records or disagree on estado codes."""
+        other = BinaryPredictionStore(self.store.path)
+
+        def write(store, estado):
+            for i in range(100):
+                store.append({"estado": estado, "timestamp": f"2025-02-01T00:00:{i % 60:02d}+00:00",
+                              "age": 30, "sex": "F", "arterialIndex": 120})
+
+        threads = [threading.Thread(target=write, args=(store, f"NUEVO {i}"))
+                   for i, store in enumerate((self.store, other, self.store, other))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        other.close()
+        counts = self.store.count_by_estado(since="2025-02-01T00:00:00+00:00")
+        self.assertEqual(counts, {f"NUEVO {i}": 100 for i in range(4)})
+
+    def test_out_of_range_inputs(self):
+        """Inputs the record format cannot hold are rejected rather than truncated."""
+        with self.assertRaises(ValueError):
+            self.store.append({"estado": "NO ENFERMO", "timestamp": "2025-03-01T00:00:00+00:00",
+                               "age": 40000, "sex": "M", "arterialIndex": 120})
+        self.assertEqual(len(list(self.store.iter_records())), len(self.records))
+
+    def test_copy_records(self):
+        """copy_records converts another store's history, keeping the inputs."""
+        target = BinaryPredictionStore(os.path.join(self.tmpdir.name, "copia.bin"))
+        try:
+            self.assertEqual(copy_records(self.log, target, chunk=64), len(self.records))
+            self.assertEqual(list(target.iter_records()), self.records)
+        finally:
+            target.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from model.prediction.aggregates import PredictionAggregates
+from model.prediction.compaction import compact, compaction_boundary, count_by_estado, load_aggregates
+from model.prediction.rollups import timestamp_to_micros
+from model.prediction.shared_state import SHARED_STATE_FILENAME, SharedAggregates
+from model.prediction.storage import LOG_FILENAME, PredictionLog, open_store
+
+ESTADOS = ["NO ENFERMO", "ENFERMEDAD LEVE", "ENFERMEDAD AGUDA", "ENFERMEDAD CRÓNICA", "ENFERMEDAD TERMINAL"]
+
+FILTERS = [
+    {},
+    {"estado": "ENFERMEDAD LEVE"},
+    {"since": "2025-01-01T05:00:00+00:00"},
+    {"since": "2025-01-01T02:00:00+00:00", "until": "2025-01-01T07:00:00+00:00", "estado": "NO ENFERMO"},
+]
+
+
+def _records(n, seed, day=1):
+    """Records spread over ten hours, in (mostly) increasing time order."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        minute = i * 600 // n
+        record = {"estado": rng.choice(ESTADOS),
+                  "timestamp": f"2025-01-{day:02d}T{minute // 60:02d}:{minute % 60:02d}:{rng.randrange(60):02d}.{i + 1:06d}+00:00"}
+        if i % 4:
+            record.update(age=rng.randint(0, 90), sex=rng.choice("MF"), arterialIndex=rng.randint(50, 250))
+        records.append(record)
+    return records
+
+
+def _state(aggregates):
+    """Everything the read endpoints get from the aggregates."""
+    return (aggregates.counts(), aggregates.last(), aggregates.latest(),
+            aggregates.timeseries('minute', 0, 2**62), aggregates.timeseries('hour', 0, 2**62))
+
+
+class TestCompaction(unittest.TestCase):
+    def setUp(self):
+        """An empty data directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """Remove the data directory."""
+        self.tmpdir.cleanup()
+
+    def _check_backend(self, backend):
+        store = open_store(backend, self.tmpdir.name)
+        self.addCleanup(store.close)
+        records = _records(600, seed=1)
+        store.append_many(records[:400])
+        expected = {i: store.count_by_estado(**kwargs) for i, kwargs in enumerate(FILTERS)}
+
+        result = compact(store, retain_records=100)
+        self.assertEqual(result["removed"], 300)
+        self.assertEqual(list(store.iter_records()), records[300:400])
+        for i, kwargs in enumerate(FILTERS):
+            self.assertEqual(count_by_estado(store, **kwargs), expected[i], (backend, kwargs))
+
+        # Later records are replayed on top of the snapshot, and a second run only reads what is left
+        store.append_many(records[400:])
+        positions = [position for position, _ in store.iter_from(0)]
+        self.assertEqual(compact(store, retain_records=100)["removed"], 200)
+        self.assertEqual([position for position, _ in store.iter_from(0)], positions[200:])
+        store.append_many(records[:3])
+
+        full = PredictionAggregates()
+        full.rebuild(records + records[:3])
+        restored = PredictionAggregates()
+        load_aggregates(restored, store)
+        self.assertEqual(_state(restored), _state(full))
+        self.assertEqual(count_by_estado(store), full.counts())
+
+    def test_jsonl(self):
+        """The JSON-lines log keeps its newest records and exact counts."""
+        self._check_backend('jsonl')
+
+    def test_sqlite(self):
+        """The SQLite store keeps its newest records and exact counts."""
+        self._check_backend('sqlite')
+
+    def test_binary(self):
+        """The binary store keeps its newest records and exact counts."""
+        self._check_backend('binary')
+
+    def test_retention_by_age(self):
+        """Only the leading records older than the retention window are compacted."""
+        stored = [(1, "2025-01-01T00:00:00+00:00"), (2, "2025-01-01T05:00:00+00:00"),
+                  (3, "2025-01-01T01:00:00+00:00"), (4, "2025-01-02T00:00:00+00:00")]
+        now = timestamp_to_micros("2025-01-02T01:00:00+00:00") / 1000000
+        self.assertEqual(compaction_boundary(stored, retain_seconds=6 * 3600, now=now), 3)
+        self.assertEqual(compaction_boundary(stored, retain_seconds=22 * 3600, now=now), 1)
+        self.assertEqual(compaction_boundary(stored, retain_records=3, retain_seconds=30 * 3600, now=now), 1)
+        self.assertEqual(compaction_boundary(stored), 0)
+
+    def test_runs_read_only_new_and_compacted_records(self):
+        """Later runs replay the records written since the last one, and stop at the first record kept."""
+        store = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        self.addCleanup(store.close)
+        records = _records(1000, seed=5)
+        store.append_many(records[:990])
+        compact(store)
+        read = []
+        iter_from = store.iter_from
+
+        def counting_iter_from(position):
+            for item in iter_from(position):
+                read.append(item)
+                yield item
+
+        store.iter_from = counting_iter_from
+        store.append_many(records[990:995])
+        self.assertEqual(compact(store)["removed"], 0)
+        self.assertEqual(len(read), 5)
+
+        del read[:]
+        store.append_many(records[995:])
+        self.assertEqual(compact(store, retain_records=980)["removed"], 20)
+        # 5 new records, then the 20 compacted ones and the first one kept
+        self.assertEqual(len(read), 5 + 21)
+        self.assertEqual([r for _, r in iter_from(0)], records[20:])
+        self.assertEqual(count_by_estado(store), _loaded(store).counts())
+        self.assertEqual(sum(count_by_estado(store).values()), 1000)
+
+    def test_interrupted_compaction(self):
+        """A snapshot written without removing the records yet never counts them twice, and loading finishes the job."""
+        store = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        self.addCleanup(store.close)
+        records = _records(200, seed=2)
+        store.append_many(records)
+        with mock.patch.object(PredictionLog, "compact"):
+            compact(store, retain_records=50)
+        self.assertEqual(len(list(store.iter_records())), 200)
+        self.assertEqual(count_by_estado(store, estado="NO ENFERMO"),
+                         {"NO ENFERMO": sum(r["estado"] == "NO ENFERMO" for r in records)})
+
+        aggregates = PredictionAggregates()
+        load_aggregates(aggregates, store)
+        self.assertEqual(list(store.iter_records()), records[150:])
+        self.assertEqual(sum(aggregates.counts().values()), 200)
+
+    def test_appends_from_another_handle(self):
+        """A handle that had the log open before a compaction appends to the new file."""
+        path = os.path.join(self.tmpdir.name, LOG_FILENAME)
+        store, other = PredictionLog(path), PredictionLog(path)
+        self.addCleanup(store.close)
+        self.addCleanup(other.close)
+        records = _records(100, seed=3)
+        other.append_many(records[:60])
+        compact(store, retain_records=10)
+        other.append_many(records[60:])
+        self.assertEqual(list(store.iter_records()), records[50:])
+        full = PredictionAggregates()
+        full.rebuild(records)
+        self.assertEqual(count_by_estado(store), full.counts())
+        self.assertEqual(_loaded(store).counts(), full.counts())
+
+    def _check_appends_during_copy(self, backend, copy_name):
+        store, other = open_store(backend, self.tmpdir.name), open_store(backend, self.tmpdir.name)
+        self.addCleanup(store.close)
+        self.addCleanup(other.close)
+        records = _records(100, seed=4)
+        # A new estado, registered while the retained records are being copied
+        records[-1] = dict(records[-1], estado="ENFERMEDAD NUEVA")
+        other.append_many(records[:60])
+        copy = getattr(type(store), copy_name)
+        calls = []
+
+        def copy_then_append(*args):
+            result = copy(*args)
+            if not calls:
+                appender = threading.Thread(target=other.append_many, args=(records[60:],))
+                appender.start()
+                appender.join(5)
+                calls.append(appender.is_alive())
+            return result
+
+        with mock.patch.object(type(store), copy_name, staticmethod(copy_then_append)):
+            compact(store, retain_records=10)
+        self.assertEqual(calls, [False])
+        self.assertEqual(list(store.iter_records()), records[50:])
+        self.assertEqual(list(other.iter_records()), records[50:])
+
+    def test_jsonl_appends_during_copy(self):
+        """Appends are not blocked while the log copies its retained records, and none is lost."""
+        self._check_appends_during_copy('jsonl', '_copy_rest')
+
+    def test_binary_appends_during_copy(self):
+        """Appends are not blocked while the binary store copies its retained records, and none is lost."""
+        self._check_appends_during_copy('binary', '_copy_range')
+
+    def test_shared_aggregates_from_snapshot(self):
+        """Workers sharing the aggregates rebuild them from the snapshot too."""
+        store = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        self.addCleanup(store.close)
+        records = _records(300, seed=4)
+        store.append_many(records[:250])
+        compact(store, retain_records=20)
+        store.append_many(records[250:])
+
+        shared = SharedAggregates(os.path.join(self.tmpdir.name, SHARED_STATE_FILENAME))
+        self.addCleanup(shared.close)
+        load_aggregates(shared, store)
+        full = PredictionAggregates()
+        full.rebuild(records)
+        self.assertEqual(shared.counts(), full.counts())
+        self.assertEqual([r["timestamp"] for r in shared.last()], [r["timestamp"] for r in full.last()])
+        self.assertEqual(shared.timeseries('hour', 0, 2**62), full.timeseries('hour', 0, 2**62))
+
+
+def _loaded(store):
+    aggregates = PredictionAggregates()
+    load_aggregates(aggregates, store)
+    return aggregates
+
+
+if __name__ == "__main__":
+    unittest.main()
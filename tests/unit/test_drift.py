@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from model.prediction.drift import QUANTILES, DriftMonitor, drift_report, psi, quantiles, reference_histograms
+
+
+def _worker(directory, age):
+    with mock.patch('os.getppid', return_value=1):
+        monitor = DriftMonitor(3600, 4, directory)
+    monitor.observe(age, 'F', 120, now=7200)
+    monitor.close()
+
+
+class TestDriftSketches(unittest.TestCase):
+    def test_quantiles_match_numpy(self):
+        """Histogram quantiles equal numpy's 'lower' quantiles of the raw values."""
+        rng = random.Random(1)
+        for _ in range(50):
+            values = [rng.randint(0, 40) for _ in range(rng.randint(1, 200))]
+            counts = [0] * 41
+            for value in values:
+                counts[value] += 1
+            expected = [int(np.quantile(values, q, method='lower')) for q in QUANTILES]
+            self.assertEqual(quantiles(counts), expected)
+        self.assertIsNone(quantiles([0] * 5))
+
+    def test_psi(self):
+        """PSI is zero for the same distribution and grows with the shift."""
+        rng = random.Random(2)
+        reference = reference_histograms((rng.randint(20, 60), 'M', rng.randint(100, 160)) for _ in range(5000))
+        same = reference_histograms((rng.randint(20, 60), 'M', rng.randint(100, 160)) for _ in range(5000))
+        shifted = reference_histograms((rng.randint(40, 80), 'M', rng.randint(100, 160)) for _ in range(5000))
+        self.assertLess(psi(reference['M', 'age'], same['M', 'age']), 0.1)
+        self.assertGreater(psi(reference['M', 'age'], shifted['M', 'age']), 0.25)
+        self.assertIsNone(psi(reference['F', 'age'], same['M', 'age']))
+
+        report = {(f['sex'], f['feature']): f for f in drift_report(shifted, reference)}
+        self.assertEqual(report['M', 'age']['drift'], 'significativo')
+        self.assertEqual(report['M', 'arterialIndex']['drift'], 'estable')
+        self.assertIsNone(report['F', 'age']['psi'])
+
+    def test_windows(self):
+        """Observations land in their time window; windows older than the ring are dropped."""
+        monitor = DriftMonitor(window_seconds=60, windows=3)
+        monitor.observe(30, 'M', 120, now=0)
+        monitor.observe_many([30, 31, 200], ['M', 'F', 'M'], [120, 130, 900], now=65)
+        current, previous = monitor.histograms(now=70)
+        self.assertEqual(sum(current['M', 'age']), 2)
+        self.assertEqual(current['M', 'age'][127], 1)
+        self.assertEqual(current['M', 'arterialIndex'][511], 1)
+        self.assertEqual(sum(current['F', 'arterialIndex']), 1)
+        self.assertEqual(sum(previous['M', 'age']), 1)
+
+        # Window 3 reuses the slot of window 0; by window 5 only window 3 is still retained
+        monitor.observe(50, 'F', 100, now=185)
+        current, previous = monitor.histograms(now=185)
+        self.assertEqual(sum(current['F', 'age']), 1)
+        self.assertEqual(sum(previous['M', 'age']), 2)
+        current, previous = monitor.histograms(now=300)
+        self.assertEqual(sum(map(sum, current.values())), 0)
+        self.assertEqual((sum(previous['M', 'age']), sum(previous['F', 'age'])), (0, 1))
+
+    def test_worker_files_are_summed(self):
+        """With a directory, reports add up the histograms of every worker process."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target=_worker, args=(tmpdir, age)) for age in (30, 40)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+                self.assertEqual(worker.exitcode, 0)
+            self.assertEqual(len(os.listdir(tmpdir)), 2)
+            with mock.patch('os.getppid', return_value=1):
+                monitor = DriftMonitor(3600, 4, tmpdir)
+            current, _ = monitor.histograms(now=7300)
+            monitor.close()
+        self.assertEqual(current['F', 'age'][30] + current['F', 'age'][40], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
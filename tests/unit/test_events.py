@@ -0,0 +1,82 @@
+import asyncio
+import json
+import threading
+import unittest
+
+from model.prediction.events import EventBroadcaster, format_event
+
+
+def _parse(message):
+    """(event, data) of a Server-Sent Events message."""
+    lines = dict(line.split(": ", 1) for line in message.strip().split("\n"))
+    return lines["event"], json.loads(lines["data"])
+
+
+class TestEventBroadcaster(unittest.TestCase):
+    def test_fan_out_from_threads(self):
+        """Messages published from other threads reach every subscriber, after the initial snapshot."""
+        async def scenario():
+            broadcaster = EventBroadcaster()
+            broadcaster.start(asyncio.get_running_loop())
+            streams = [broadcaster.subscribe(lambda: format_event("snapshot", {})) for _ in range(3)]
+            for stream in streams:
+                self.assertEqual(_parse(await stream.__anext__())[0], "snapshot")
+            self.assertEqual(broadcaster.subscriber_count, 3)
+
+            thread = threading.Thread(target=broadcaster.publish, args=(format_event("prediction", {"n": 1}),))
+            thread.start()
+            thread.join()
+            for stream in streams:
+                self.assertEqual(_parse(await stream.__anext__()), ("prediction", {"n": 1}))
+
+            broadcaster.close()
+            for stream in streams:
+                with self.assertRaises(StopAsyncIteration):
+                    await stream.__anext__()
+            self.assertEqual(broadcaster.subscriber_count, 0)
+
+            # Streams opened while the server is stopping end at once
+            with self.assertRaises(StopAsyncIteration):
+                await broadcaster.subscribe(lambda: format_event("snapshot", {})).__anext__()
+        asyncio.run(scenario())
+
+    def test_slow_subscriber_gets_snapshot(self):
+        """A subscriber that falls behind loses its backlog and receives one fresh snapshot."""
+        async def scenario():
+            broadcaster = EventBroadcaster(max_queue=3)
+            broadcaster.start(asyncio.get_running_loop())
+            state = {"n": 0}
+            stream = broadcaster.subscribe(lambda: format_event("snapshot", dict(state)))
+            await stream.__anext__()
+            for n in range(1, 11):
+                state["n"] = n
+                broadcaster.publish(format_event("prediction", {"n": n}))
+            self.assertEqual(_parse(await stream.__anext__()), ("snapshot", {"n": 10}))
+            broadcaster.publish(format_event("prediction", {"n": 11}))
+            self.assertEqual(_parse(await stream.__anext__()), ("prediction", {"n": 11}))
+            await stream.aclose()
+            self.assertEqual(broadcaster.subscriber_count, 0)
+        asyncio.run(scenario())
+
+    def test_disconnected_subscriber(self):
+        """A stream whose client has gone away ends at the next heartbeat instead of waiting for a message."""
+        async def scenario():
+            broadcaster = EventBroadcaster(heartbeat=0.01)
+            broadcaster.start(asyncio.get_running_loop())
+            connected = [True]
+
+            async def disconnected():
+                return not connected[0]
+
+            stream = broadcaster.subscribe(lambda: format_event("snapshot", {}), disconnected)
+            await stream.__anext__()
+            self.assertEqual(await stream.__anext__(), ": keepalive\n\n")
+            connected[0] = False
+            with self.assertRaises(StopAsyncIteration):
+                await stream.__anext__()
+            self.assertEqual(broadcaster.subscriber_count, 0)
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
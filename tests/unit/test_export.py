@@ -0,0 +1,88 @@
+import io
+import os
+import tempfile
+import unittest
+
+try:
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+from model.prediction.storage import open_store
+
+
+def _records(n):
+    records = []
+    for i in range(n):
+        record = {"estado": "NO ENFERMO" if i % 2 else "ENFERMEDAD LEVE",
+                  "timestamp": f"2025-01-01T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}+00:00"}
+        if i % 3:
+            record.update(age=i % 90, sex="MF"[i % 2], arterialIndex=100 + i % 50)
+        records.append(record)
+    return records
+
+
+@unittest.skipUnless(pq is not None, "pyarrow no está instalado")
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        """An empty data directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """Remove the data directory."""
+        self.tmpdir.cleanup()
+
+    def test_formats_and_filters(self):
+        """Every backend exports the same rows as Parquet row groups or an Arrow stream, in batches."""
+        from model.prediction.export import export_stream
+
+        records = _records(2500)
+        expected = [{"estado": r["estado"], "age": r.get("age"), "sex": r.get("sex"),
+                     "arterialIndex": r.get("arterialIndex")} for r in records]
+        for backend in ("jsonl", "sqlite", "binary"):
+            store = open_store(backend, self.tmpdir.name)
+            self.addCleanup(store.close)
+            store.append_many(records)
+
+            chunks = list(export_stream(store, "parquet", batch_rows=1000))
+            self.assertGreater(len(chunks), 1)
+            parquet = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+            self.assertEqual(parquet.metadata.num_row_groups, 3)
+            table = parquet.read()
+            self.assertEqual(table.drop_columns(["timestamp"]).to_pylist(), expected, backend)
+            self.assertEqual(table.column("timestamp")[61].as_py().isoformat(), records[61]["timestamp"])
+
+            data = b"".join(export_stream(store, "arrow", since="2025-01-01T00:30:00+00:00",
+                                          until="2025-01-01T00:40:00+00:00", estado="NO ENFERMO", batch_rows=100))
+            self.assertEqual(ipc.open_stream(data).read_all().num_rows, 300)
+            self.assertEqual(pq.read_table(io.BytesIO(b"".join(export_stream(store, estado="OTRO")))).num_rows, 0)
+
+    def test_stops_at_the_records_stored_when_it_started(self):
+        """Predictions appended while an export is streaming are left for the next export."""
+        from model.prediction.export import export_stream
+
+        store = open_store("jsonl", self.tmpdir.name)
+        self.addCleanup(store.close)
+        records = _records(300)
+        store.append_many(records[:200])
+        stream = export_stream(store, "arrow", batch_rows=50)
+        first = next(stream)
+        store.append_many(records[200:])
+        table = ipc.open_stream(first + b"".join(stream)).read_all()
+        self.assertEqual(table.num_rows, 200)
+
+    def test_cli(self):
+        """The command writes the same Parquet file as the endpoint."""
+        from model.prediction.export import main
+
+        store = open_store("sqlite", self.tmpdir.name)
+        store.append_many(_records(10))
+        store.close()
+        output = os.path.join(self.tmpdir.name, "predicciones.parquet")
+        main(["--data-dir", self.tmpdir.name, "--store", "sqlite", "--output", output])
+        self.assertEqual(pq.read_table(output).num_rows, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from model.prediction.metrics import MetricsRegistry
+
+
+def _families(registry):
+    return (registry, registry.counter('requests_total', 'Peticiones.', ['route']),
+            registry.histogram('latency_seconds', 'Latencia.', buckets=(1.0,)))
+
+
+def _worker(directory, amount):
+    registry, requests, latency = _families(MetricsRegistry(directory, group='run'))
+    requests.labels('/a').inc(amount)
+    latency.observe(0.5)
+    registry.close()
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    """Counters, histograms and gauges in the Prometheus text format."""
+
+    def test_counter_and_histogram_render(self):
+        """Counters add up per label set; histogram buckets are cumulative with count and sum."""
+        registry = MetricsRegistry()
+        requests = registry.counter('requests_total', 'Peticiones.', ['route'])
+        latency = registry.histogram('latency_seconds', 'Latencia.', buckets=(0.1, 1.0))
+        requests.labels('/a').inc()
+        requests.labels('/a').inc()
+        requests.labels('/b').inc(3)
+        for value in (0.05, 0.1, 0.5, 2.0):
+            latency.observe(value)
+        registry.gauge('queue_size', 'Cola.', lambda: 7)
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE requests_total counter', lines)
+        self.assertIn('requests_total{route="/a"} 2', lines)
+        self.assertIn('requests_total{route="/b"} 3', lines)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 3', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_count 4', lines)
+        self.assertIn('latency_seconds_sum 2.65', lines)
+        self.assertIn('# TYPE queue_size gauge', lines)
+        self.assertIn('queue_size 7', lines)
+
+    def test_label_values_are_escaped(self):
+        """Quotes and backslashes in label values do not break the exposition format."""
+        registry = MetricsRegistry()
+        registry.counter('errors_total', 'Errores.', ['detail']).labels('a "b" \\c').inc()
+        self.assertIn('errors_total{detail="a \\"b\\" \\\\c"} 1', registry.render().splitlines())
+
+    def test_worker_files_are_summed(self):
+        """Registries of the same group share a directory and render the sum of every worker process."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stale = os.path.join(tmpdir, 'old_1.json')
+            with open(stale, 'w') as f:
+                f.write('[]')
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target=_worker, args=(tmpdir, i + 1)) for i in range(2)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+                self.assertEqual(worker.exitcode, 0)
+            self.assertFalse(os.path.exists(stale))
+
+            registry = _families(MetricsRegistry(tmpdir, group='run'))[0]
+            lines = registry.render().splitlines()
+            registry.close()
+        self.assertIn('requests_total{route="/a"} 3', lines)
+        self.assertIn('latency_seconds_count 2', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from model.prediction.profiling import ProfilingMiddleware
+
+
+def slow_work():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+
+
+def _wait_for(path, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return os.path.exists(path)
+
+
+class TestProfilingMiddleware(unittest.TestCase):
+    """Selected requests are profiled into collapsed-stack files."""
+
+    def setUp(self):
+        """A tiny app with a CPU-bound sync endpoint behind the profiler."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        app = FastAPI()
+
+        @app.get("/slow")
+        def slow():
+            slow_work()
+            return {"ok": True}
+
+        app.add_middleware(ProfilingMiddleware, directory=self.tmpdir.name, token="secreto")
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        """Remove the profile directory."""
+        self.tmpdir.cleanup()
+
+    def test_token_profiles_request(self):
+        """The right token yields a profile whose stacks reach the endpoint code."""
+        response = self.client.get("/slow", headers={"X-Profile": "secreto"})
+        self.assertEqual(response.status_code, 200)
+        filename = response.headers["x-profile-file"]
+        self.assertIn("GET-slow", filename)
+        path = os.path.join(self.tmpdir.name, filename)
+        self.assertTrue(_wait_for(path))
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertGreater(int(line.rsplit(" ", 1)[1]), 0)
+        self.assertTrue(any("slow_work (test_profiling.py" in line for line in lines))
+
+    def test_unselected_requests_are_not_profiled(self):
+        """Without the header, or with a wrong token, nothing is profiled."""
+        for headers in ({}, {"X-Profile": "otro"}):
+            response = self.client.get("/slow", headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("x-profile-file", response.headers)
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_concurrency_cap(self):
+        """Requests beyond max_concurrent run unprofiled."""
+        app = FastAPI()
+        app.get("/slow")(lambda: {"ok": True})
+        middleware = ProfilingMiddleware(app, directory=self.tmpdir.name, token="secreto", max_concurrent=1)
+        client = TestClient(middleware)
+        self.assertTrue(middleware._slots.acquire(blocking=False))
+        try:
+            self.assertNotIn("x-profile-file", client.get("/slow", headers={"X-Profile": "secreto"}).headers)
+        finally:
+            middleware._slots.release()
+        filename = client.get("/slow", headers={"X-Profile": "secreto"}).headers["x-profile-file"]
+        self.assertTrue(_wait_for(os.path.join(self.tmpdir.name, filename)))
+
+
+if __name__ == "__main__":
+    unittest.main()
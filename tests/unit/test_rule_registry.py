@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from model.prediction.rule_registry import DEFAULT_VERSION, RuleRegistry
+from model.prediction.rules import RuleEngine
+from model.prediction.settings import PREDICTION_DIR
+
+with open(os.path.join(PREDICTION_DIR, "conditions.json")) as f:
+    CONDITIONS = json.load(f)
+
+# Everything above the threshold is acute, everything else healthy
+STRICT = {"conditions": [], "default_threshold": {"arterial_index": 100}}
+
+
+class TestRuleRegistry(unittest.TestCase):
+    def setUp(self):
+        """A registry over an empty rules directory, recording the shadow callbacks."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.results = []
+        self.registry = RuleRegistry(self.tmpdir.name, CONDITIONS, on_result=lambda *r: self.results.append(r))
+
+    def tearDown(self):
+        """Stop the shadow thread and remove the rules directory."""
+        self.registry.close()
+        self.tmpdir.cleanup()
+
+    def test_add_and_activate(self):
+        """Added versions are stored, compiled and can be activated and persisted."""
+        self.assertEqual(self.registry.versions(), [DEFAULT_VERSION])
+        self.registry.add("v2", STRICT)
+        self.assertEqual(self.registry.versions(), [DEFAULT_VERSION, "v2"])
+        self.registry.activate("v2")
+        version, engine = self.registry.active
+        self.assertEqual((version, engine.classify(20, "M", 101)), ("v2", "ENFERMEDAD AGUDA"))
+
+        with self.assertRaises(FileExistsError):
+            self.registry.add("v2", CONDITIONS)
+        with self.assertRaises(ValueError):
+            self.registry.add("../v3", CONDITIONS)
+        with self.assertRaises(ValueError):
+            self.registry.add("v3", {"conditions": []})
+        with self.assertRaises(KeyError):
+            self.registry.activate("v9")
+        # Fractional bounds would be truncated by the batch path
+        with self.assertRaises(ValueError):
+            self.registry.add("v3", {"conditions": [], "default_threshold": {"arterial_index": 100.5}})
+        fractional = json.loads(json.dumps(CONDITIONS))
+        fractional["conditions"][0]["rules"][0]["arterial_index"] = [0, 120.5]
+        with self.assertRaises(ValueError):
+            self.registry.add("v3", fractional)
+        self.assertEqual(self.registry.versions(), [DEFAULT_VERSION, "v2"])
+
+        # A new registry (a restart or another worker) starts from the saved selection
+        reopened = RuleRegistry(self.tmpdir.name, CONDITIONS)
+        self.assertEqual(reopened.active[0], "v2")
+
+    def test_reload(self):
+        """reload() picks up versions and a selection changed by another registry."""
+        other = RuleRegistry(self.tmpdir.name, CONDITIONS)
+        other.add("v2", STRICT)
+        other.activate("v2")
+        other.set_shadows([DEFAULT_VERSION])
+        self.registry.reload()
+        self.assertEqual(self.registry.active[0], "v2")
+        self.assertEqual(self.registry.shadow_versions, [DEFAULT_VERSION])
+
+    def test_shadow_counts(self):
+        """Shadow versions are compared with the live estados of single and batch classifications."""
+        self.registry.add("v2", STRICT)
+        self.registry.shadow(20, "M", 120, "NO ENFERMO")
+        self.assertEqual(self.registry.stats(), {})  # nothing is queued without shadows
+
+        self.registry.set_shadows(["v2"])
+        _, engine = self.registry.active
+        inputs = [(20, "M", 90), (20, "M", 150), (70, "F", 300)]
+        for age, sex, arterial_index in inputs:
+            self.registry.shadow(age, sex, arterial_index, engine.classify(age, sex, arterial_index))
+        self.registry.shadow_many(engine, *zip(*inputs))
+        self.registry.drain()
+
+        strict = RuleEngine(STRICT)
+        agreed = sum(engine.classify(*row) == strict.classify(*row) for row in inputs)
+        self.assertLess(agreed, len(inputs))
+        stats = self.registry.stats()["v2"]
+        self.assertEqual((stats["agree"], stats["disagree"]), (2 * agreed, 2 * (len(inputs) - agreed)))
+        self.assertEqual(sum(d["count"] for d in stats["disagreements"]), stats["disagree"])
+        self.assertEqual(sum(a for _, a, _ in self.results), stats["agree"])
+
+    def test_shadow_queue_is_bounded(self):
+        """Without the background thread, items beyond max_pending are dropped and counted."""
+        self.registry.max_pending = 2
+        self.registry.set_shadows([DEFAULT_VERSION])
+        for _ in range(5):
+            self.registry.shadow(20, "M", 120, "NO ENFERMO")
+        self.assertEqual(self.registry.dropped, 3)
+
+    def test_swap_during_classifications(self):
+        """Classifications running while versions are swapped always use one complete version."""
+        self.registry.add("v2", STRICT)
+        answers = {self.registry.active[1].classify(20, "M", 150), "ENFERMEDAD AGUDA"}
+        seen = set()
+        stop = threading.Event()
+
+        def classify():
+            while not stop.is_set():
+                _, engine = self.registry.active
+                seen.add(engine.classify(20, "M", 150))
+
+        worker = threading.Thread(target=classify)
+        worker.start()
+        for i in range(200):
+            self.registry.activate("v2" if i % 2 else DEFAULT_VERSION)
+        stop.set()
+        worker.join()
+        self.assertLessEqual(seen, answers)
+
+
+if __name__ == "__main__":
+    unittest.main()
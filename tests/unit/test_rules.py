@@ -0,0 +1,62 @@
+import json
+import os
+import unittest
+
+from model.prediction.rules import RuleEngine, evaluate_conditions
+
+CONDITIONS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "model", "prediction", "conditions.json")
+
+
+class TestRuleEngine(unittest.TestCase):
+    def setUp(self):
+        """Load the conditions shipped with the backend."""
+        with open(CONDITIONS_PATH, "r") as f:
+            self.conditions = json.load(f)
+        self.engine = RuleEngine(self.conditions)
+
+    def test_matches_reference_evaluation(self):
+        """The compiled engine returns the same estado as the nested-loop evaluation."""
+        for sex in ("M", "F", "X"):
+            for age in range(-1, 102):
+                for arterial_index in range(0, 1010):
+                    self.assertEqual(
+                        self.engine.classify(age, sex, arterial_index),
+                        evaluate_conditions(self.conditions, age, sex, arterial_index),
+                        f"Mismatch for age={age}, sex={sex}, arterialIndex={arterial_index}",
+                    )
+
+    def test_classify_many_matches_classify(self):
+        """The vectorized classification agrees with the scalar one, including out-of-range inputs."""
+        rows = [(age, sex, arterial_index)
+                for age in (-1, 0, 19, 20, 39, 40, 65, 101, 10 ** 12)
+                for sex in ("M", "F", "X")
+                for arterial_index in (0, 110, 111, 120, 121, 156, 157, 161, 162, 500, 10 ** 15)]
+        ages, sexes, arterial_indexes = zip(*rows)
+        self.assertEqual(self.engine.classify_many(ages, sexes, arterial_indexes),
+                         [self.engine.classify(*row) for row in rows])
+        self.assertEqual(self.engine.classify_many([], [], []), [])
+
+    def test_default_threshold_fallback(self):
+        """Ages outside every range fall back to the default threshold."""
+        self.assertEqual(self.engine.classify(10, "M", 120), "NO ENFERMO")
+        self.assertEqual(self.engine.classify(10, "M", 121), "ENFERMEDAD AGUDA")
+
+    def test_first_matching_rule_wins(self):
+        """Overlapping rules keep the order of conditions.json."""
+        conditions = {
+            "default_threshold": {"arterial_index": 50},
+            "conditions": [
+                {"age_range": [0, 10], "rules": [{"sex": "M", "arterial_index": [0, 100], "estado": "A"}]},
+                {"age_range": [5, 20], "rules": [{"sex": "M", "arterial_index": [50, 200], "estado": "B"},
+                                                 {"sex": "F", "arterial_index": [0, 10], "estado": "C"}]},
+            ],
+        }
+        engine = RuleEngine(conditions)
+        self.assertEqual(engine.classify(7, "M", 60), "A")
+        self.assertEqual(engine.classify(7, "M", 150), "B")
+        self.assertEqual(engine.classify(7, "F", 5), "C")
+        self.assertEqual(engine.classify(30, "F", 5), "NO ENFERMO")
+
+
+if __name__ == "__main__":
+    unittest.main()
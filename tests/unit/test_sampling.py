@@ -0,0 +1,20 @@
+import unittest
+
+from model.prediction.sampling import EstadoSampler
+
+
+class TestEstadoSampler(unittest.TestCase):
+    def test_sample_draws_from_matching_rows(self):
+        """Sampling only returns estados that model.csv has for the predicted status."""
+        sampler = EstadoSampler(["NO ENFERMO", "ENFERMEDAD LEVE", "NO ENFERMO"])
+        for _ in range(50):
+            self.assertEqual(sampler.sample("NO ENFERMO"), "NO ENFERMO")
+
+    def test_sample_without_rows_returns_estado(self):
+        """A status with no rows in model.csv is returned unchanged."""
+        sampler = EstadoSampler(["NO ENFERMO"])
+        self.assertEqual(sampler.sample("ENFERMEDAD TERMINAL"), "ENFERMEDAD TERMINAL")
+
+
+if __name__ == "__main__":
+    unittest.main()
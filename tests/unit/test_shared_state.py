@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from model.prediction.aggregates import PredictionAggregates
+from model.prediction.shared_state import SHARED_STATE_FILENAME, SharedAggregates
+from model.prediction.storage import LOG_FILENAME, PredictionLog
+
+ESTADOS = ["NO ENFERMO", "ENFERMEDAD LEVE", "ENFERMEDAD AGUDA", "ENFERMEDAD CRÓNICA", "ENFERMEDAD TERMINAL"]
+
+
+def _worker(data_dir, worker, n):
+    """Commit `n` predictions from a separate process."""
+    store = PredictionLog(os.path.join(data_dir, LOG_FILENAME))
+    shared = SharedAggregates(os.path.join(data_dir, SHARED_STATE_FILENAME))
+    shared.load(store)
+    for i in range(n):
+        shared.commit(store, [{"estado": ESTADOS[(worker + i) % 5], "timestamp": f"2025-01-0{worker + 1}T00:00:{i % 60:02d}+00:00"}])
+    shared.close()
+    store.close()
+
+
+class TestSharedAggregates(unittest.TestCase):
+    def setUp(self):
+        """Create a store and a shared segment in a temporary data directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        self.path = os.path.join(self.tmpdir.name, SHARED_STATE_FILENAME)
+
+    def tearDown(self):
+        """Close the store and remove the data directory."""
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_matches_in_process_aggregates(self):
+        """The shared segment answers like PredictionAggregates for the same records."""
+        rng = random.Random(11)
+        records = [
+            {"estado": rng.choice(ESTADOS), "timestamp": f"2025-01-01T00:{rng.randrange(60):02d}:00.{rng.randrange(1, 4):06d}+00:00"}
+            for _ in range(300)
+        ]
+        local = PredictionAggregates()
+        shared = SharedAggregates(self.path)
+        try:
+            for record in records:
+                local.commit(self.store, [record])
+            shared.load(self.store)
+            self.assertEqual(shared.counts(), local.counts())
+            self.assertEqual(shared.last(5), local.last(5))
+            self.assertEqual(shared.latest(), local.latest())
+            for granularity in ("minute", "hour", "day"):
+                self.assertEqual(shared.timeseries(granularity, 0, 2 ** 62), local.timeseries(granularity, 0, 2 ** 62))
+        finally:
+            shared.close()
+
+    def test_batch_commit_matches_single_commits(self):
+        """Committing a batch gives the same state as committing its records one by one."""
+        rng = random.Random(5)
+        records = [{"estado": rng.choice(ESTADOS), "timestamp": f"2025-01-01T00:00:0{rng.randrange(3)}+00:00"} for _ in range(50)]
+        local = PredictionAggregates()
+        shared = SharedAggregates(self.path)
+        try:
+            for record in records:
+                local.commit(self.store, [record])
+            shared.commit(self.store, records)
+            batched = PredictionAggregates()
+            batched.add_many(records)
+            for aggregates in (shared, batched):
+                self.assertEqual(aggregates.counts(), local.counts())
+                self.assertEqual(aggregates.last(5), local.last(5))
+                self.assertEqual(aggregates.latest(), local.latest())
+                self.assertEqual(aggregates.timeseries("minute", 0, 2 ** 62), local.timeseries("minute", 0, 2 ** 62))
+        finally:
+            shared.close()
+
+    def test_workers_share_state(self):
+        """Predictions committed by other processes are visible to every worker."""
+        shared = SharedAggregates(self.path)
+        try:
+            shared.load(self.store)
+            epoch, version = shared.epoch, shared.version
+            ctx = multiprocessing.get_context("fork")
+            processes = [ctx.Process(target=_worker, args=(self.tmpdir.name, w, 200)) for w in range(3)]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+            self.assertEqual(sum(shared.counts().values()), 600)
+            self.assertEqual(len(list(self.store.iter_records())), 600)
+            self.assertEqual(shared.latest()["timestamp"], "2025-01-03T00:00:59+00:00")
+            # Cache validators: same epoch for every worker, one version bump per commit
+            self.assertEqual((shared.epoch, shared.version), (epoch, version + 600))
+
+            # A compaction in one worker changes the validators of all of them
+            other = SharedAggregates(self.path)
+            try:
+                other.touch()
+            finally:
+                other.close()
+            self.assertEqual((shared.epoch, shared.version), (epoch, version + 601))
+            self.assertEqual(sum(shared.counts().values()), 600)
+        finally:
+            shared.close()
+
+    def test_readers_and_writer_threads(self):
+        """Readers syncing the name table while the writer thread registers estados never mix up the names."""
+        shared = SharedAggregates(self.path)
+        names = [f"ESTADO {i}" for i in range(30)]
+        stop = threading.Event()
+        seen = []
+
+        def read():
+            while not stop.is_set():
+                seen.append(set(shared.counts()) | {r["estado"] for r in shared.last()})
+
+        try:
+            shared.load(self.store)
+            readers = [threading.Thread(target=read) for _ in range(4)]
+            for reader in readers:
+                reader.start()
+            for i, name in enumerate(names):
+                shared.commit(self.store, [{"estado": name, "timestamp": f"2025-01-01T00:00:{i:02d}+00:00"}] * (i + 1))
+            stop.set()
+            for reader in readers:
+                reader.join()
+            self.assertEqual(shared.counts(), {name: i + 1 for i, name in enumerate(names)})
+            self.assertEqual(shared._sync_names()[0], names)
+            self.assertTrue(all(s <= set(names) for s in seen))
+        finally:
+            stop.set()
+            shared.close()
+
+    def test_stale_segment_is_rebuilt(self):
+        """Records appended without the shared lock trigger a rebuild on the next load."""
+        shared = SharedAggregates(self.path)
+        try:
+            shared.load(self.store)
+            shared.commit(self.store, [{"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"}])
+            self.store.append({"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-01T00:00:01+00:00"})
+            self.assertEqual(shared.counts(), {"NO ENFERMO": 1})
+        finally:
+            shared.close()
+
+        reopened = SharedAggregates(self.path)
+        try:
+            reopened.load(self.store)
+            self.assertEqual(reopened.counts(), {"NO ENFERMO": 1, "ENFERMEDAD LEVE": 1})
+        finally:
+            reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from model.prediction.sqlite_store import SQLitePredictionStore, _where
+from model.prediction.storage import LOG_FILENAME, SQLITE_FILENAME, PredictionLog
+
+ESTADOS = ["NO ENFERMO", "ENFERMEDAD LEVE", "ENFERMEDAD AGUDA", "ENFERMEDAD CRÓNICA", "ENFERMEDAD TERMINAL"]
+
+
+class TestSQLitePredictionStore(unittest.TestCase):
+    def setUp(self):
+        """Fill a SQLite store and a JSON-lines log with the same records."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SQLitePredictionStore(os.path.join(self.tmpdir.name, SQLITE_FILENAME))
+        self.log = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        rng = random.Random(3)
+        self.records = [
+            {"estado": rng.choice(ESTADOS), "timestamp": f"2025-01-{d:02d}T{h:02d}:00:00.{i:06d}+00:00"}
+            for i, (d, h) in enumerate((rng.randint(1, 28), rng.randint(0, 23)) for _ in range(300))
+        ]
+        self.store.append_many(self.records)
+        self.log.append_many(self.records)
+
+    def tearDown(self):
+        """Close both stores and remove the data directory."""
+        self.store.close()
+        self.log.close()
+        self.tmpdir.cleanup()
+
+    def test_iter_records_in_append_order(self):
+        """Records come back in insertion order."""
+        self.assertEqual(list(self.store.iter_records()), self.records)
+
+    def test_queries_match_scan(self):
+        """Indexed queries give the same answers as scanning the log."""
+        filters = [
+            {},
+            {"since": "2025-01-10T00:00:00+00:00"},
+            {"since": "2025-01-05T00:00:00+00:00", "until": "2025-01-20T00:00:00+00:00"},
+            {"estado": "ENFERMEDAD LEVE", "until": "2025-01-15T00:00:00+00:00"},
+        ]
+        for kwargs in filters:
+            self.assertEqual(self.store.count_by_estado(**kwargs), self.log.count_by_estado(**kwargs), kwargs)
+            self.assertEqual(self.store.query(limit=20, **kwargs), self.log.query(limit=20, **kwargs), kwargs)
+
+    def test_queries_use_indexes(self):
+        """Time-range and per-estado queries are planned on the covering indexes."""
+        conn = self.store._connection()
+        where, params = _where("2025-01-01T00:00:00+00:00", None, None)
+        plan = " ".join(str(row) for row in conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT estado, COUNT(*) FROM predictions{where} GROUP BY estado", params
+        ))
+        self.assertIn("SEARCH predictions USING COVERING INDEX idx_predictions_timestamp", plan)
+        where, params = _where(None, None, "NO ENFERMO")
+        plan = " ".join(str(row) for row in conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT estado, timestamp FROM predictions{where} ORDER BY timestamp DESC LIMIT ?",
+            params + [5],
+        ))
+        self.assertIn("SEARCH predictions USING COVERING INDEX idx_predictions_estado", plan)
+
+    def test_inputs_round_trip_and_old_schema(self):
+        """Input features are stored, and a database created before they existed gets the columns."""
+        path = os.path.join(self.tmpdir.name, "antigua.sqlite3")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE predictions (id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, estado TEXT NOT NULL)")
+        conn.execute("INSERT INTO predictions (timestamp, estado) VALUES ('2025-01-01T00:00:00+00:00', 'NO ENFERMO')")
+        conn.commit()
+        conn.close()
+        store = SQLitePredictionStore(path)
+        try:
+            record = {"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-02T00:00:00+00:00",
+                      "age": 45, "sex": "F", "arterialIndex": 160}
+            store.append(record)
+            self.assertEqual(list(store.iter_records()),
+                             [{"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"}, record])
+        finally:
+            store.close()
+
+    def test_concurrent_threads(self):
+        """Each thread writes through its own connection without losing records."""
+        def write():
+            for i in range(50):
+                self.store.append({"estado": "NO ENFERMO", "timestamp": f"2025-02-01T00:00:{i:02d}+00:00"})
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(list(self.store.iter_records())), 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "model")
+
+
+class TestStartup(unittest.TestCase):
+    def test_serving_path_skips_heavy_imports(self):
+        """Importing the app and serving a prediction does not import pandas or NumPy."""
+        code = (
+            "import json, sys\n"
+            "from fastapi.testclient import TestClient\n"
+            "from prediction import application\n"
+            "with TestClient(application.app) as client:\n"
+            "    client.get('/getprediction', params={'age': 20, 'sex': 'M', 'arterialIndex': 120})\n"
+            "print(json.dumps([name for name in ('pandas', 'numpy') if name in sys.modules]))\n"
+        )
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(os.environ, PREDICTION_DATA_DIR=data_dir)
+            output = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=MODEL_DIR, env=env,
+                                    check=True, capture_output=True, text=True).stdout
+        self.assertEqual(json.loads(output.strip().splitlines()[-1]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
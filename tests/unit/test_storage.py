@@ -0,0 +1,93 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from model.prediction.storage import LOG_FILENAME, PredictionLog, migrate_json_predictions
+
+
+class TestPredictionLog(unittest.TestCase):
+    def setUp(self):
+        """Create a temporary data directory for the log."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+
+    def tearDown(self):
+        """Close the log and remove the data directory."""
+        self.log.close()
+        self.tmpdir.cleanup()
+
+    def test_append_and_iterate(self):
+        """Records are read back in append order."""
+        self.log.append({"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"})
+        self.log.append_many([
+            {"estado": "ENFERMEDAD CRÓNICA", "timestamp": "2025-01-01T00:00:01+00:00"},
+            {"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-01T00:00:02+00:00"},
+        ])
+        estados = [r["estado"] for r in self.log.iter_records()]
+        self.assertEqual(estados, ["NO ENFERMO", "ENFERMEDAD CRÓNICA", "ENFERMEDAD LEVE"])
+
+    def test_missing_log_is_empty(self):
+        """Iterating a log that was never written yields nothing."""
+        self.assertEqual(list(self.log.iter_records()), [])
+
+    def test_torn_line_is_skipped(self):
+        """A partially written trailing line does not break reads."""
+        self.log.append({"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"})
+        with open(self.log.path, "a") as f:
+            f.write('{"estado": "ENFERM')
+        self.assertEqual(len(list(self.log.iter_records())), 1)
+
+    def test_concurrent_appends_are_not_lost(self):
+        """Writers sharing the log never lose or interleave records."""
+        other = PredictionLog(self.log.path)
+
+        def write(log, n):
+            for i in range(n):
+                log.append({"estado": "NO ENFERMO", "timestamp": f"2025-01-01T00:00:{i:02d}+00:00"})
+
+        threads = [threading.Thread(target=write, args=(log, 200)) for log in (self.log, other, self.log, other)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        other.close()
+        self.assertEqual(len(list(self.log.iter_records())), 800)
+
+    def test_migrate_legacy_files(self):
+        """The migrator imports the three JSON arrays in timestamp order and renames them."""
+        legacy = {
+            1: [{"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:02+00:00"}],
+            2: [{"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-01T00:00:01+00:00"}],
+        }
+        for i, predictions in legacy.items():
+            with open(os.path.join(self.tmpdir.name, f"predictions_{i}.json"), "w") as f:
+                json.dump(predictions, f, indent=2)
+
+        self.assertEqual(migrate_json_predictions(self.tmpdir.name, self.log), 2)
+        self.assertEqual([r["estado"] for r in self.log.iter_records()], ["ENFERMEDAD LEVE", "NO ENFERMO"])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, "predictions_1.json.migrated")))
+        self.assertEqual(migrate_json_predictions(self.tmpdir.name, self.log), 0)
+
+    def test_migrate_skips_corrupt_files(self):
+        """A legacy file that does not parse is reported and left in place instead of being marked as migrated."""
+        with open(os.path.join(self.tmpdir.name, "predictions_1.json"), "w") as f:
+            json.dump([{"estado": "NO ENFERMO", "timestamp": "2025-01-01T00:00:00+00:00"}], f)
+        corrupt = os.path.join(self.tmpdir.name, "predictions_2.json")
+        with open(corrupt, "w") as f:
+            f.write('[{"estado": "ENFERMEDAD LEVE", "timestamp": "2025-01-01T00:0')
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.assertEqual(migrate_json_predictions(self.tmpdir.name, self.log), 1)
+        self.assertIn(corrupt, stderr.getvalue())
+        self.assertTrue(os.path.exists(corrupt))
+        self.assertFalse(os.path.exists(corrupt + ".migrated"))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, "predictions_1.json.migrated")))
+
+
+if __name__ == "__main__":
+    unittest.main()
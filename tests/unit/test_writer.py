@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+
+from model.prediction.binary_store import BinaryPredictionStore
+from model.prediction.storage import LOG_FILENAME, PredictionLog
+from model.prediction.writer import WriteBehindQueue, WriteQueueFull
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def setUp(self):
+        """Create a log in a temporary data directory."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log = PredictionLog(os.path.join(self.tmpdir.name, LOG_FILENAME))
+        self.committed = []
+
+    def _commit(self, records):
+        self.log.append_many(records)
+        self.committed.extend(records)
+
+    def tearDown(self):
+        """Close the log and remove the data directory."""
+        self.log.close()
+        self.tmpdir.cleanup()
+
+    def _record(self, i):
+        return {"estado": "NO ENFERMO", "timestamp": f"2025-01-01T00:00:{i % 60:02d}+00:00"}
+
+    def test_durable_ack_waits_for_write(self):
+        """A resolved future means the record is already in the log."""
+        writer = WriteBehindQueue(self.log, commit=self._commit, max_batch=8)
+        writer.start()
+        try:
+            writer.submit(self._record(0)).result(timeout=5)
+            self.assertEqual(len(list(self.log.iter_records())), 1)
+            self.assertEqual(self.committed, [self._record(0)])
+        finally:
+            writer.close()
+
+    def test_close_drains_queue(self):
+        """Records still queued at shutdown are written before close returns."""
+        writer = WriteBehindQueue(self.log, commit=self._commit, max_batch=16, max_delay=0.05, fsync='never')
+        writer.start()
+        futures = [writer.submit(self._record(i)) for i in range(500)]
+        writer.close()
+        self.assertTrue(all(f.done() and f.exception() is None for f in futures))
+        self.assertEqual(len(list(self.log.iter_records())), 500)
+        self.assertEqual(len(self.committed), 500)
+
+    def test_full_queue_rejects(self):
+        """A full queue fails fast instead of blocking forever."""
+        writer = WriteBehindQueue(self.log, commit=self._commit, max_queue=1, put_timeout=0.01)
+        writer.submit(self._record(0))
+        with self.assertRaises(WriteQueueFull):
+            writer.submit(self._record(1))
+
+    def test_submit_many_and_nonblocking_submit(self):
+        """Records submitted together share a batch larger than max_batch, and block=False never waits."""
+        batches = []
+        writer = WriteBehindQueue(self.log, commit=batches.append, max_queue=1, max_batch=2, put_timeout=5)
+        group = writer.submit_many([self._record(i) for i in range(5)])
+        with self.assertRaises(WriteQueueFull):
+            writer.submit(self._record(5), block=False)
+        writer.start()
+        try:
+            group.result(timeout=5)
+            self.assertEqual(batches, [[self._record(i) for i in range(5)]])
+        finally:
+            writer.close()
+
+    def test_write_error_is_reported(self):
+        """Storage errors reach the waiting callers."""
+        def fail(records):
+            raise OSError("disk full")
+
+        writer = WriteBehindQueue(self.log, commit=fail)
+        writer.start()
+        try:
+            with self.assertRaises(OSError):
+                writer.submit(self._record(0)).result(timeout=5)
+        finally:
+            writer.close()
+
+    def test_rejected_record_fails_alone(self):
+        """A record the store cannot hold fails its own submission; the rest of the batch is written."""
+        store = BinaryPredictionStore(os.path.join(self.tmpdir.name, "predictions.bin"))
+        self.addCleanup(store.close)
+        records = [dict(self._record(i), age=20, sex="M", arterialIndex=120) for i in range(20)]
+        records[7]["age"] = 40000
+
+        writer = WriteBehindQueue(store, commit=store.append_many, max_delay=1)
+        # Queued before the thread starts, so they all land in one batch
+        futures = [writer.submit(record) for record in records]
+        writer.start()
+        try:
+            with self.assertRaises(ValueError):
+                futures[7].result(timeout=5)
+            for future in futures[:7] + futures[8:]:
+                future.result(timeout=5)
+        finally:
+            writer.close()
+        self.assertEqual(list(store.iter_records()), records[:7] + records[8:])
+
+
+if __name__ == "__main__":
+    unittest.main()